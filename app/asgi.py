@@ -14,3 +14,8 @@ from django.core.asgi import get_asgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'app.settings')
 
 application = get_asgi_application()
+
+# Open the pooled Gemini connection before the first request (GEMINI_WARMUP_ON_START)
+from app.filesearch.gemini_client import warm_up  # noqa: E402
+
+warm_up()
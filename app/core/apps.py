@@ -1,6 +1,17 @@
 from django.apps import AppConfig
+from django.db.backends.signals import connection_created
 
 
 class CoreConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'app.core'
+
+    def ready(self):
+        from app.core.metrics import record_query
+
+        def install_query_timer(sender, connection, **kwargs):
+            # Charges query time to the request being served (RequestMetricsMiddleware)
+            if record_query not in connection.execute_wrappers:
+                connection.execute_wrappers.append(record_query)
+
+        connection_created.connect(install_query_timer, weak=False, dispatch_uid='core-query-timer')
@@ -0,0 +1,190 @@
+import platform
+import statistics
+import timeit
+from datetime import datetime, timezone
+from types import SimpleNamespace
+
+import django
+from django.contrib.auth import get_user_model
+from rest_framework import status
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.tokens import AccessToken
+
+from app.core.views import CustomPageNumberPagination
+from app.global_constants import SuccessMessage, GlobalValues
+from app.utils import get_response_schema
+from permissions import IsUser, IsSuperAdmin
+
+# Fixed fixtures: benchmarks must not depend on the database or on the time they run
+FIXED_TIME = datetime(2025, 1, 1, tzinfo=timezone.utc)
+PAGE_SIZE = 25
+LIST_SIZE = 100
+
+# {name: setup returning the zero-argument callable to time}
+BENCHMARKS = {}
+
+
+def benchmark(name):
+    def register(setup):
+        BENCHMARKS[name] = setup
+        return setup
+    return register
+
+
+def fixture_user(role_id=GlobalValues.USER.value):
+    from app.role.models import Role
+
+    role = Role(id=role_id, name='SuperAdmin' if role_id == GlobalValues.SUPER_ADMIN.value else 'User',
+                created=FIXED_TIME, updated=FIXED_TIME)
+    return get_user_model()(
+        id=1000 + role_id, email=f"bench-{role_id}@example.com", first_name='Bench', last_name='User',
+        role=role, is_active=True, created=FIXED_TIME, updated=FIXED_TIME,
+    )
+
+
+def fixture_documents(count):
+    from app.filesearch.models import FileSearchStore
+
+    return [
+        FileSearchStore(
+            id=index, user_id=1002, title=f"Document {index}", file=f"uploads/filesearch/document-{index}.pdf",
+            store_name=f"fileSearchStores/bench-{index}", content_hash=f"{index:064x}",
+            status=FileSearchStore.StoreStatus.READY,
+            ingestion_timings={'queue_wait': 0.12, 'create_store': 0.4, 'upload': 1.3, 'remote_processing': 8.2},
+            created=FIXED_TIME, updated=FIXED_TIME,
+        )
+        for index in range(1, count + 1)
+    ]
+
+
+def fixture_request(path='/api/filesearch/stores/list-filter/', user=None, **headers):
+    request = Request(APIRequestFactory().get(path, **headers))
+    request.user = user
+    return request
+
+
+@benchmark('response_schema')
+def bench_response_schema():
+    from app.filesearch.serializers import FileSearchStoreSerializer
+
+    data = FileSearchStoreSerializer(fixture_documents(1)[0]).data
+    return lambda: get_response_schema(data, SuccessMessage.RECORD_RETRIEVED.value, status.HTTP_200_OK)
+
+
+@benchmark('response_render')
+def bench_response_render():
+    from app.filesearch.serializers import FileSearchStoreSerializer
+
+    response = get_response_schema(FileSearchStoreSerializer(fixture_documents(PAGE_SIZE), many=True).data,
+                                   SuccessMessage.RECORD_RETRIEVED.value, status.HTTP_200_OK)
+    renderer = JSONRenderer()
+    return lambda: renderer.render(response.data)
+
+
+@benchmark('file_search_store_serializer')
+def bench_file_search_store_serializer():
+    from app.filesearch.serializers import FileSearchStoreSerializer
+
+    document = fixture_documents(1)[0]
+    return lambda: FileSearchStoreSerializer(document).data
+
+
+@benchmark('file_search_store_serializer_many')
+def bench_file_search_store_serializer_many():
+    from app.filesearch.serializers import FileSearchStoreSerializer
+
+    documents = fixture_documents(PAGE_SIZE)
+    return lambda: FileSearchStoreSerializer(documents, many=True).data
+
+
+@benchmark('user_display_serializer')
+def bench_user_display_serializer():
+    from app.user.serializers import UserDisplaySerializer
+
+    user = fixture_user()
+    return lambda: UserDisplaySerializer(user).data
+
+
+@benchmark('pagination')
+def bench_pagination():
+    from app.filesearch.serializers import FileSearchStoreListDisplaySerializer
+
+    documents = fixture_documents(LIST_SIZE)
+    request = fixture_request(f"/api/filesearch/stores/list-filter/?page=2&size={PAGE_SIZE}")
+
+    def paginate():
+        paginator = CustomPageNumberPagination()
+        page = paginator.paginate_queryset(documents, request)
+        return paginator.get_paginated_response(FileSearchStoreListDisplaySerializer(page, many=True).data)
+    return paginate
+
+
+@benchmark('jwt_decode')
+def bench_jwt_decode():
+    token = str(AccessToken.for_user(fixture_user()))
+    return lambda: AccessToken(token)
+
+
+@benchmark('jwt_authenticate')
+def bench_jwt_authenticate():
+    # Header parsing and token validation; the user lookup is a database query and not measured here
+    authentication = JWTAuthentication()
+    request = fixture_request(HTTP_AUTHORIZATION=f"Bearer {AccessToken.for_user(fixture_user())}")
+    return lambda: authentication.get_validated_token(authentication.get_raw_token(authentication.get_header(request)))
+
+
+@benchmark('permission_is_user')
+def bench_permission_is_user():
+    permission = IsUser()
+    request = SimpleNamespace(user=fixture_user())
+    return lambda: permission.has_permission(request, None)
+
+
+@benchmark('permission_is_super_admin')
+def bench_permission_is_super_admin():
+    permission = IsSuperAdmin()
+    request = SimpleNamespace(user=fixture_user(GlobalValues.SUPER_ADMIN.value))
+    return lambda: permission.has_permission(request, None)
+
+
+def measure(fn, repeat=5, min_time=0.2):
+    """Per-call timings in microseconds: `repeat` rounds of as many calls as fit in `min_time` seconds."""
+
+    timer = timeit.Timer(fn)
+    loops, _ = timer.autorange()
+    loops = max(int(loops * min_time / 0.2), 1)
+    rounds = [total / loops * 1e6 for total in timer.repeat(repeat, loops)]
+    return {
+        'loops': loops,
+        'repeat': repeat,
+        'min_us': round(min(rounds), 3),
+        'median_us': round(statistics.median(rounds), 3),
+        'mean_us': round(statistics.mean(rounds), 3),
+    }
+
+
+def run_benchmarks(names=None, repeat=5, min_time=0.2):
+    return {
+        'environment': {
+            'python': platform.python_version(),
+            'django': django.get_version(),
+            'machine': platform.machine(),
+            'platform': platform.platform(),
+        },
+        'benchmarks': {name: measure(BENCHMARKS[name](), repeat, min_time) for name in names or BENCHMARKS},
+    }
+
+
+def compare(report, baseline, tolerance):
+    """Benchmarks whose best time is more than `tolerance` slower than in `baseline`."""
+
+    regressions = []
+    for name, current in report['benchmarks'].items():
+        base = baseline.get('benchmarks', {}).get(name)
+        if base is not None and current['min_us'] > base['min_us'] * (1 + tolerance):
+            regressions.append(f"{name}: {current['min_us']}us vs {base['min_us']}us "
+                               f"({(current['min_us'] / base['min_us'] - 1) * 100:+.0f}%)")
+    return regressions
@@ -0,0 +1,328 @@
+import http.client
+import json
+import logging
+import math
+import random
+import threading
+import time
+import uuid
+from collections import defaultdict
+from urllib.parse import urlsplit
+
+from django.contrib.auth import get_user_model
+from django.core.files.base import ContentFile
+from django.utils import timezone
+
+from app.global_constants import GlobalValues
+
+logger = logging.getLogger(__name__)
+
+# Questions a query storm picks from: repeats exercise the answer cache like real traffic does
+QUESTIONS = [
+    "Summarize the document.",
+    "What are the key points?",
+    "Which topics does the document cover?",
+    "List the definitions given in the document.",
+    "What conclusions does the author draw?",
+    "Give three exam questions based on the document.",
+    "Explain the main argument in simple terms.",
+    "What examples are used?",
+]
+
+# Weight of each action in a traffic mix
+MIXES = {
+    'login_burst': {'login': 1},
+    'list_pagination': {'list': 1},
+    'detail_polling': {'detail': 1},
+    'uploads': {'upload': 1, 'detail': 2},
+    'query_storm': {'query': 1},
+    'mixed': {'login': 1, 'list': 4, 'detail': 6, 'upload': 1, 'query': 4},
+}
+
+LOGIN_PATH = '/api/user/login/'
+LIST_PATH = '/api/filesearch/stores/list-filter/'
+DETAIL_PATH = '/api/filesearch/stores/{id}/'
+UPLOAD_PATH = '/api/filesearch/upload/'
+QUERY_PATH = '/api/filesearch/query/'
+
+
+def sample_pdf(text):
+    """A one-page PDF showing `text`, so uploads and seeded documents go through real extraction."""
+
+    escaped = text.replace('\\', '\\\\').replace('(', '\\(').replace(')', '\\)').encode('latin-1', 'replace')
+    content = b"BT /F1 12 Tf 72 720 Td (" + escaped + b") Tj ET"
+    objects = [
+        b"<< /Type /Catalog /Pages 2 0 R >>",
+        b"<< /Type /Pages /Kids [3 0 R] /Count 1 >>",
+        b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] /Contents 4 0 R "
+        b"/Resources << /Font << /F1 5 0 R >> >> >>",
+        b"<< /Length %d >>\nstream\n" % len(content) + content + b"\nendstream",
+        b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>",
+    ]
+    pdf = b"%PDF-1.4\n"
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(len(pdf))
+        pdf += b"%d 0 obj\n" % number + body + b"\nendobj\n"
+    xref = len(pdf)
+    pdf += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    pdf += b"".join(b"%010d 00000 n \n" % offset for offset in offsets)
+    pdf += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref)
+    return pdf
+
+
+def seed_accounts(count, documents, password, prefix='loadtest'):
+    """
+    Create (or reuse) `count` users with `documents` READY documents each, ingested through the
+    configured FILESEARCH_BACKEND. Returns [(email, [document ids])].
+    """
+
+    from app.filesearch.gemini_client import get_client
+    from app.filesearch.models import FileSearchStore
+    from app.filesearch.processing import compute_file_hash, remote_document_name
+
+    User = get_user_model()
+    client = get_client()
+    accounts = []
+    for index in range(count):
+        email = f"{prefix}-{index}@example.com"
+        user = User.objects.filter(email=email).first()
+        if user is None:
+            user = User.objects.create_user(email, password, first_name='Load', last_name=f'Test {index}',
+                                            role_id=GlobalValues.USER.value)
+        elif not user.check_password(password):
+            user.set_password(password)
+            user.save(update_fields=['password'])
+
+        ready = list(FileSearchStore.objects.filter(
+            user=user, is_active=True, status=FileSearchStore.StoreStatus.READY,
+        ).values_list('id', flat=True)[:documents])
+        for _ in range(documents - len(ready)):
+            pdf = sample_pdf(f"Load test document {uuid.uuid4().hex} for {email}.")
+            store = FileSearchStore(user=user, title=f"Load test {len(ready) + 1}")
+            store.file.save(f"{prefix}-{uuid.uuid4().hex}.pdf", ContentFile(pdf), save=False)
+            with store.file.open('rb') as file:
+                store.content_hash = compute_file_hash(file)
+            store.store_name = client.create_store().name
+            operation = client.upload_file_to_store(store.store_name, store.file.path, display_name=store.title,
+                                                    metadata={'content_hash': store.content_hash})
+            while not operation.done:
+                time.sleep(1)
+                operation = client.get_operation(operation.name)
+            store.remote_document_name = remote_document_name(operation)
+            store.status = FileSearchStore.StoreStatus.READY
+            store.save()
+            ready.append(store.id)
+        accounts.append((email, ready))
+    return accounts
+
+
+def percentile(values, quantile):
+    """Nearest-rank percentile of sorted `values`."""
+
+    if not values:
+        return None
+    return values[max(math.ceil(quantile * len(values)) - 1, 0)]
+
+
+class Results:
+    """Latency and status of every request, per endpoint (named like its URL pattern)."""
+
+    def __init__(self):
+        self.latencies = defaultdict(list)
+        self.errors = defaultdict(int)
+        self.throttled = defaultdict(int)
+        self.statuses = defaultdict(lambda: defaultdict(int))
+        self._lock = threading.Lock()
+
+    def record(self, endpoint, seconds, status_code):
+        with self._lock:
+            self.latencies[endpoint].append(seconds)
+            self.statuses[endpoint][status_code] += 1
+            if status_code == 429:
+                self.throttled[endpoint] += 1
+            elif status_code is None or status_code >= 400:
+                self.errors[endpoint] += 1
+
+    def summary(self, duration):
+        report = {}
+        for endpoint, latencies in sorted(self.latencies.items()):
+            latencies = sorted(latencies)
+            report[endpoint] = {
+                'requests': len(latencies),
+                'rps': round(len(latencies) / duration, 2),
+                'errors': self.errors[endpoint],
+                'throttled': self.throttled[endpoint],
+                'error_rate': round(self.errors[endpoint] / len(latencies), 4),
+                'p50_ms': round(percentile(latencies, 0.5) * 1000, 1),
+                'p95_ms': round(percentile(latencies, 0.95) * 1000, 1),
+                'p99_ms': round(percentile(latencies, 0.99) * 1000, 1),
+                'max_ms': round(latencies[-1] * 1000, 1),
+                'statuses': {str(code): count for code, count in sorted(self.statuses[endpoint].items(),
+                                                                        key=lambda item: str(item[0]))},
+            }
+        return report
+
+
+class VirtualUser:
+    """One client: a keep-alive connection, a JWT and the documents it owns."""
+
+    def __init__(self, load_test, email, document_ids):
+        self.load_test = load_test
+        self.email = email
+        self.document_ids = list(document_ids)
+        self.polling = []
+        self.page = 1
+        self.token = None
+        url = urlsplit(load_test.base_url)
+        connection_class = http.client.HTTPSConnection if url.scheme == 'https' else http.client.HTTPConnection
+        self.connection = connection_class(url.hostname, url.port, timeout=load_test.timeout)
+
+    def request(self, endpoint, method, path, body=None, content_type='application/json'):
+        headers = {}
+        if self.token:
+            headers['Authorization'] = f"Bearer {self.token}"
+        if body is not None:
+            headers['Content-Type'] = content_type
+            if content_type == 'application/json':
+                body = json.dumps(body)
+
+        started = time.perf_counter()
+        try:
+            self.connection.request(method, path, body=body, headers=headers)
+            response = self.connection.getresponse()
+            payload = response.read()
+            status_code = response.status
+        except (OSError, http.client.HTTPException) as exc:
+            # Counted as an error; the next request reconnects
+            logger.debug("%s %s failed: %s", method, path, exc)
+            self.connection.close()
+            self.load_test.results.record(endpoint, time.perf_counter() - started, None)
+            return None, {}
+        self.load_test.results.record(endpoint, time.perf_counter() - started, status_code)
+
+        try:
+            data = json.loads(payload) if payload else {}
+        except ValueError:
+            data = {}
+        return status_code, data if isinstance(data, dict) else {}
+
+    # --- actions -------------------------------------------------------------
+
+    def login(self):
+        status_code, data = self.request('user-login', 'POST', LOGIN_PATH, {
+            'email': self.email, 'password': self.load_test.password,
+        })
+        if status_code == 200:
+            self.token = data['results'].get('access')
+
+    def list(self):
+        status_code, data = self.request(
+            'filesearch-list', 'GET', f"{LIST_PATH}?page={self.page}&size={self.load_test.page_size}",
+        )
+        # Walk the pages, then start over
+        self.page = self.page + 1 if status_code == 200 and data.get('next') else 1
+
+    def detail(self):
+        # Documents just uploaded are polled until ready, like the frontend does
+        document_id = self.polling[0] if self.polling else random.choice(self.document_ids or [0])
+        status_code, data = self.request('filesearch-detail', 'GET', DETAIL_PATH.format(id=document_id))
+        if self.polling and (status_code != 200 or data['results'].get('status') in ('READY', 'FAILED')):
+            self.polling.pop(0)
+
+    def upload(self):
+        boundary = uuid.uuid4().hex
+        pdf = sample_pdf(f"Load test upload {uuid.uuid4().hex}.")
+        body = (
+            f"--{boundary}\r\nContent-Disposition: form-data; name=\"title\"\r\n\r\nLoad test upload\r\n"
+            f"--{boundary}\r\nContent-Disposition: form-data; name=\"file\"; filename=\"loadtest.pdf\"\r\n"
+            f"Content-Type: application/pdf\r\n\r\n"
+        ).encode() + pdf + f"\r\n--{boundary}--\r\n".encode()
+        status_code, data = self.request('filesearch-upload', 'POST', UPLOAD_PATH, body,
+                                         content_type=f"multipart/form-data; boundary={boundary}")
+        if status_code in (201, 202):
+            self.polling.append(data['results']['id'])
+
+    def query(self):
+        if random.random() < self.load_test.unique_query_rate:
+            question = f"{random.choice(QUESTIONS)} ({uuid.uuid4().hex[:8]})"
+        else:
+            question = random.choice(QUESTIONS)
+        self.request('filesearch-query', 'POST', QUERY_PATH, {
+            'query': question, 'document_id': random.choice(self.document_ids or [0]),
+        })
+
+    def run(self, start_at, stop_at):
+        time.sleep(max(start_at - time.monotonic(), 0))
+        self.login()
+        actions, weights = zip(*self.load_test.mix.items())
+        while time.monotonic() < stop_at:
+            getattr(self, random.choices(actions, weights)[0])()
+            if self.load_test.think_time:
+                time.sleep(random.expovariate(1 / self.load_test.think_time))
+        self.connection.close()
+
+
+class LoadTest:
+    """
+    Closed-loop load test: `users` virtual users, started over `ramp_up` seconds, each repeatedly
+    picking an action from `mix` (weights) until `duration` seconds have passed.
+    """
+
+    def __init__(self, base_url, accounts, password, mix, users, duration, ramp_up=0.0, think_time=0.0,
+                 page_size=10, unique_query_rate=0.3, timeout=60):
+        self.base_url = base_url
+        self.accounts = accounts
+        self.password = password
+        self.mix = mix
+        self.users = users
+        self.duration = duration
+        self.ramp_up = ramp_up
+        self.think_time = think_time
+        self.page_size = page_size
+        self.unique_query_rate = unique_query_rate
+        self.timeout = timeout
+        self.results = Results()
+
+    def run(self):
+        started = time.monotonic()
+        stop_at = started + self.duration
+        threads = []
+        for index in range(self.users):
+            email, document_ids = self.accounts[index % len(self.accounts)]
+            user = VirtualUser(self, email, document_ids)
+            start_at = started + self.ramp_up * index / max(self.users, 1)
+            thread = threading.Thread(target=user.run, args=(start_at, stop_at), daemon=True,
+                                      name=f"loadtest-{index}")
+            thread.start()
+            threads.append(thread)
+        for thread in threads:
+            thread.join()
+
+        elapsed = time.monotonic() - started
+        return {
+            'base_url': self.base_url,
+            'mix': self.mix,
+            'users': self.users,
+            'duration': round(elapsed, 2),
+            'finished': timezone.now().isoformat(),
+            'endpoints': self.results.summary(elapsed),
+        }
+
+
+def compare(report, baseline, tolerance, error_tolerance=0.01):
+    """Regressions of `report` against `baseline`: p95 latency or throughput worse than `tolerance`, more errors."""
+
+    regressions = []
+    for endpoint, base in baseline.get('endpoints', {}).items():
+        current = report['endpoints'].get(endpoint)
+        if current is None:
+            regressions.append(f"{endpoint}: no requests (baseline had {base['requests']})")
+            continue
+        if current['p95_ms'] > base['p95_ms'] * (1 + tolerance):
+            regressions.append(f"{endpoint}: p95 {current['p95_ms']}ms vs {base['p95_ms']}ms")
+        if current['rps'] < base['rps'] * (1 - tolerance):
+            regressions.append(f"{endpoint}: {current['rps']} rps vs {base['rps']} rps")
+        if current['error_rate'] > base['error_rate'] + error_tolerance:
+            regressions.append(f"{endpoint}: error rate {current['error_rate']} vs {base['error_rate']}")
+    return regressions
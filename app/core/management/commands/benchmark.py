@@ -0,0 +1,53 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from app.core.benchmarks import BENCHMARKS, compare, run_benchmarks
+
+
+class Command(BaseCommand):
+    help = ('Microbenchmark the response hot paths (response envelope, serializers, pagination, JWT, permissions) '
+            'on fixed fixtures and compare them with a stored baseline. No database access.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('names', nargs='*', help=f"Benchmarks to run (default: all of {', '.join(BENCHMARKS)})")
+        parser.add_argument('--repeat', type=int, default=5, help='Timing rounds per benchmark')
+        parser.add_argument('--min-time', type=float, default=0.2, help='Seconds per timing round')
+        parser.add_argument('--output', help='Write the results as JSON to this file')
+        parser.add_argument('--baseline', help='Compare with the results stored in this JSON file')
+        parser.add_argument('--save-baseline', action='store_true',
+                            help='Write the results to --baseline instead of comparing')
+        parser.add_argument('--tolerance', type=float, default=0.2,
+                            help='Allowed slowdown of the best time vs the baseline (0.2 = 20%%)')
+
+    def handle(self, *args, **options):
+        if options['save_baseline'] and not options['baseline']:
+            raise CommandError('--save-baseline needs --baseline')
+        unknown = set(options['names']) - set(BENCHMARKS)
+        if unknown:
+            raise CommandError(f"Unknown benchmarks: {', '.join(sorted(unknown))}")
+
+        report = run_benchmarks(options['names'], options['repeat'], options['min_time'])
+        self.stdout.write(f"{'benchmark':<36}{'min_us':>12}{'median_us':>12}{'loops':>10}")
+        for name, row in report['benchmarks'].items():
+            self.stdout.write(f"{name:<36}{row['min_us']:>12}{row['median_us']:>12}{row['loops']:>10}")
+
+        if options['output']:
+            self.write(options['output'], report)
+        if options['save_baseline']:
+            self.write(options['baseline'], report)
+            self.stdout.write(self.style.SUCCESS(f"Baseline saved to {options['baseline']}"))
+        elif options['baseline']:
+            with open(options['baseline'], encoding='utf-8') as file:
+                baseline = json.load(file)
+            if baseline.get('environment') != report['environment']:
+                self.stdout.write(self.style.WARNING('Baseline was recorded in a different environment'))
+            regressions = compare(report, baseline, options['tolerance'])
+            if regressions:
+                raise CommandError('Slower than the baseline:\n  ' + '\n  '.join(regressions))
+            self.stdout.write(self.style.SUCCESS('No regressions against the baseline'))
+
+    @staticmethod
+    def write(path, report):
+        with open(path, 'w', encoding='utf-8') as file:
+            json.dump(report, file, indent=2)
@@ -0,0 +1,103 @@
+import random
+from datetime import timedelta
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.utils import timezone
+
+from app.filesearch.models import FileSearchStore
+from app.global_constants import GlobalValues
+
+SEED_BATCH_SIZE = 10000
+TITLE_WORDS = ['Algebra', 'Biology', 'Chemistry', 'Databases', 'Economics', 'Finance', 'Geometry', 'History',
+               'Networks', 'Physics', 'Statistics', 'Zoology']
+
+
+class Command(BaseCommand):
+    help = ('Print the query plans of the hot user and filesearch queries (document list, query targets, operation '
+            'poller, login, user list). Optionally seed synthetic rows first, to compare plans before and after '
+            'an index migration on a realistic table size.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--seed-users', type=int, default=0, help='Synthetic users to create first')
+        parser.add_argument('--documents-per-user', type=int, default=20, help='Synthetic documents per seeded user')
+        parser.add_argument('--analyze', action='store_true', help='EXPLAIN ANALYZE (runs the queries)')
+
+    def handle(self, *args, **options):
+        if options['seed_users']:
+            self.seed(options['seed_users'], options['documents_per_user'])
+
+        User = get_user_model()
+        user = User.objects.filter(role_id=GlobalValues.USER.value, is_active=True).order_by('id').first()
+        if user is None:
+            self.stdout.write(self.style.WARNING('No active user to explain the queries for; use --seed-users'))
+            return
+
+        documents = FileSearchStore.objects.filter(user_id=user.id, is_active=True)
+        document_id = documents.values_list('id', flat=True).first() or 0
+        ready = documents.filter(status=FileSearchStore.StoreStatus.READY)
+        users = User.objects.filter(role_id=GlobalValues.USER.value).order_by('-updated')
+        queries = {
+            'document list': documents.order_by('-created')[:10],
+            'document list, title filter': documents.filter(title__istartswith='Bio').order_by('-created')[:10],
+            'document detail': documents.filter(id=document_id).order_by('-created')[:1],
+            'latest ready document': ready.order_by('-created')[:1],
+            'query documents': ready.filter(store_name__isnull=False).exclude(store_name='').order_by('-created'),
+            'operation poller': FileSearchStore.objects.filter(
+                status=FileSearchStore.StoreStatus.PROCESSING, operation_name__isnull=False,
+                next_poll_at__lte=timezone.now(),
+            ).order_by('next_poll_at')[:100],
+            'login': User.objects.filter(email=user.email, is_active=True)[:1],
+            'user list': users[:10],
+            'user list, email filter': users.filter(email__istartswith=user.email[:4])[:10],
+            'user list, name filter': users.filter(first_name__istartswith='Load')[:10],
+        }
+        for label, queryset in queries.items():
+            self.stdout.write(self.style.MIGRATE_HEADING(label))
+            self.stdout.write(queryset.explain(analyze=options['analyze']) if connection.vendor == 'postgresql'
+                              else queryset.explain())
+            self.stdout.write('')
+
+    def seed(self, user_count, documents_per_user):
+        User = get_user_model()
+        now = timezone.now()
+        first = User.objects.count()
+        self.stdout.write(f"Seeding {user_count} users with {documents_per_user} documents each...")
+
+        for start in range(0, user_count, SEED_BATCH_SIZE):
+            User.objects.bulk_create([
+                # '!' marks an unusable password: seeded users can't log in
+                User(email=f"seed-{first + index}@example.com", password='!',
+                     first_name=random.choice(['Ada', 'Alan', 'Grace', 'Linus', 'Load']),
+                     last_name=f"Seed {first + index}", role_id=GlobalValues.USER.value,
+                     is_active=random.random() < 0.9)
+                for index in range(start, min(start + SEED_BATCH_SIZE, user_count))
+            ])
+
+        user_ids = list(User.objects.filter(email__startswith='seed-').order_by('-id')
+                        .values_list('id', flat=True)[:user_count])
+        statuses = [FileSearchStore.StoreStatus.READY] * 8 + [FileSearchStore.StoreStatus.FAILED,
+                                                              FileSearchStore.StoreStatus.PROCESSING]
+        batch = []
+        for user_id in user_ids:
+            for index in range(documents_per_user):
+                status = random.choice(statuses)
+                batch.append(FileSearchStore(
+                    user_id=user_id, title=f"{random.choice(TITLE_WORDS)} notes {index}",
+                    file=f"uploads/filesearch/seed-{user_id}-{index}.pdf",
+                    store_name=f"fileSearchStores/seed-{user_id}-{index}", status=status,
+                    operation_name=f"operations/seed-{user_id}-{index}" if status == 'PROCESSING' else None,
+                    next_poll_at=now + timedelta(seconds=random.randint(0, 600)) if status == 'PROCESSING' else None,
+                    is_active=random.random() < 0.95,
+                ))
+                if len(batch) >= SEED_BATCH_SIZE:
+                    FileSearchStore.objects.bulk_create(batch)
+                    batch = []
+        FileSearchStore.objects.bulk_create(batch)
+
+        if connection.vendor == 'postgresql':
+            # Fresh statistics, or the planner still assumes the tables are empty
+            with connection.cursor() as cursor:
+                cursor.execute(f"ANALYZE {User._meta.db_table}, {FileSearchStore._meta.db_table}")
+        self.stdout.write(self.style.SUCCESS('Seeded'))
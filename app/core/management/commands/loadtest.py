@@ -0,0 +1,79 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from app.core.loadtest import MIXES, LoadTest, compare, seed_accounts
+
+
+class Command(BaseCommand):
+    help = ('Run a load test against a running server (e.g. with FILESEARCH_BACKEND set to the fake backend) and '
+            'compare it with a stored baseline. Run it with the same settings as the server: it seeds accounts '
+            'in that database.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--base-url', default='http://127.0.0.1:8000', help='Server to load')
+        parser.add_argument('--mix', choices=sorted(MIXES), default='mixed', help='Traffic mix')
+        parser.add_argument('--users', type=int, default=20, help='Concurrent virtual users')
+        parser.add_argument('--duration', type=float, default=60, help='Seconds to run')
+        parser.add_argument('--ramp-up', type=float, default=5,
+                            help='Seconds over which virtual users start (0: all at once, e.g. a login burst)')
+        parser.add_argument('--think-time', type=float, default=0,
+                            help='Mean seconds a virtual user waits between requests (0: closed loop)')
+        parser.add_argument('--accounts', type=int, default=None,
+                            help='Accounts to seed and share among virtual users (defaults to --users)')
+        parser.add_argument('--documents', type=int, default=3, help='READY documents seeded per account')
+        parser.add_argument('--password', default='LoadTest-123', help='Password of the seeded accounts')
+        parser.add_argument('--output', help='Write the results as JSON to this file')
+        parser.add_argument('--baseline', help='Compare with the results stored in this JSON file')
+        parser.add_argument('--save-baseline', action='store_true',
+                            help='Write the results to --baseline instead of comparing')
+        parser.add_argument('--tolerance', type=float, default=0.2,
+                            help='Allowed p95 latency increase / throughput decrease vs the baseline (0.2 = 20%%)')
+
+    def handle(self, *args, **options):
+        if options['save_baseline'] and not options['baseline']:
+            raise CommandError('--save-baseline needs --baseline')
+
+        accounts = seed_accounts(options['accounts'] or options['users'], options['documents'],
+                                 options['password'])
+        load_test = LoadTest(
+            base_url=options['base_url'].rstrip('/'),
+            accounts=accounts,
+            password=options['password'],
+            mix=MIXES[options['mix']],
+            users=options['users'],
+            duration=options['duration'],
+            ramp_up=options['ramp_up'],
+            think_time=options['think_time'],
+        )
+        self.stdout.write(f"Running '{options['mix']}' with {options['users']} users for {options['duration']}s "
+                          f"against {load_test.base_url}")
+        report = load_test.run()
+        report['scenario'] = options['mix']
+        self.print_report(report)
+
+        if options['output']:
+            self.write(options['output'], report)
+        if options['save_baseline']:
+            self.write(options['baseline'], report)
+            self.stdout.write(self.style.SUCCESS(f"Baseline saved to {options['baseline']}"))
+        elif options['baseline']:
+            with open(options['baseline'], encoding='utf-8') as file:
+                baseline = json.load(file)
+            if baseline.get('scenario') != report['scenario'] or baseline.get('users') != report['users']:
+                self.stdout.write(self.style.WARNING('Baseline was recorded with a different mix or user count'))
+            regressions = compare(report, baseline, options['tolerance'])
+            if regressions:
+                raise CommandError('Regressions against the baseline:\n  ' + '\n  '.join(regressions))
+            self.stdout.write(self.style.SUCCESS('No regressions against the baseline'))
+
+    def print_report(self, report):
+        columns = ('requests', 'rps', 'error_rate', 'throttled', 'p50_ms', 'p95_ms', 'p99_ms', 'max_ms')
+        self.stdout.write(f"{'endpoint':<20}" + ''.join(f"{column:>12}" for column in columns))
+        for endpoint, row in report['endpoints'].items():
+            self.stdout.write(f"{endpoint:<20}" + ''.join(f"{row[column]:>12}" for column in columns))
+
+    @staticmethod
+    def write(path, report):
+        with open(path, 'w', encoding='utf-8') as file:
+            json.dump(report, file, indent=2)
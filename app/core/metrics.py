@@ -0,0 +1,455 @@
+import atexit
+import fcntl
+import json
+import logging
+import math
+import os
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from pathlib import Path
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+# Seconds; chosen to cover both sub-millisecond ORM lookups and multi-minute remote processing
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100, 200, 500)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216)
+
+INGESTION_STAGE_METRIC = 'filesearch_ingestion_stage_seconds'
+QUERY_STAGE_METRIC = 'filesearch_query_stage_seconds'
+
+# Per-request measures recorded by RequestMetricsMiddleware: {measure: (metric name, buckets)}
+REQUEST_MEASURES = {
+    'wall_seconds': ('http_request_duration_seconds', DEFAULT_BUCKETS),
+    'db_seconds': ('http_request_db_seconds', DEFAULT_BUCKETS),
+    'db_queries': ('http_request_db_queries', QUERY_COUNT_BUCKETS),
+    'external_seconds': ('http_request_external_seconds', DEFAULT_BUCKETS),
+    'response_bytes': ('http_response_size_bytes', SIZE_BUCKETS),
+}
+
+HELP = {
+    INGESTION_STAGE_METRIC: 'Time spent per ingestion stage.',
+    QUERY_STAGE_METRIC: 'Time spent per query stage.',
+    'http_request_duration_seconds': 'Wall time per request (streamed responses: until the last chunk).',
+    'http_request_db_seconds': 'Time spent in database queries per request.',
+    'http_request_db_queries': 'Database queries per request.',
+    'http_request_external_seconds': 'Time spent waiting on Gemini per request.',
+    'http_response_size_bytes': 'Response body size.',
+}
+
+METRIC_BUCKETS = {name: buckets for name, buckets in REQUEST_MEASURES.values()}
+
+DEAD_FILE = 'dead.json'
+
+
+class MetricsRegistry:
+    """
+    Fixed-bucket histograms of one process.
+
+    Every process writes its totals to METRICS_DIR/<pid>.json at most every `flush_interval`
+    seconds (and at exit), and /metrics merges every file in the directory, so whichever worker
+    gets scraped reports the whole host. A new process that reuses the pid of a dead one first
+    folds the old totals into dead.json, so counters never go backwards.
+
+    `windows` (a SlidingWindows) is flushed along with the totals. Observations never write files
+    themselves: they run on request threads and event loops, so a due flush is handed to a
+    background thread.
+    """
+
+    def __init__(self, directory, flush_interval, buckets=DEFAULT_BUCKETS, windows=None):
+        self.directory = Path(directory)
+        self.flush_interval = flush_interval
+        self.buckets = tuple(buckets)
+        self.windows = windows
+        self.path = self.directory / f"{os.getpid()}.json"
+        # {name: {labels json: [bucket counts..., +Inf count, sum]}}
+        self._series = {}
+        self._lock = threading.Lock()
+        self._flushed = 0.0
+        self._adopted = False
+        self._flush_due = threading.Event()
+        self._flusher = None
+
+    def buckets_for(self, name):
+        return METRIC_BUCKETS.get(name, self.buckets)
+
+    def observe(self, name, value, **labels):
+        self.observe_many({name: value}, **labels)
+
+    def observe_many(self, values, **labels):
+        """Observe {metric name: value} with the same labels, under one lock."""
+
+        key = json.dumps(labels, sort_keys=True)
+        with self._lock:
+            for name, value in values.items():
+                buckets = self.buckets_for(name)
+                series = self._series.setdefault(name, {}).setdefault(key, [0] * (len(buckets) + 2))
+                series[bucket_index(buckets, value)] += 1
+                series[-1] += value
+        if time.monotonic() - self._flushed >= self.flush_interval:
+            self._flush_soon()
+
+    def _flush_soon(self):
+        if self._flusher is None:
+            with self._lock:
+                if self._flusher is None:
+                    self._flusher = threading.Thread(target=self._flush_loop, daemon=True, name='metrics-flush')
+                    self._flusher.start()
+        self._flush_due.set()
+
+    def _flush_loop(self):
+        while True:
+            self._flush_due.wait()
+            self._flush_due.clear()
+            self.flush()
+
+    # --- shared directory ------------------------------------------------------
+
+    @contextmanager
+    def _directory_lock(self):
+        self.directory.mkdir(parents=True, exist_ok=True)
+        with open(self.directory / '.lock', 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _adopt_stale_file(self):
+        # Totals left under our pid by a dead process belong to the dead pool
+        if self.path.exists():
+            dead_path = self.directory / DEAD_FILE
+            dead = merge(read_series(dead_path), read_series(self.path))
+            write_series(dead_path, dead)
+            self.path.unlink()
+        self._adopted = True
+
+    def flush(self):
+        with self._lock:
+            snapshot = json.loads(json.dumps(self._series))
+            self._flushed = time.monotonic()
+        try:
+            with self._directory_lock():
+                if not self._adopted:
+                    self._adopt_stale_file()
+                write_series(self.path, snapshot)
+        except OSError:
+            logger.exception("Failed to write metrics to %s", self.path)
+        if self.windows is not None:
+            self.windows.flush()
+
+    def collect(self):
+        """Totals of every process that wrote to the directory, this one included."""
+
+        self.flush()
+        totals = {}
+        with self._directory_lock():
+            for path in self.directory.glob('*.json'):
+                totals = merge(totals, read_series(path))
+        return totals
+
+    def render(self):
+        """Prometheus text exposition format (version 0.0.4)."""
+
+        lines = []
+        for name, series in sorted(self.collect().items()):
+            lines.append(f"# HELP {name} {HELP.get(name, name)}")
+            lines.append(f"# TYPE {name} histogram")
+            buckets = self.buckets_for(name)
+            for key, values in sorted(series.items()):
+                labels = json.loads(key)
+                cumulative = 0
+                for bound, count in zip(buckets + (math.inf,), values[:-1]):
+                    cumulative += count
+                    le = '+Inf' if bound == math.inf else repr(float(bound))
+                    lines.append(f"{name}_bucket{format_labels({**labels, 'le': le})} {cumulative}")
+                lines.append(f"{name}_sum{format_labels(labels)} {values[-1]!r}")
+                lines.append(f"{name}_count{format_labels(labels)} {cumulative}")
+        return '\n'.join(lines) + '\n'
+
+
+class SlidingWindows:
+    """
+    Histograms per (view, measure) over the last few minutes, kept in `slot_seconds` slots so any
+    window (rounded up to whole slots) can be summed from them.
+
+    Like MetricsRegistry, each process writes its recent slots to <directory>/<pid>.json and
+    `percentiles` merges every file; files of dead processes age out after the longest window.
+    """
+
+    def __init__(self, directory, slot_seconds, windows):
+        self.directory = Path(directory)
+        self.slot_seconds = slot_seconds
+        self.windows = tuple(sorted(windows))
+        self.path = self.directory / f"{os.getpid()}.json"
+        # {slot: {view: {measure: [bucket counts..., +Inf count, sum]}}}
+        self._slots = {}
+        self._lock = threading.Lock()
+
+    def horizon(self, now):
+        """First slot still inside the longest window."""
+
+        return int((now - self.windows[-1]) // self.slot_seconds)
+
+    def observe(self, view, values):
+        slot = int(time.time() // self.slot_seconds)
+        with self._lock:
+            views = self._slots.setdefault(slot, {}).setdefault(view, {})
+            for measure, value in values.items():
+                buckets = REQUEST_MEASURES[measure][1]
+                counts = views.setdefault(measure, [0] * (len(buckets) + 2))
+                counts[bucket_index(buckets, value)] += 1
+                counts[-1] += value
+
+    def flush(self):
+        horizon = self.horizon(time.time())
+        with self._lock:
+            for slot in [slot for slot in self._slots if slot < horizon]:
+                del self._slots[slot]
+            snapshot = json.loads(json.dumps(self._slots))
+        try:
+            self.directory.mkdir(parents=True, exist_ok=True)
+            write_series(self.path, snapshot)
+        except OSError:
+            logger.exception("Failed to write metrics to %s", self.path)
+
+    def collect(self):
+        """{slot: {view: {measure: counts}}} of every process, for the slots inside the longest window."""
+
+        self.flush()
+        now = time.time()
+        horizon = self.horizon(now)
+        slots = {}
+        for path in self.directory.glob('*.json'):
+            try:
+                if path.stat().st_mtime < now - self.windows[-1] - self.slot_seconds:
+                    # Nothing in there is recent enough any more (the process is gone)
+                    path.unlink()
+                    continue
+            except OSError:
+                continue
+            for slot, views in read_series(path).items():
+                if int(slot) >= horizon:
+                    slots[int(slot)] = merge(slots.get(int(slot), {}), views)
+        return slots
+
+    def percentiles(self, quantiles=(0.5, 0.95, 0.99)):
+        """
+        {view: {window seconds: {'requests': n, measure: {'p50': ..., ...}}}}, estimated from the
+        buckets by linear interpolation (as Prometheus' histogram_quantile does).
+        """
+
+        slots = self.collect()
+        current = int(time.time() // self.slot_seconds)
+        report = {}
+        for window in self.windows:
+            first = current - math.ceil(window / self.slot_seconds) + 1
+            totals = {}
+            for slot, views in slots.items():
+                if slot >= first:
+                    totals = merge(totals, views)
+            for view, measures in sorted(totals.items()):
+                entry = {'requests': sum(measures['wall_seconds'][:-1]) if 'wall_seconds' in measures else 0}
+                for measure, counts in measures.items():
+                    buckets = REQUEST_MEASURES[measure][1]
+                    entry[measure] = {
+                        f"p{round(q * 100)}": bucket_quantile(buckets, counts, q) for q in quantiles
+                    }
+                report.setdefault(view, {})[window] = entry
+        return report
+
+
+def bucket_index(buckets, value):
+    return next((i for i, bound in enumerate(buckets) if value <= bound), len(buckets))
+
+
+def bucket_quantile(buckets, counts, quantile):
+    """Estimate a quantile from [bucket counts..., +Inf count, sum]; None without observations."""
+
+    total = sum(counts[:-1])
+    if not total:
+        return None
+    rank = quantile * total
+    cumulative = 0
+    for index, count in enumerate(counts[:-1]):
+        if count and cumulative + count >= rank:
+            if index == len(buckets):
+                # Above the last bound: that bound is the best estimate there is
+                return buckets[-1]
+            lower = buckets[index - 1] if index > 0 else 0
+            return round(lower + (buckets[index] - lower) * (rank - cumulative) / count, 6)
+        cumulative += count
+    return buckets[-1]
+
+
+def read_series(path):
+    try:
+        return json.loads(Path(path).read_text(encoding='utf-8'))
+    except (OSError, ValueError):
+        return {}
+
+
+def write_series(path, series):
+    tmp_path = Path(f"{path}.tmp")
+    tmp_path.write_text(json.dumps(series), encoding='utf-8')
+    os.replace(tmp_path, path)
+
+
+def merge(left, right):
+    merged = json.loads(json.dumps(left))
+    for name, series in right.items():
+        target = merged.setdefault(name, {})
+        for key, values in series.items():
+            if key in target and len(target[key]) == len(values):
+                target[key] = [a + b for a, b in zip(target[key], values)]
+            else:
+                target.setdefault(key, values)
+    return merged
+
+
+def format_labels(labels):
+    if not labels:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for value in labels.values())
+    return '{' + ','.join(f'{key}="{value}"' for key, value in zip(labels, escaped)) + '}'
+
+
+_registries = {}
+_registries_lock = threading.Lock()
+
+
+def get_registry():
+    """The MetricsRegistry of this process (keyed by pid, like the Gemini client), or None when disabled."""
+
+    if not settings.METRICS_ENABLED:
+        return None
+    pid = os.getpid()
+    registry = _registries.get(pid)
+    if registry is None:
+        with _registries_lock:
+            registry = _registries.get(pid)
+            if registry is None:
+                _registries.clear()
+                windows = SlidingWindows(
+                    Path(settings.METRICS_DIR) / 'windows',
+                    settings.REQUEST_METRICS_SLOT_SECONDS,
+                    settings.REQUEST_METRICS_WINDOWS,
+                )
+                registry = _registries[pid] = MetricsRegistry(
+                    settings.METRICS_DIR, settings.METRICS_FLUSH_INTERVAL, windows=windows,
+                )
+                atexit.register(registry.flush)
+    return registry
+
+
+def observe(name, value, **labels):
+    registry = get_registry()
+    if registry is not None:
+        registry.observe(name, value, **labels)
+
+
+class StageTimer:
+    """Per-request stage durations, reported to the client as a Server-Timing header."""
+
+    def __init__(self):
+        self.timings = {}
+
+    def add(self, stage, seconds):
+        self.timings[stage] = self.timings.get(stage, 0.0) + seconds
+
+    def server_timing(self):
+        return ', '.join(f"{stage};dur={seconds * 1000:.1f}" for stage, seconds in self.timings.items())
+
+
+# The StageTimer of the request being served; copied into tasks and sync_to_async threads
+current_timer = ContextVar('current_timer', default=None)
+
+
+@contextmanager
+def timed(metric, stage, timings=None):
+    """
+    Time a block as `stage`: observed in the `metric` histogram (if given), added to the current
+    request's StageTimer and, when given, to the `timings` dict (seconds, summed per stage).
+    """
+
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started
+        if metric:
+            observe(metric, elapsed, stage=stage)
+        timer = current_timer.get()
+        if timer is not None:
+            timer.add(stage, elapsed)
+        if timings is not None:
+            timings[stage] = round(timings.get(stage, 0.0) + elapsed, 4)
+
+
+class RequestStats:
+    """Database and Gemini time of the request being served (see RequestMetricsMiddleware)."""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.db_seconds = 0.0
+        self.db_queries = 0
+        self.external_seconds = 0.0
+        self.response_bytes = 0
+        # Batch queries touch these from several threads at once
+        self._lock = threading.Lock()
+
+    def add_query(self, seconds):
+        with self._lock:
+            self.db_seconds += seconds
+            self.db_queries += 1
+
+    def add_external(self, seconds):
+        with self._lock:
+            self.external_seconds += seconds
+
+    def values(self):
+        return {
+            'wall_seconds': time.perf_counter() - self.started,
+            'db_seconds': self.db_seconds,
+            'db_queries': self.db_queries,
+            'external_seconds': self.external_seconds,
+            'response_bytes': self.response_bytes,
+        }
+
+
+current_request = ContextVar('current_request', default=None)
+
+
+def record_query(execute, sql, params, many, context):
+    """Database execute wrapper (installed on every connection) charging query time to the current request."""
+
+    stats = current_request.get()
+    if stats is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        stats.add_query(time.perf_counter() - started)
+
+
+def add_external_time(seconds):
+    stats = current_request.get()
+    if stats is not None:
+        stats.add_external(seconds)
+
+
+@contextmanager
+def external_call():
+    """Charge the time spent in the block to the current request's external (Gemini) time."""
+
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        add_external_time(time.perf_counter() - started)
@@ -0,0 +1,95 @@
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.core.exceptions import MiddlewareNotUsed
+
+from app.core.metrics import REQUEST_MEASURES, RequestStats, current_request, get_registry
+
+
+def view_name(request):
+    # url name (with namespace), or the view's dotted path for unnamed routes
+    resolver_match = getattr(request, 'resolver_match', None)
+    return resolver_match.view_name if resolver_match is not None else 'unresolved'
+
+
+class RequestMetricsMiddleware:
+    """
+        Records wall time, database time and query count, Gemini time and response size of every
+        request per resolved view name (e.g. `filesearch-query`), in the /metrics histograms and in
+        the sliding windows behind /api/metrics/latency/.
+        Streamed responses are recorded when their last chunk has been sent.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if get_registry() is None:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+
+        stats = RequestStats()
+        token = current_request.set(stats)
+        try:
+            response = self.get_response(request)
+        finally:
+            current_request.reset(token)
+        return self.finish(request, response, stats)
+
+    async def __acall__(self, request):
+        stats = RequestStats()
+        token = current_request.set(stats)
+        try:
+            response = await self.get_response(request)
+        finally:
+            current_request.reset(token)
+        return self.finish(request, response, stats)
+
+    def finish(self, request, response, stats):
+        if not response.streaming:
+            stats.response_bytes = len(response.content)
+            self.record(request, stats)
+        elif response.is_async:
+            response.streaming_content = self.astream(request, response.streaming_content, stats)
+        else:
+            response.streaming_content = self.stream(request, response.streaming_content, stats)
+        return response
+
+    def stream(self, request, content, stats):
+        # The body is sent after the middleware returned: charge its queries and Gemini calls too.
+        # Servers may advance the iterator from different contexts, so restore instead of reset().
+        previous = current_request.get()
+        current_request.set(stats)
+        try:
+            for chunk in content:
+                stats.response_bytes += len(chunk)
+                yield chunk
+        finally:
+            current_request.set(previous)
+            self.record(request, stats)
+
+    async def astream(self, request, content, stats):
+        previous = current_request.get()
+        current_request.set(stats)
+        try:
+            async for chunk in content:
+                stats.response_bytes += len(chunk)
+                yield chunk
+        finally:
+            current_request.set(previous)
+            self.record(request, stats)
+
+    @staticmethod
+    def record(request, stats):
+        registry = get_registry()
+        if registry is None:
+            return
+        values = stats.values()
+        view = view_name(request)
+        registry.observe_many({REQUEST_MEASURES[measure][0]: value for measure, value in values.items()}, view=view)
+        if registry.windows is not None:
+            registry.windows.observe(view, values)
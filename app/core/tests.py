@@ -1,3 +1,316 @@
-from django.test import TestCase
+import shutil
+import tempfile
+import threading
+import time
+from io import StringIO
+from pathlib import Path
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.http import HttpResponse, StreamingHttpResponse
+from django.test import RequestFactory, SimpleTestCase, TestCase, override_settings
+
+from app.core.benchmarks import BENCHMARKS, compare as compare_benchmarks, measure
+from app.core.loadtest import Results, compare as compare_load_test, percentile
+from app.core.metrics import (
+    DEAD_FILE, MetricsRegistry, SlidingWindows, StageTimer, add_external_time, bucket_index, bucket_quantile,
+    current_timer, merge, read_series, timed, write_series,
+)
+from app.core.middleware import RequestMetricsMiddleware
+from app.core.views import MetricsView
+from app.filesearch.models import FileSearchStore
+from app.global_constants import GlobalValues
+from app.role.models import Role
+
+
+class BucketTests(SimpleTestCase):
+
+    def test_bucket_index_uses_upper_bounds(self):
+        buckets = (1, 5, 10)
+
+        self.assertEqual([bucket_index(buckets, value) for value in (0, 1, 1.5, 10, 11)], [0, 0, 1, 2, 3])
+
+    def test_bucket_quantile_interpolates_within_the_bucket(self):
+        buckets = (1, 2, 4)
+        # Ten observations: four in (0, 1], four in (1, 2], two in (2, 4]; sum last
+        counts = [4, 4, 2, 0, 15.0]
+
+        self.assertEqual(bucket_quantile(buckets, counts, 0.2), 0.5)
+        self.assertEqual(bucket_quantile(buckets, counts, 0.5), 1.25)
+        self.assertEqual(bucket_quantile(buckets, counts, 0.9), 3.0)
+        self.assertEqual(bucket_quantile(buckets, counts, 1.0), 4)
+
+    def test_bucket_quantile_above_the_last_bound_and_without_observations(self):
+        self.assertEqual(bucket_quantile((1, 2), [0, 1, 3, 20.0], 0.99), 2)
+        self.assertIsNone(bucket_quantile((1, 2), [0, 0, 0, 0.0], 0.5))
+
+    def test_merge_adds_series_with_the_same_labels(self):
+        left = {'latency': {'{"stage": "a"}': [1, 0, 0.5]}}
+        right = {'latency': {'{"stage": "a"}': [2, 1, 3.0], '{"stage": "b"}': [0, 1, 7.0]},
+                 'size': {'{}': [1, 2.0]}}
+
+        merged = merge(left, right)
+
+        self.assertEqual(merged, {
+            'latency': {'{"stage": "a"}': [3, 1, 3.5], '{"stage": "b"}': [0, 1, 7.0]},
+            'size': {'{}': [1, 2.0]},
+        })
+        # Inputs are left alone
+        self.assertEqual(left, {'latency': {'{"stage": "a"}': [1, 0, 0.5]}})
+
+
+class MetricsRegistryTests(SimpleTestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory, ignore_errors=True)
+        self.registry = MetricsRegistry(self.directory, flush_interval=3600, buckets=(0.1, 1))
+
+    def test_collect_merges_every_process_of_the_host(self):
+        self.registry.observe('stage_seconds', 0.05, stage='upload')
+        self.registry.observe('stage_seconds', 0.5, stage='upload')
+        write_series(Path(self.directory) / '99999.json', {'stage_seconds': {'{"stage": "upload"}': [0, 0, 1, 5.0]}})
+
+        self.assertEqual(self.registry.collect(), {'stage_seconds': {'{"stage": "upload"}': [1, 1, 1, 5.55]}})
+
+    def test_totals_of_a_dead_process_with_the_same_pid_are_kept(self):
+        write_series(self.registry.path, {'stage_seconds': {'{}': [2, 0, 0, 0.1]}})
+
+        self.registry.observe('stage_seconds', 0.05)
+        self.registry.flush()
+
+        self.assertEqual(read_series(Path(self.directory) / DEAD_FILE), {'stage_seconds': {'{}': [2, 0, 0, 0.1]}})
+        self.assertEqual(self.registry.collect()['stage_seconds']['{}'][:3], [3, 0, 0])
+
+    def test_render_writes_cumulative_prometheus_histograms(self):
+        self.registry.observe('stage_seconds', 0.05, stage='upload')
+        self.registry.observe('stage_seconds', 5, stage='upload')
+
+        lines = self.registry.render().splitlines()
+
+        self.assertIn('# TYPE stage_seconds histogram', lines)
+        self.assertIn('stage_seconds_bucket{stage="upload",le="0.1"} 1', lines)
+        self.assertIn('stage_seconds_bucket{stage="upload",le="1.0"} 1', lines)
+        self.assertIn('stage_seconds_bucket{stage="upload",le="+Inf"} 2', lines)
+        self.assertIn('stage_seconds_sum{stage="upload"} 5.05', lines)
+        self.assertIn('stage_seconds_count{stage="upload"} 2', lines)
+
+    def test_observe_leaves_the_file_writes_to_a_background_thread(self):
+        registry = MetricsRegistry(self.directory, flush_interval=0)
+        flushed = threading.Event()
+        threads = []
+
+        def flush():
+            threads.append(threading.current_thread())
+            flushed.set()
+
+        with mock.patch.object(registry, 'flush', side_effect=flush):
+            registry.observe('stage_seconds', 0.05)
+            self.assertTrue(flushed.wait(5))
+
+        self.assertNotIn(threading.current_thread(), threads)
+
+    @override_settings(METRICS_TOKEN='scrape-token')
+    def test_metrics_view_requires_the_token(self):
+        self.registry.observe('stage_seconds', 0.05, stage='upload')
+        view = MetricsView.as_view()
+
+        with mock.patch('app.core.views.get_registry', return_value=self.registry):
+            denied = view(RequestFactory().get('/metrics/'))
+            allowed = view(RequestFactory().get('/metrics/', HTTP_AUTHORIZATION='Bearer scrape-token'))
+
+        self.assertEqual(denied.status_code, 401)
+        self.assertEqual(allowed.status_code, 200)
+        self.assertIn(b'stage_seconds_count{stage="upload"} 1', allowed.content)
+
+
+class TimedTests(SimpleTestCase):
+
+    def test_timed_adds_to_the_timings_and_the_request_timer(self):
+        timings = {'upload': 1.0}
+        timer = StageTimer()
+        token = current_timer.set(timer)
+        try:
+            with mock.patch('app.core.metrics.observe') as observe:
+                with timed('stage_seconds', 'upload', timings):
+                    pass
+                with timed(None, 'parse'):
+                    pass
+        finally:
+            current_timer.reset(token)
+
+        self.assertGreaterEqual(timings['upload'], 1.0)
+        self.assertEqual(set(timer.timings), {'upload', 'parse'})
+        observe.assert_called_once_with('stage_seconds', mock.ANY, stage='upload')
+        self.assertRegex(timer.server_timing(), r'^upload;dur=\d+\.\d, parse;dur=\d+\.\d$')
+
+
+class SlidingWindowsTests(SimpleTestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory, ignore_errors=True)
+        self.windows = SlidingWindows(self.directory, slot_seconds=10, windows=(60, 20))
+
+    def test_percentiles_per_view_and_window(self):
+        now = time.time()
+        with mock.patch('app.core.metrics.time.time', return_value=now - 30):
+            for _ in range(10):
+                self.windows.observe('document-list', {'wall_seconds': 2, 'db_queries': 3})
+        with mock.patch('app.core.metrics.time.time', return_value=now):
+            for _ in range(10):
+                self.windows.observe('document-list', {'wall_seconds': 0.01, 'db_queries': 3})
+            report = self.windows.percentiles(quantiles=(0.5, 0.99))
+
+        recent, longer = report['document-list'][20], report['document-list'][60]
+        self.assertEqual(recent['requests'], 10)
+        self.assertEqual(recent['wall_seconds'], {'p50': 0.0075, 'p99': 0.00995})
+        self.assertEqual(longer['requests'], 20)
+        self.assertEqual(longer['wall_seconds']['p99'], 2.47)
+        # Interpolated inside the (2, 3] bucket
+        self.assertEqual(longer['db_queries'], {'p50': 2.5, 'p99': 2.99})
+
+    def test_slots_of_other_processes_are_merged(self):
+        self.windows.observe('login', {'wall_seconds': 0.2})
+        other = SlidingWindows(self.directory, slot_seconds=10, windows=(60,))
+        other.path = Path(self.directory) / '99999.json'
+        other.observe('login', {'wall_seconds': 0.2})
+        other.flush()
+
+        self.assertEqual(self.windows.percentiles()['login'][60]['requests'], 2)
+
+
+class RequestMetricsMiddlewareTests(SimpleTestCase):
+
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory, ignore_errors=True)
+        self.registry = MetricsRegistry(directory, flush_interval=3600,
+                                        windows=SlidingWindows(Path(directory) / 'windows', 10, (60,)))
+        patcher = mock.patch('app.core.middleware.get_registry', return_value=self.registry)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def request(self):
+        request = RequestFactory().get('/api/filesearch/stores/list-filter/')
+        request.resolver_match = mock.Mock(view_name='filesearch-list')
+        return request
+
+    def series(self, name):
+        return self.registry.collect()[name]['{"view": "filesearch-list"}']
+
+    def test_records_each_measure_per_view(self):
+        def view(request):
+            add_external_time(0.3)
+            return HttpResponse(b'x' * 300)
+
+        RequestMetricsMiddleware(view)(self.request())
+
+        self.assertEqual(sum(self.series('http_request_duration_seconds')[:-1]), 1)
+        self.assertEqual(self.series('http_request_external_seconds')[-1], 0.3)
+        self.assertEqual(self.series('http_response_size_bytes')[-1], 300)
+        self.assertEqual(self.registry.windows.percentiles()['filesearch-list'][60]['requests'], 1)
+
+    def test_streamed_responses_are_recorded_after_the_last_chunk(self):
+        def chunks():
+            add_external_time(0.5)
+            yield b'data: one\n\n'
+            yield b'data: two\n\n'
+
+        response = RequestMetricsMiddleware(lambda request: StreamingHttpResponse(chunks()))(self.request())
+        self.assertNotIn('http_request_duration_seconds', self.registry.collect())
+
+        self.assertEqual(b''.join(response.streaming_content), b'data: one\n\ndata: two\n\n')
+        self.assertEqual(self.series('http_response_size_bytes')[-1], 22)
+        self.assertEqual(self.series('http_request_external_seconds')[-1], 0.5)
+
+
+class LoadTestResultsTests(SimpleTestCase):
+
+    def test_percentile_is_nearest_rank(self):
+        values = list(range(1, 101))
+
+        self.assertEqual(percentile(values, 0.5), 50)
+        self.assertEqual(percentile(values, 0.95), 95)
+        self.assertEqual(percentile([7], 0.99), 7)
+        self.assertIsNone(percentile([], 0.5))
+
+    def test_summary_counts_errors_and_throttling_separately(self):
+        results = Results()
+        for seconds in (0.3, 0.1, 0.2):
+            results.record('list', seconds, 200)
+        results.record('list', 0.05, 429)
+        results.record('list', 1.0, None)
+
+        summary = results.summary(duration=2)['list']
+
+        self.assertEqual(summary['requests'], 5)
+        self.assertEqual(summary['rps'], 2.5)
+        self.assertEqual((summary['errors'], summary['throttled'], summary['error_rate']), (1, 1, 0.2))
+        self.assertEqual((summary['p50_ms'], summary['max_ms']), (200.0, 1000.0))
+        self.assertEqual(summary['statuses'], {'200': 3, '429': 1, 'None': 1})
+
+    def test_compare_reports_latency_throughput_and_error_regressions(self):
+        baseline = {'endpoints': {
+            'list': {'requests': 100, 'rps': 50, 'p95_ms': 100, 'error_rate': 0.0},
+            'query': {'requests': 10, 'rps': 5, 'p95_ms': 900, 'error_rate': 0.0},
+            'login': {'requests': 10, 'rps': 5, 'p95_ms': 80, 'error_rate': 0.0},
+        }}
+        report = {'endpoints': {
+            'list': {'requests': 100, 'rps': 40, 'p95_ms': 130, 'error_rate': 0.05},
+            'query': {'requests': 10, 'rps': 5, 'p95_ms': 950, 'error_rate': 0.005},
+        }}
+
+        self.assertEqual(compare_load_test(report, baseline, tolerance=0.1), [
+            'list: p95 130ms vs 100ms',
+            'list: 40 rps vs 50 rps',
+            'list: error rate 0.05 vs 0.0',
+            'login: no requests (baseline had 10)',
+        ])
+
+
+class BenchmarkTests(SimpleTestCase):
+
+    def test_every_benchmark_runs_without_the_database(self):
+        # SimpleTestCase refuses database queries, so a fixture that hits the database fails here
+        for name, setup in BENCHMARKS.items():
+            with self.subTest(name):
+                setup()()
+
+    def test_measure_reports_per_call_microseconds(self):
+        result = measure(lambda: None, repeat=3, min_time=0.01)
+
+        self.assertEqual(result['repeat'], 3)
+        self.assertGreaterEqual(result['loops'], 1)
+        self.assertLessEqual(result['min_us'], result['median_us'])
+
+    def test_compare_flags_benchmarks_slower_than_the_tolerance(self):
+        baseline = {'benchmarks': {'jwt_decode': {'min_us': 10.0}, 'pagination': {'min_us': 100.0}}}
+        report = {'benchmarks': {'jwt_decode': {'min_us': 10.5}, 'pagination': {'min_us': 150.0},
+                                 'response_render': {'min_us': 40.0}}}
+
+        self.assertEqual(compare_benchmarks(report, baseline, tolerance=0.1), ['pagination: 150.0us vs 100.0us (+50%)'])
+
+
+class ExplainQueriesCommandTests(TestCase):
+
+    def test_seeds_rows_and_explains_every_hot_query(self):
+        Role.objects.create(id=GlobalValues.USER.value, name='User')
+        out = StringIO()
+
+        # Every seeded row active, so there is a user to explain the queries for
+        with mock.patch('app.core.management.commands.explain_queries.random.random', return_value=0.5):
+            call_command('explain_queries', seed_users=3, documents_per_user=2, stdout=out)
+
+        self.assertEqual(get_user_model().objects.filter(email__startswith='seed-').count(), 3)
+        self.assertEqual(FileSearchStore.objects.count(), 6)
+        for label in ('document list', 'operation poller', 'login', 'user list, email filter'):
+            self.assertIn(label, out.getvalue())
+
+    def test_warns_without_an_active_user(self):
+        out = StringIO()
+
+        call_command('explain_queries', stdout=out)
+
+        self.assertIn('No active user', out.getvalue())
@@ -1,5 +1,19 @@
+import secrets
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.http import HttpResponse, Http404
 from django.shortcuts import render
+from django.views import View
+from drf_yasg.utils import swagger_auto_schema
+from rest_framework import status
 from rest_framework.pagination import PageNumberPagination
+from rest_framework.generics import GenericAPIView
+
+from app.core.metrics import StageTimer, current_timer, get_registry, timed
+from app.global_constants import SuccessMessage, ErrorMessage
+from app.utils import get_response_schema
+from permissions import IsSuperAdmin
 
 
 # Create your views here.
@@ -24,4 +38,94 @@ class CustomPageNumberPagination(PageNumberPagination):
         paginator = self.django_paginator_class(queryset, self.page_size)
         self.page = paginator.get_page(page_number)
 
-        return self.page
\ No newline at end of file
+        return self.page
+
+
+class AsyncAPIView(GenericAPIView):
+    """
+        GenericAPIView whose handlers are coroutines, served without a thread per request under ASGI
+        (under WSGI Django runs them in an event loop per request).
+        Authentication, permissions and throttling run as in APIView (in a worker thread, since
+        they may hit the database); handlers are awaited and may return a DRF Response or a
+        StreamingHttpResponse with an async iterator.
+        Stages timed during the request (see app.core.metrics.timed) are returned in a
+        Server-Timing header; `timing_metric` also records them in that histogram.
+    """
+    timing_metric = None
+
+    async def dispatch(self, request, *args, **kwargs):
+        self.args = args
+        self.kwargs = kwargs
+        request = self.initialize_request(request, *args, **kwargs)
+        self.request = request
+        self.headers = self.default_response_headers
+        timer = StageTimer()
+        timer_token = current_timer.set(timer)
+
+        try:
+            with timed(self.timing_metric, 'auth'):
+                await sync_to_async(self.initial)(request, *args, **kwargs)
+
+            if request.method.lower() in self.http_method_names:
+                handler = getattr(self, request.method.lower(), self.http_method_not_allowed)
+            else:
+                handler = self.http_method_not_allowed
+
+            response = await handler(request, *args, **kwargs)
+
+        except Exception as exc:
+            response = self.handle_exception(exc)
+        finally:
+            current_timer.reset(timer_token)
+
+        self.response = self.finalize_response(request, response, *args, **kwargs)
+        if timer.timings:
+            self.response['Server-Timing'] = timer.server_timing()
+        return self.response
+
+    async def http_method_not_allowed(self, request, *args, **kwargs):
+        return super().http_method_not_allowed(request, *args, **kwargs)
+
+    async def options(self, request, *args, **kwargs):
+        return super().options(request, *args, **kwargs)
+
+
+class MetricsView(View):
+    """
+        Stage timing histograms of every process on this host, in the Prometheus text format.
+        Not a DRF view: scrapers authenticate with METRICS_TOKEN, not a user JWT.
+    """
+
+    def get(self, request, *args, **kwargs):
+        registry = get_registry()
+        if registry is None:
+            raise Http404
+
+        if settings.METRICS_TOKEN:
+            supplied = request.headers.get('Authorization', '').removeprefix('Bearer ')
+            if not secrets.compare_digest(supplied, settings.METRICS_TOKEN):
+                return HttpResponse(status=401)
+
+        return HttpResponse(registry.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+class RequestLatencyView(GenericAPIView):
+    """
+        p50/p95/p99 of wall time, database time and query count, Gemini time and response size per
+        endpoint over the REQUEST_METRICS_WINDOWS sliding windows, across the processes of this host.
+        GET /api/metrics/latency/
+    """
+    permission_classes = [IsSuperAdmin]
+
+    @swagger_auto_schema(responses={200: 'Percentiles per endpoint and window'})
+    def get(self, request):
+        registry = get_registry()
+        if registry is None or registry.windows is None:
+            return get_response_schema({}, ErrorMessage.NOT_FOUND.value, status.HTTP_404_NOT_FOUND)
+
+        return_data = {
+            'windows': list(registry.windows.windows),
+            'slot_seconds': registry.windows.slot_seconds,
+            'endpoints': registry.windows.percentiles(),
+        }
+        return get_response_schema(return_data, SuccessMessage.RECORD_RETRIEVED.value, status.HTTP_200_OK)
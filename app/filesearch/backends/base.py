@@ -0,0 +1,75 @@
+import asyncio
+
+
+class FileSearchBackend:
+    """
+    Interface of the services behind GeminiClientWrapper.
+
+    Return values mirror the google-genai objects the rest of the app reads:
+      - create_store() -> object with `.name`
+      - upload_file_to_store() / get_operation() -> operation with `.name`, `.done`, `.error`
+        and, once done, `.response.document_name`
+      - query_store() -> response with `.text` and
+        `.candidates[0].grounding_metadata.grounding_chunks[i].retrieved_context.text`
+        (`query` is the bare user question; `system_instruction` carries the grounding rules)
+      - aquery_store() / agenerate() -> coroutines returning what query_store() / generate() return
+      - astream_query_store() -> async iterator of partial responses shaped like query_store()'s,
+        each carrying a text delta; grounding metadata comes with the last ones
+    """
+
+    def ping(self):
+        raise NotImplementedError
+
+    def create_store(self, display_name=None):
+        raise NotImplementedError
+
+    def delete_store(self, store_name):
+        raise NotImplementedError
+
+    def delete_document(self, document_name):
+        raise NotImplementedError
+
+    def upload_file_to_store(self, store_name, file_path, display_name=None, metadata=None):
+        raise NotImplementedError
+
+    def get_operation(self, operation_name):
+        raise NotImplementedError
+
+    def query_store(self, store_names, query, metadata_filter=None, system_instruction=None):
+        raise NotImplementedError
+
+    def generate(self, prompt):
+        """Plain generation without retrieval; returns a response with `.text`."""
+        raise NotImplementedError
+
+    # --- async (ASGI views); defaults run the blocking call in a thread ------
+
+    async def aquery_store(self, store_names, query, metadata_filter=None, system_instruction=None):
+        return await asyncio.to_thread(self.query_store, store_names, query, metadata_filter=metadata_filter,
+                                       system_instruction=system_instruction)
+
+    async def agenerate(self, prompt):
+        return await asyncio.to_thread(self.generate, prompt)
+
+    async def astream_query_store(self, store_names, query, metadata_filter=None, system_instruction=None):
+        # Backends without streaming answer in one piece, off the event loop
+        yield await asyncio.to_thread(self.query_store, store_names, query, metadata_filter=metadata_filter,
+                                      system_instruction=system_instruction)
+
+    async def astream_generate(self, prompt):
+        yield await asyncio.to_thread(self.generate, prompt)
+
+
+def build_prompt(query, system_instruction=None, context_chunks=None):
+    """Single-turn prompt: system instruction, optional retrieved chunks, then the user question."""
+
+    parts = []
+    if system_instruction:
+        parts.append(system_instruction)
+    if context_chunks:
+        parts.append("Document chunks:\n" + "\n\n".join(
+            f"[{index}] {chunk}" for index, chunk in enumerate(context_chunks, start=1)
+        ))
+    parts.append(f"User question: {query}" if system_instruction or context_chunks else query)
+    return "\n\n".join(parts)
+
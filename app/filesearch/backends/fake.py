@@ -0,0 +1,236 @@
+import asyncio
+import copy
+import hashlib
+import math
+import random
+import re
+import threading
+import time
+import uuid
+from types import SimpleNamespace
+
+from django.conf import settings
+
+from app.filesearch.backends.base import FileSearchBackend
+
+DEFAULT_CONFIG = {
+    # Seed for reproducible runs (None = random)
+    'seed': None,
+    # Per-call latency, log-normal: `median_ms` is the p50, `sigma` the spread of log(latency)
+    'latency': {
+        'default': {'median_ms': 50, 'sigma': 0.3},
+        'create_store': {'median_ms': 400, 'sigma': 0.3},
+        'upload_file_to_store': {'median_ms': 800, 'sigma': 0.4},
+        'get_operation': {'median_ms': 80, 'sigma': 0.3},
+        'query_store': {'median_ms': 1800, 'sigma': 0.5},
+        'generate': {'median_ms': 1500, 'sigma': 0.5},
+    },
+    # Time until an upload operation reports done, log-normal as above
+    'operation_duration': {'median_ms': 15000, 'sigma': 0.5},
+    # Share of upload operations that finish with an error
+    'operation_failure_rate': 0.0,
+    # Share of calls failing with each HTTP status (429 quota, 500 server error, ...)
+    'error_rates': {429: 0.0, 500: 0.0},
+    # Seconds a 429 asks the caller to wait (RetryInfo)
+    'quota_retry_delay': 5,
+    # Streaming (astream_*): time to the first delta, then one delta of `delta_chars` every `delta_interval_ms`
+    'stream': {'first_token': {'median_ms': 400, 'sigma': 0.4}, 'delta_chars': 40, 'delta_interval_ms': 25},
+    # Size of query responses
+    'grounding_chunks': 5,
+    'grounding_chunk_chars': 1000,
+    'answer_chars': 600,
+}
+
+WORDS = (
+    'lecture algorithm theorem proof definition example exercise complexity structure memory index tree '
+    'graph vector matrix probability distribution gradient function model data query search page chapter'
+).split()
+
+OPERATION_NAME_RE = re.compile(r'/operations/fake-[0-9a-f]+-(?P<done_at>\d+)-(?P<outcome>ok|fail)$')
+
+
+class FakeAPIError(Exception):
+    """Mimics google.genai.errors.APIError (`code`, `status`, `message`)."""
+
+    def __init__(self, code, message, retry_delay=None):
+        self.code = code
+        self.status = {429: 'RESOURCE_EXHAUSTED', 404: 'NOT_FOUND'}.get(code, 'INTERNAL')
+        self.message = message
+        # Quota errors carry a google.rpc.RetryInfo detail, like the real API
+        self.details = {'error': {'code': code, 'status': self.status, 'message': message, 'details': [
+            {'@type': 'type.googleapis.com/google.rpc.RetryInfo', 'retryDelay': f"{retry_delay}s"},
+        ] if retry_delay is not None else []}}
+        super().__init__(f"{code} {self.status}. {message}")
+
+
+def merge_config(defaults, overrides):
+    merged = copy.deepcopy(defaults)
+    for key, value in (overrides or {}).items():
+        if isinstance(value, dict) and isinstance(merged.get(key), dict):
+            merged[key] = merge_config(merged[key], value)
+        else:
+            merged[key] = value
+    return merged
+
+
+class FakeBackend(FileSearchBackend):
+    """
+    In-process stand-in for Gemini File Search, for load tests and profiling without network access.
+
+    Latencies, operation durations, error rates and response sizes come from FAKE_FILESEARCH_BACKEND.
+    Operation names encode their completion time and outcome, so an operation started by one
+    process (ingestion worker) can be polled by another (operation poller), even after restarts.
+    """
+
+    def __init__(self, config=None):
+        self.config = merge_config(DEFAULT_CONFIG, config or getattr(settings, 'FAKE_FILESEARCH_BACKEND', {}))
+        self.random = random.Random(self.config['seed'])
+        self._lock = threading.Lock()
+
+    # --- behaviour knobs -------------------------------------------------
+
+    def _lognormal_ms(self, spec):
+        median_ms = spec.get('median_ms', 0)
+        if median_ms <= 0:
+            return 0.0
+        with self._lock:
+            return self.random.lognormvariate(math.log(median_ms), spec.get('sigma', 0))
+
+    def _simulate_call(self, method):
+        latency = self.config['latency']
+        time.sleep(self._lognormal_ms(latency.get(method, latency['default'])) / 1000)
+        self._inject_fault(method)
+
+    def _inject_fault(self, method):
+        with self._lock:
+            roll = self.random.random()
+        threshold = 0.0
+        for code, rate in self.config['error_rates'].items():
+            threshold += rate
+            if roll < threshold:
+                raise FakeAPIError(int(code), f"Injected fault in {method}",
+                                   retry_delay=self.config['quota_retry_delay'] if int(code) == 429 else None)
+
+    def _text(self, seed, length):
+        rng = random.Random(seed)
+        words = []
+        size = 0
+        # The joined text is one separator shorter than `size`
+        while size <= length:
+            word = rng.choice(WORDS)
+            words.append(word)
+            size += len(word) + 1
+        return ' '.join(words)[:length]
+
+    # --- FileSearchBackend -----------------------------------------------
+
+    def ping(self):
+        self._simulate_call('ping')
+        return SimpleNamespace(name=f"models/{settings.GEMINI_MODEL}")
+
+    def create_store(self, display_name=None):
+        self._simulate_call('create_store')
+        return SimpleNamespace(name=f"fileSearchStores/fake-{uuid.uuid4().hex[:16]}", display_name=display_name)
+
+    def delete_store(self, store_name):
+        self._simulate_call('delete_store')
+
+    def delete_document(self, document_name):
+        self._simulate_call('delete_document')
+
+    def upload_file_to_store(self, store_name, file_path, display_name=None, metadata=None):
+        self._simulate_call('upload_file_to_store')
+
+        with self._lock:
+            failed = self.random.random() < self.config['operation_failure_rate']
+        duration_ms = self._lognormal_ms(self.config['operation_duration'])
+        done_at = int(time.time() * 1000 + duration_ms)
+        outcome = 'fail' if failed else 'ok'
+
+        return self._operation(f"{store_name}/upload/operations/fake-{uuid.uuid4().hex[:16]}-{done_at}-{outcome}")
+
+    def get_operation(self, operation_name):
+        self._simulate_call('get_operation')
+        return self._operation(operation_name)
+
+    def _operation(self, operation_name):
+        match = OPERATION_NAME_RE.search(operation_name)
+        if not match:
+            raise FakeAPIError(404, f"Operation {operation_name} not found")
+
+        done = time.time() * 1000 >= int(match.group('done_at'))
+        operation = SimpleNamespace(name=operation_name, done=done, error=None, response=None)
+        if done and match.group('outcome') == 'fail':
+            operation.error = {'code': 13, 'message': 'Injected ingestion failure'}
+        elif done:
+            store_name = operation_name.split('/upload/')[0]
+            document_id = hashlib.sha1(operation_name.encode()).hexdigest()[:16]
+            operation.response = SimpleNamespace(document_name=f"{store_name}/documents/{document_id}")
+        return operation
+
+    def _answer(self, store_names, query, metadata_filter):
+        seed = f"{','.join(store_names)}|{metadata_filter}|{query}"
+        chunks = [
+            SimpleNamespace(retrieved_context=SimpleNamespace(
+                text=self._text(f"{seed}|{index}", self.config['grounding_chunk_chars']),
+                title=f"fake-document-{index}",
+                document_name=f"{store_names[index % len(store_names)]}/documents/fake-{index}",
+            ))
+            for index in range(self.config['grounding_chunks'])
+        ]
+        return self._text(seed, self.config['answer_chars']), chunks
+
+    def _response(self, text, grounding_chunks=None):
+        return SimpleNamespace(
+            text=text,
+            candidates=[SimpleNamespace(
+                content=SimpleNamespace(parts=[SimpleNamespace(text=text)]),
+                grounding_metadata=SimpleNamespace(grounding_chunks=grounding_chunks) if grounding_chunks else None,
+            )],
+            # ~4 characters per token, prompt side dominated by the grounding chunks
+            usage_metadata=SimpleNamespace(total_token_count=(
+                len(text) + sum(len(chunk.retrieved_context.text) for chunk in grounding_chunks or [])) // 4),
+        )
+
+    def query_store(self, store_names, query, metadata_filter=None, system_instruction=None):
+        self._simulate_call('query_store')
+        return self._response(*self._answer(store_names, query, metadata_filter))
+
+    def generate(self, prompt):
+        self._simulate_call('generate')
+        return SimpleNamespace(text=self._text(prompt, self.config['answer_chars']))
+
+    async def _asimulate_call(self, method):
+        latency = self.config['latency']
+        await asyncio.sleep(self._lognormal_ms(latency.get(method, latency['default'])) / 1000)
+        self._inject_fault(method)
+
+    async def aquery_store(self, store_names, query, metadata_filter=None, system_instruction=None):
+        await self._asimulate_call('query_store')
+        return self._response(*self._answer(store_names, query, metadata_filter))
+
+    async def agenerate(self, prompt):
+        await self._asimulate_call('generate')
+        return SimpleNamespace(text=self._text(prompt, self.config['answer_chars']))
+
+    async def _stream(self, method, text, grounding_chunks=None):
+        stream = self.config['stream']
+        await asyncio.sleep(self._lognormal_ms(stream['first_token']) / 1000)
+        self._inject_fault(method)
+
+        size = max(stream['delta_chars'], 1)
+        deltas = [text[start:start + size] for start in range(0, len(text), size)] or ['']
+        for index, delta in enumerate(deltas):
+            if index:
+                await asyncio.sleep(stream['delta_interval_ms'] / 1000)
+            # Grounding metadata only comes with the last chunk, as with the real API
+            yield self._response(delta, grounding_chunks if index == len(deltas) - 1 else None)
+
+    async def astream_query_store(self, store_names, query, metadata_filter=None, system_instruction=None):
+        text, grounding_chunks = self._answer(store_names, query, metadata_filter)
+        async for chunk in self._stream('astream_query_store', text, grounding_chunks):
+            yield chunk
+
+    async def astream_generate(self, prompt):
+        async for chunk in self._stream('astream_generate', self._text(prompt, self.config['answer_chars'])):
+            yield chunk
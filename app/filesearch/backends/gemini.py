@@ -0,0 +1,135 @@
+import os
+
+from django.conf import settings
+
+from app.filesearch.backends.base import FileSearchBackend, build_prompt
+
+try:
+    from google import genai
+    from google.genai import types
+except Exception:
+    genai = None
+    types = None
+
+try:
+    import httpx
+except Exception:
+    httpx = None
+
+
+def build_http_options():
+    """HTTP options shared by every client: request timeout and keep-alive connection pool limits."""
+
+    client_args = {}
+    if httpx is not None:
+        client_args['limits'] = httpx.Limits(
+            max_connections=settings.GEMINI_HTTP_MAX_CONNECTIONS,
+            max_keepalive_connections=settings.GEMINI_HTTP_MAX_KEEPALIVE_CONNECTIONS,
+            keepalive_expiry=settings.GEMINI_HTTP_KEEPALIVE_EXPIRY,
+        )
+
+    return types.HttpOptions(
+        timeout=settings.GEMINI_HTTP_TIMEOUT_MS,
+        client_args=client_args,
+        async_client_args=client_args,
+    )
+
+
+class GeminiBackend(FileSearchBackend):
+    """Google Gemini File Search through the google-genai SDK."""
+
+    def __init__(self):
+        api_key = os.getenv('GOOGLE_API_KEY') or getattr(settings, 'GOOGLE_API_KEY', None)
+        if not api_key:
+            raise RuntimeError('GOOGLE_API_KEY is not set')
+
+        if genai is None:
+            raise RuntimeError('google-genai library is not available')
+
+        self.client = genai.Client(api_key=api_key, http_options=build_http_options())
+
+    def ping(self):
+        # cheap authenticated round trip, used for warm-up and health checks
+        return self.client.models.get(model=settings.GEMINI_MODEL)
+
+    def create_store(self, display_name: str = None):
+        # create a new file search store
+        config = {'display_name': display_name} if display_name else None
+        return self.client.file_search_stores.create(config=config)
+
+    def delete_store(self, store_name: str):
+        # force=True also removes the documents inside the store
+        return self.client.file_search_stores.delete(name=store_name, config={'force': True})
+
+    def delete_document(self, document_name: str):
+        # remove a single document from a shared store
+        return self.client.file_search_stores.documents.delete(name=document_name, config={'force': True})
+
+    def upload_file_to_store(self, store_name: str, file_path: str, display_name: str = None, metadata: dict = None):
+        # returns operation object; metadata is attached to the remote document and usable in metadata_filter
+        config = {}
+        if display_name:
+            config['display_name'] = display_name
+        if metadata:
+            config['custom_metadata'] = [{'key': key, 'string_value': str(value)} for key, value in metadata.items()]
+
+        return self.client.file_search_stores.upload_to_file_search_store(
+            file_search_store_name=store_name,
+            file=file_path,
+            config=config or None
+        )
+
+    def get_operation(self, operation_name: str):
+        # Rehydrate a pending upload operation from its name (survives process restarts)
+        return self.client.operations.get(types.UploadToFileSearchStoreOperation(name=operation_name))
+
+    def file_search_config(self, store_names, metadata_filter=None):
+        return types.GenerateContentConfig(
+            tools=[
+                types.Tool(
+                    file_search=types.FileSearch(
+                        file_search_store_names=store_names,
+                        metadata_filter=metadata_filter
+                    )
+                )
+            ]
+        )
+
+    def query_store(self, store_names, query: str, metadata_filter: str = None, system_instruction: str = None):
+        # Use models.generate_content with file_search tool over one or more stores
+        response = self.client.models.generate_content(
+            model=settings.GEMINI_MODEL,
+            contents=build_prompt(query, system_instruction),
+            config=self.file_search_config(store_names, metadata_filter)
+        )
+        return response
+
+    def generate(self, prompt: str):
+        return self.client.models.generate_content(model=settings.GEMINI_MODEL, contents=prompt)
+
+    async def aquery_store(self, store_names, query: str, metadata_filter: str = None, system_instruction: str = None):
+        # Same request as query_store on the async client (shares the pooled connections' limits)
+        return await self.client.aio.models.generate_content(
+            model=settings.GEMINI_MODEL,
+            contents=build_prompt(query, system_instruction),
+            config=self.file_search_config(store_names, metadata_filter)
+        )
+
+    async def agenerate(self, prompt: str):
+        return await self.client.aio.models.generate_content(model=settings.GEMINI_MODEL, contents=prompt)
+
+    async def astream_query_store(self, store_names, query: str, metadata_filter: str = None,
+                                  system_instruction: str = None):
+        # Same request as query_store on the async client, streamed chunk by chunk
+        stream = await self.client.aio.models.generate_content_stream(
+            model=settings.GEMINI_MODEL,
+            contents=build_prompt(query, system_instruction),
+            config=self.file_search_config(store_names, metadata_filter)
+        )
+        async for chunk in stream:
+            yield chunk
+
+    async def astream_generate(self, prompt: str):
+        stream = await self.client.aio.models.generate_content_stream(model=settings.GEMINI_MODEL, contents=prompt)
+        async for chunk in stream:
+            yield chunk
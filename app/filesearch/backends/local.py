@@ -0,0 +1,278 @@
+import asyncio
+import heapq
+import json
+import os
+import re
+import shutil
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from types import SimpleNamespace
+
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+from app.filesearch.backends.base import FileSearchBackend, build_prompt
+from app.filesearch.retrieval.bm25 import load_index, evict_index
+from app.filesearch.retrieval.hybrid import reciprocal_rank_fusion, rerank, apply_token_budget
+from app.filesearch.retrieval.indexing import index_document, get_embedder, META_FILE
+from app.filesearch.retrieval.vectors import load_vector_index, evict_vector_index
+
+STORE_NAME_RE = re.compile(r'^localStores/(?P<store>[0-9a-f]{32})$')
+DOCUMENT_NAME_RE = re.compile(r'^localStores/(?P<store>[0-9a-f]{32})/documents/(?P<document>[0-9a-f]{32})$')
+METADATA_FILTER_RE = re.compile(r'(\w+)\s*=\s*"([^"]*)"')
+OR_RE = re.compile(r'\s+OR\s+')
+
+# Runs the keyword pass while the calling thread runs the vector pass
+_search_pool = ThreadPoolExecutor(max_workers=4, thread_name_prefix='local-search')
+
+
+def parse_metadata_filter(metadata_filter):
+    """
+    Supports the `key="value" AND key2="value2"` subset of the Gemini filter syntax, with
+    alternatives joined by OR. Returns the alternatives as dicts; a document matches any of them.
+    """
+
+    return [dict(METADATA_FILTER_RE.findall(alternative)) for alternative in OR_RE.split(metadata_filter or '')]
+
+
+class LocalBackend(FileSearchBackend):
+    """
+    Local retrieval: PDFs are chunked and indexed under MEDIA_ROOT (BM25 postings plus a memory-mapped
+    embedding matrix), queries retrieve the top chunks on this machine and only the final answer generation goes to
+    LOCAL_FILESEARCH_GENERATOR (any backend implementing `generate`).
+
+    Uploads are indexed synchronously, so the returned operation is already done; its `metadata`
+    carries the page/chunk counts and per-stage timings.
+    """
+
+    def __init__(self):
+        self.root = Path(settings.MEDIA_ROOT) / settings.LOCAL_FILESEARCH_INDEX_DIR
+        self._generator = None
+
+    @property
+    def generator(self):
+        if self._generator is None:
+            self._generator = import_string(settings.LOCAL_FILESEARCH_GENERATOR)()
+        return self._generator
+
+    # --- paths -------------------------------------------------------------
+
+    def store_dir(self, store_name):
+        match = STORE_NAME_RE.match(store_name)
+        if not match:
+            raise ValueError(f"Invalid local store name: {store_name}")
+        return self.root / match.group('store')
+
+    def document_dir(self, document_name):
+        match = DOCUMENT_NAME_RE.match(document_name)
+        if not match:
+            raise ValueError(f"Invalid local document name: {document_name}")
+        return self.root / match.group('store') / match.group('document')
+
+    def store_documents(self, store_name, metadata_filter=None):
+        """Yield (document_dir, meta) for the indexed documents of a store matching the filter."""
+
+        wanted = parse_metadata_filter(metadata_filter)
+        store_dir = self.store_dir(store_name)
+        if not store_dir.is_dir():
+            return
+
+        for document_dir in sorted(store_dir.iterdir()):
+            meta_path = document_dir / META_FILE
+            if not meta_path.is_file():
+                continue
+            meta = json.loads(meta_path.read_text(encoding='utf-8'))
+            if any(all(meta['metadata'].get(key) == value for key, value in alternative.items())
+                   for alternative in wanted):
+                yield document_dir, meta
+
+    # --- FileSearchBackend -------------------------------------------------
+
+    def ping(self):
+        self.root.mkdir(parents=True, exist_ok=True)
+        if not os.access(self.root, os.W_OK):
+            raise RuntimeError(f"Index directory {self.root} is not writable")
+        return SimpleNamespace(name=str(self.root))
+
+    def create_store(self, display_name=None):
+        name = f"localStores/{uuid.uuid4().hex}"
+        self.store_dir(name).mkdir(parents=True, exist_ok=True)
+        return SimpleNamespace(name=name, display_name=display_name)
+
+    def evict(self, document_dir):
+        evict_index(str(document_dir))
+        evict_vector_index(str(document_dir))
+
+    def delete_store(self, store_name):
+        store_dir = self.store_dir(store_name)
+        if store_dir.is_dir():
+            for document_dir in store_dir.iterdir():
+                self.evict(document_dir)
+        shutil.rmtree(store_dir, ignore_errors=True)
+
+    def delete_document(self, document_name):
+        document_dir = self.document_dir(document_name)
+        self.evict(document_dir)
+        shutil.rmtree(document_dir, ignore_errors=True)
+
+    def upload_file_to_store(self, store_name, file_path, display_name=None, metadata=None):
+        document_name = f"{store_name}/documents/{uuid.uuid4().hex}"
+        stats = index_document(
+            file_path,
+            str(self.document_dir(document_name)),
+            display_name=display_name,
+            metadata={key: str(value) for key, value in (metadata or {}).items()},
+        )
+        return SimpleNamespace(
+            name=f"{document_name}/operations/index",
+            done=True,
+            error=None,
+            response=SimpleNamespace(document_name=document_name),
+            metadata=stats,
+        )
+
+    def get_operation(self, operation_name):
+        document_name = operation_name.rsplit('/operations/', 1)[0]
+        return SimpleNamespace(
+            name=operation_name,
+            done=True,
+            error=None,
+            response=SimpleNamespace(document_name=document_name),
+        )
+
+    def keyword_ranking(self, documents, query, depth):
+        """Best `depth` chunk keys (document index, chunk id) by BM25, across documents."""
+
+        hits = []
+        for position, (_, document_dir, _) in enumerate(documents):
+            hits.extend(((position, chunk_id), score)
+                        for chunk_id, score in load_index(str(document_dir)).search(query, depth))
+        return heapq.nlargest(depth, hits, key=lambda hit: hit[1])
+
+    def vector_ranking(self, documents, query, depth):
+        """Best `depth` chunk keys by cosine similarity, for documents indexed with the current embedder."""
+
+        embedder = get_embedder()
+        query_vector = embedder.embed([query])[0]
+        hits = []
+        for position, (_, document_dir, meta) in enumerate(documents):
+            if meta.get('embedder') != embedder.name:
+                continue
+            vector_index = load_vector_index(str(document_dir))
+            if vector_index is not None:
+                hits.extend(((position, chunk_id), score) for chunk_id, score in vector_index.search(query_vector, depth))
+        return heapq.nlargest(depth, hits, key=lambda hit: hit[1])
+
+    def chunk_texts(self, documents, keys):
+        """{(document index, chunk id): text}, reading each document's chunks file once."""
+
+        by_document = {}
+        for position, chunk_id in keys:
+            by_document.setdefault(position, []).append(chunk_id)
+
+        texts = {}
+        for position, chunk_ids in by_document.items():
+            chunks = load_index(str(documents[position][1])).get_chunks(chunk_ids)
+            for chunk_id, chunk in zip(chunk_ids, chunks):
+                texts[(position, chunk_id)] = chunk['text']
+        return texts
+
+    def retrieve(self, store_names, query, metadata_filter=None, top_k=None):
+        """
+        Top chunks across every matching document, as (score, text, title, document_name).
+
+        LOCAL_RETRIEVAL_MODE: `bm25`, `vector`, or `hybrid` - both searches run concurrently over a
+        deeper candidate pool, are merged with reciprocal-rank fusion and reranked locally.
+        The result is capped by LOCAL_RETRIEVAL_TOKEN_BUDGET, so generation gets the smallest
+        high-value context.
+        """
+
+        top_k = top_k or settings.LOCAL_RETRIEVAL_TOP_K
+        mode = settings.LOCAL_RETRIEVAL_MODE if get_embedder() is not None else 'bm25'
+
+        documents = [
+            (store_name, document_dir, meta)
+            for store_name in store_names
+            for document_dir, meta in self.store_documents(store_name, metadata_filter)
+        ]
+        if not documents:
+            return []
+
+        if mode == 'hybrid':
+            depth = top_k * settings.LOCAL_HYBRID_CANDIDATE_FACTOR
+            keyword = _search_pool.submit(self.keyword_ranking, documents, query, depth)
+            vector_hits = self.vector_ranking(documents, query, depth)
+            rankings = [[key for key, _ in keyword.result()], [key for key, _ in vector_hits]]
+            hits = reciprocal_rank_fusion(rankings, k=settings.LOCAL_RRF_K)[:depth]
+        elif mode == 'vector':
+            hits = self.vector_ranking(documents, query, top_k)
+        else:
+            hits = self.keyword_ranking(documents, query, top_k)
+
+        texts = self.chunk_texts(documents, [key for key, _ in hits])
+        candidates = [(key, score, texts[key]) for key, score in hits]
+        if mode == 'hybrid':
+            candidates = rerank(query, candidates, weight=settings.LOCAL_RERANK_WEIGHT)
+        candidates = apply_token_budget(candidates, settings.LOCAL_RETRIEVAL_TOKEN_BUDGET, top_k)
+
+        results = []
+        for (position, _), score, text in candidates:
+            store_name, document_dir, meta = documents[position]
+            document_name = f"{store_name}/documents/{document_dir.name}"
+            results.append((score, text, meta.get('display_name'), document_name))
+        return results
+
+    def _response(self, text, hits):
+        chunks = [
+            SimpleNamespace(
+                retrieved_context=SimpleNamespace(text=chunk_text, title=title, document_name=document_name),
+                score=score,
+            )
+            for score, chunk_text, title, document_name in hits
+        ]
+        return SimpleNamespace(
+            text=text,
+            candidates=[SimpleNamespace(
+                content=SimpleNamespace(parts=[SimpleNamespace(text=text)]),
+                grounding_metadata=SimpleNamespace(grounding_chunks=chunks),
+            )],
+        )
+
+    def query_store(self, store_names, query, metadata_filter=None, system_instruction=None):
+        hits = self.retrieve(store_names, query, metadata_filter)
+
+        text = ''
+        if hits:
+            prompt = build_prompt(query, system_instruction, [text for _, text, _, _ in hits])
+            text = self.generator.generate(prompt).text or ''
+
+        return self._response(text, hits)
+
+    def generate(self, prompt):
+        return self.generator.generate(prompt)
+
+    async def aquery_store(self, store_names, query, metadata_filter=None, system_instruction=None):
+        hits = await asyncio.to_thread(self.retrieve, store_names, query, metadata_filter)
+
+        text = ''
+        if hits:
+            prompt = build_prompt(query, system_instruction, [text for _, text, _, _ in hits])
+            text = (await self.generator.agenerate(prompt)).text or ''
+
+        return self._response(text, hits)
+
+    def agenerate(self, prompt):
+        return self.generator.agenerate(prompt)
+
+    async def astream_query_store(self, store_names, query, metadata_filter=None, system_instruction=None):
+        # Retrieval is local CPU/disk work: keep it off the event loop, then stream the generation
+        hits = await asyncio.to_thread(self.retrieve, store_names, query, metadata_filter)
+        if hits:
+            prompt = build_prompt(query, system_instruction, [text for _, text, _, _ in hits])
+            async for chunk in self.generator.astream_generate(prompt):
+                yield SimpleNamespace(text=getattr(chunk, 'text', None) or '', candidates=None)
+        yield self._response('', hits)
+
+    def astream_generate(self, prompt):
+        return self.generator.astream_generate(prompt)
@@ -0,0 +1,174 @@
+import hashlib
+import json
+import logging
+import re
+import threading
+import time
+from collections import Counter, OrderedDict
+
+from django.conf import settings
+from django.core.cache import caches
+
+logger = logging.getLogger(__name__)
+
+WHITESPACE_RE = re.compile(r'\s+')
+
+
+def normalize_query(query):
+    """Case-fold, collapse whitespace and drop trailing punctuation, so trivially different questions share a key."""
+
+    return WHITESPACE_RE.sub(' ', query.casefold()).strip().rstrip('?!. ')
+
+
+class AnswerCache:
+    """
+    Query answers keyed by (store names, metadata filter, normalized query, model, prompt version).
+
+    Two tiers: a bounded in-process LRU and, when ANSWER_CACHE_SHARED_ALIAS names an entry of
+    Django's CACHES (e.g. Redis), a shared tier consulted on local misses. Both expire entries
+    after ANSWER_CACHE_TTL.
+
+    Invalidation bumps a per-store generation that is part of every key, so stale entries are
+    simply never read again. Generations live in the shared tier when there is one, so
+    invalidation reaches every process; without it, each process only sees its own
+    invalidations and relies on the TTL for the rest.
+    """
+
+    def __init__(self, max_entries, ttl, shared_alias=None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.shared = caches[shared_alias] if shared_alias else None
+        self._entries = OrderedDict()
+        self._generations = {}
+        self._lock = threading.Lock()
+        self.stats = Counter()
+
+    # --- keys ----------------------------------------------------------------
+
+    def generation_key(self, store_name):
+        return f"answer-cache:generation:{store_name}"
+
+    def generations(self, store_names):
+        if self.shared is not None:
+            keys = {self.generation_key(store_name): store_name for store_name in store_names}
+            found = self.shared.get_many(list(keys))
+            return {store_name: found.get(key, 0) for key, store_name in keys.items()}
+        with self._lock:
+            return {store_name: self._generations.get(store_name, 0) for store_name in store_names}
+
+    def scope_key(self, store_names, metadata_filter=None, prompt_version=None):
+        """Everything but the query: answers under one scope come from the same store contents and prompt."""
+
+        generations = self.generations(sorted(set(store_names)))
+        payload = json.dumps([
+            settings.FILESEARCH_BACKEND,
+            settings.GEMINI_MODEL,
+            prompt_version,
+            sorted(generations.items()),
+            metadata_filter,
+        ])
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def make_key(self, scope, query):
+        digest = hashlib.sha256(f"{scope}|{normalize_query(query)}".encode('utf-8')).hexdigest()
+        return f"answer-cache:{digest}"
+
+    # --- entries -------------------------------------------------------------
+
+    def get(self, key):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > now:
+                self._entries.move_to_end(key)
+                self.stats['local_hits'] += 1
+                return entry[1]
+            if entry is not None:
+                del self._entries[key]
+
+        value = self.shared.get(key) if self.shared is not None else None
+        with self._lock:
+            if value is None:
+                self.stats['misses'] += 1
+                return None
+            self.stats['shared_hits'] += 1
+        self._store_local(key, value)
+        return value
+
+    def set(self, key, value):
+        self._store_local(key, value)
+        if self.shared is not None:
+            self.shared.set(key, value, timeout=self.ttl)
+
+    def _store_local(self, key, value):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.stats['evictions'] += 1
+
+    def invalidate(self, store_names):
+        store_names = [store_name for store_name in store_names if store_name]
+        if not store_names:
+            return
+
+        with self._lock:
+            for store_name in store_names:
+                self._generations[store_name] = self._generations.get(store_name, 0) + 1
+            self.stats['invalidations'] += len(store_names)
+
+        if self.shared is not None:
+            for store_name in store_names:
+                key = self.generation_key(store_name)
+                # Generations must outlive the entries they guard
+                self.shared.add(key, 0, timeout=None)
+                try:
+                    self.shared.incr(key)
+                except ValueError:
+                    self.shared.set(key, 1, timeout=None)
+
+    def snapshot(self):
+        with self._lock:
+            lookups = self.stats['local_hits'] + self.stats['shared_hits'] + self.stats['misses']
+            hits = self.stats['local_hits'] + self.stats['shared_hits']
+            return {
+                'enabled': settings.ANSWER_CACHE_ENABLED,
+                'entries': len(self._entries),
+                'max_entries': self.max_entries,
+                'ttl': self.ttl,
+                'shared_tier': self.shared is not None,
+                'hits': hits,
+                'local_hits': self.stats['local_hits'],
+                'shared_hits': self.stats['shared_hits'],
+                'misses': self.stats['misses'],
+                'hit_rate': round(hits / lookups, 4) if lookups else None,
+                'evictions': self.stats['evictions'],
+                'invalidations': self.stats['invalidations'],
+            }
+
+
+_answer_cache = None
+_answer_cache_lock = threading.Lock()
+
+
+def get_answer_cache():
+    global _answer_cache
+    if _answer_cache is None:
+        with _answer_cache_lock:
+            if _answer_cache is None:
+                _answer_cache = AnswerCache(
+                    max_entries=settings.ANSWER_CACHE_MAX_ENTRIES,
+                    ttl=settings.ANSWER_CACHE_TTL,
+                    shared_alias=settings.ANSWER_CACHE_SHARED_ALIAS or None,
+                )
+    return _answer_cache
+
+
+def invalidate_answers(*store_names):
+    """Drop cached answers of stores whose content changed (document ingested or deleted)."""
+
+    try:
+        get_answer_cache().invalidate(store_names)
+    except Exception:
+        logger.exception("Failed to invalidate cached answers for %s", store_names)
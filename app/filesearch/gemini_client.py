@@ -1,49 +1,224 @@
+import logging
 import os
+import threading
+import time
+
+from asgiref.sync import sync_to_async
 from django.conf import settings
+from django.utils.module_loading import import_string
+
+from app.core.metrics import add_external_time, external_call
+from app.filesearch.ratelimit import build_rate_limiter, quota_retry_delay, response_tokens, RateLimited, \
+    INTERACTIVE, BACKGROUND
+from app.filesearch.resilience import build_bulkhead, GeminiUnavailable, QUERY_CALLS, UPLOAD_CALLS, OPERATION_CALLS, \
+    STORE_CALLS
+
+logger = logging.getLogger(__name__)
+
+
+def load_backend():
+    """Instantiate the backend configured in FILESEARCH_BACKEND (dotted path)."""
+
+    return import_string(settings.FILESEARCH_BACKEND)()
 
-try:
-    from google import genai
-    from google.genai import types
-except Exception:
-    genai = None
-    types = None
+
+def is_quota_error(exc):
+    return getattr(exc, 'code', None) == 429
 
 
 class GeminiClientWrapper:
-    def __init__(self):
-        api_key = os.getenv('GOOGLE_API_KEY') or getattr(settings, 'GOOGLE_API_KEY', None)
-        if not api_key:
-            raise RuntimeError('GOOGLE_API_KEY is not set')
-
-        if genai is None:
-            raise RuntimeError('google-genai library is not available')
-
-        self.client = genai.Client(api_key=api_key)
-
-    def create_store(self):
-        # create a new file search store
-        return self.client.file_search_stores.create()
-
-    def upload_file_to_store(self, store_name: str, file_path: str):
-        # returns operation object
-        return self.client.file_search_stores.upload_to_file_search_store(
-            file_search_store_name=store_name,
-            file=file_path
-        )
-
-    def query_store(self, store_name: str, query: str):
-        # Use models.generate_content with file_search tool
-        response = self.client.models.generate_content(
-            model='gemini-2.5-flash',
-            contents=query,
-            config=types.GenerateContentConfig(
-                tools=[
-                    types.Tool(
-                        file_search=types.FileSearch(
-                            file_search_store_names=[store_name]
-                        )
-                    )
-                ]
-            )
-        )
+    def __init__(self, backend=None, bulkhead=None, rate_limiter=None):
+        # Real Gemini, the offline fake, ... - see app/filesearch/backends
+        self.backend = backend or load_backend()
+        # Circuit breaker and adaptive concurrency limit: calls fail fast with GeminiUnavailable
+        # instead of piling up behind a slow or failing upstream (ping bypasses it for health checks)
+        self.bulkhead = bulkhead or build_bulkhead()
+        # Requests/tokens per minute quota shared by all workers (None: no quota configured)
+        self.rate_limiter = rate_limiter if rate_limiter is not None else build_rate_limiter()
+
+    def _quota_exceeded(self, exc):
+        delay = quota_retry_delay(exc)
+        if self.rate_limiter is not None:
+            self.rate_limiter.penalize(delay)
+        return RateLimited("Gemini quota exceeded", delay or 1.0)
+
+    def _call(self, priority, call_class, method, *args, **kwargs):
+        reserved = self.rate_limiter.acquire(priority) if self.rate_limiter is not None else None
+        try:
+            with self.bulkhead.guard(call_class), external_call():
+                response = method(*args, **kwargs)
+        except GeminiUnavailable:
+            # Refused by the bulkhead (circuit open, concurrency limit): nothing reached Gemini
+            if self.rate_limiter is not None:
+                self.rate_limiter.refund(reserved)
+            raise
+        except Exception as exc:
+            if is_quota_error(exc):
+                raise self._quota_exceeded(exc) from exc
+            raise
+        if self.rate_limiter is not None:
+            self.rate_limiter.settle(reserved, response_tokens(response))
+        return response
+
+    async def _acall(self, priority, call_class, method, *args, **kwargs):
+        reserved = await self.rate_limiter.aacquire(priority) if self.rate_limiter is not None else None
+        try:
+            async with self.bulkhead.aguard(call_class):
+                with external_call():
+                    response = await method(*args, **kwargs)
+        except GeminiUnavailable:
+            if self.rate_limiter is not None:
+                await sync_to_async(self.rate_limiter.refund)(reserved)
+            raise
+        except Exception as exc:
+            if is_quota_error(exc):
+                raise await sync_to_async(self._quota_exceeded)(exc) from exc
+            raise
+        if self.rate_limiter is not None:
+            await sync_to_async(self.rate_limiter.settle)(reserved, response_tokens(response))
         return response
+
+    def ping(self):
+        return self.backend.ping()
+
+    # Ingestion and cleanup: background priority, queries go first when quota is short
+
+    def create_store(self, display_name: str = None):
+        return self._call(BACKGROUND, STORE_CALLS, self.backend.create_store, display_name=display_name)
+
+    def delete_store(self, store_name: str):
+        return self._call(BACKGROUND, STORE_CALLS, self.backend.delete_store, store_name)
+
+    def delete_document(self, document_name: str):
+        return self._call(BACKGROUND, STORE_CALLS, self.backend.delete_document, document_name)
+
+    def upload_file_to_store(self, store_name: str, file_path: str, display_name: str = None, metadata: dict = None):
+        return self._call(BACKGROUND, UPLOAD_CALLS, self.backend.upload_file_to_store, store_name, file_path,
+                          display_name=display_name, metadata=metadata)
+
+    def get_operation(self, operation_name: str):
+        return self._call(BACKGROUND, OPERATION_CALLS, self.backend.get_operation, operation_name)
+
+    # Queries: interactive priority
+
+    def query_store(self, store_names, query: str, metadata_filter: str = None, system_instruction: str = None):
+        if isinstance(store_names, str):
+            store_names = [store_names]
+        return self._call(INTERACTIVE, QUERY_CALLS, self.backend.query_store, list(store_names), query,
+                          metadata_filter=metadata_filter, system_instruction=system_instruction)
+
+    def generate(self, prompt: str):
+        return self._call(INTERACTIVE, QUERY_CALLS, self.backend.generate, prompt)
+
+    async def aquery_store(self, store_names, query: str, metadata_filter: str = None, system_instruction: str = None):
+        if isinstance(store_names, str):
+            store_names = [store_names]
+        return await self._acall(INTERACTIVE, QUERY_CALLS, self.backend.aquery_store, list(store_names), query,
+                                 metadata_filter=metadata_filter, system_instruction=system_instruction)
+
+    async def agenerate(self, prompt: str):
+        return await self._acall(INTERACTIVE, QUERY_CALLS, self.backend.agenerate, prompt)
+
+    async def astream_query_store(self, store_names, query: str, metadata_filter: str = None,
+                                  system_instruction: str = None):
+        # Async iterator of partial responses (text deltas, grounding metadata at the end);
+        # holds its concurrency slot until the stream ends
+        if isinstance(store_names, str):
+            store_names = [store_names]
+        reserved = await self.rate_limiter.aacquire(INTERACTIVE) if self.rate_limiter is not None else None
+        used = None
+        try:
+            async with self.bulkhead.aguard(QUERY_CALLS) as call:
+                # Only the time spent waiting for chunks counts as Gemini time, not the client's reads
+                waiting = time.perf_counter()
+                async for chunk in self.backend.astream_query_store(list(store_names), query,
+                                                                    metadata_filter=metadata_filter,
+                                                                    system_instruction=system_instruction):
+                    add_external_time(time.perf_counter() - waiting)
+                    # The concurrency limit adapts to the time to the first chunk: the rest of the stream
+                    # goes at the pace the client reads it, which says nothing about Gemini's load
+                    call.first_response()
+                    # Usage is reported with the last chunk
+                    used = response_tokens(chunk) or used
+                    yield chunk
+                    waiting = time.perf_counter()
+                add_external_time(time.perf_counter() - waiting)
+        except GeminiUnavailable:
+            if self.rate_limiter is not None:
+                await sync_to_async(self.rate_limiter.refund)(reserved)
+            raise
+        except Exception as exc:
+            if is_quota_error(exc):
+                raise await sync_to_async(self._quota_exceeded)(exc) from exc
+            raise
+        if self.rate_limiter is not None:
+            await sync_to_async(self.rate_limiter.settle)(reserved, used)
+
+
+_clients = {}
+_clients_lock = threading.Lock()
+_health = {'checked': 0.0, 'result': None}
+
+
+def get_client():
+    """
+    Return the process-wide GeminiClientWrapper.
+
+    The client (and its HTTP connection pool) is reused by every request and thread of the
+    process. It is keyed by pid so a worker forked from a preloaded master opens its own
+    connections instead of sharing the parent's sockets.
+    """
+
+    pid = os.getpid()
+    client = _clients.get(pid)
+    if client is None:
+        with _clients_lock:
+            client = _clients.get(pid)
+            if client is None:
+                _clients.clear()
+                client = _clients[pid] = GeminiClientWrapper()
+    return client
+
+
+def reset_clients():
+    with _clients_lock:
+        _clients.clear()
+
+
+def warm_up():
+    """Build the shared client and open its first connection (TLS handshake) before serving traffic."""
+
+    if not settings.GEMINI_WARMUP_ON_START:
+        return False
+
+    try:
+        started = time.monotonic()
+        get_client().ping()
+        logger.info("Gemini client warmed up in %.0f ms", (time.monotonic() - started) * 1000)
+        return True
+    except Exception:
+        logger.exception("Gemini client warm-up failed")
+        return False
+
+
+def health_check():
+    """Round trip through the shared client (cached for GEMINI_HEALTH_CHECK_TTL seconds), plus the circuit state."""
+
+    now = time.monotonic()
+    if _health['result'] is None or now - _health['checked'] >= settings.GEMINI_HEALTH_CHECK_TTL:
+        _health['checked'], _health['result'] = now, ping_result()
+
+    breaker = get_client().bulkhead.breaker
+    return {**_health['result'], 'circuit': breaker.state if breaker is not None else None}
+
+
+def ping_result():
+    result = {'healthy': True, 'latency_ms': None, 'error': None}
+    try:
+        started = time.monotonic()
+        get_client().ping()
+        result['latency_ms'] = round((time.monotonic() - started) * 1000, 1)
+    except Exception as exc:
+        result['healthy'] = False
+        result['error'] = str(exc)
+    return result
@@ -0,0 +1,257 @@
+import logging
+import os
+import random
+import socket
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction, close_old_connections
+from django.db.models import Q
+from django.utils import timezone
+
+from app.core.metrics import INGESTION_STAGE_METRIC, observe
+from app.filesearch.models import FileSearchStore, IngestionJob
+from app.filesearch.processing import process_file_search_store, release_user_store
+
+logger = logging.getLogger(__name__)
+
+
+def enqueue_ingestion(store):
+    """Queue a FileSearchStore for ingestion by the worker pool."""
+
+    return IngestionJob.objects.create(
+        store=store,
+        max_attempts=settings.INGESTION_JOB_MAX_ATTEMPTS,
+    )
+
+
+def compute_retry_delay(attempts):
+    """Exponential backoff with full jitter, capped at INGESTION_JOB_RETRY_MAX_DELAY."""
+
+    delay = settings.INGESTION_JOB_RETRY_BASE_DELAY * (2 ** max(attempts - 1, 0))
+    delay = min(delay, settings.INGESTION_JOB_RETRY_MAX_DELAY)
+    return random.uniform(delay / 2, delay)
+
+
+def claim_jobs(worker_id, limit):
+    """
+    Claim up to `limit` runnable jobs for this worker.
+
+    Rows are locked with SELECT ... FOR UPDATE SKIP LOCKED so workers on other nodes
+    never claim the same job. RUNNING jobs whose lease expired (worker crashed and
+    stopped renewing it, see renew_leases) are picked up again, unless they already used
+    all their attempts: a file that kills every worker running it is failed instead.
+    """
+
+    if limit <= 0:
+        return []
+
+    now = timezone.now()
+    lease_expired = now - timedelta(seconds=settings.INGESTION_JOB_LEASE_TIMEOUT)
+
+    with transaction.atomic():
+        candidates = list(
+            IngestionJob.objects
+            .select_for_update(skip_locked=True)
+            .filter(
+                Q(status=IngestionJob.JobStatus.PENDING, run_after__lte=now) |
+                Q(status=IngestionJob.JobStatus.RUNNING, locked_at__lt=lease_expired)
+            )
+            .order_by('run_after', 'id')[:limit]
+        )
+
+        jobs, exhausted = [], []
+        for job in candidates:
+            if job.status == IngestionJob.JobStatus.RUNNING and job.attempts >= job.max_attempts:
+                exhausted.append(job)
+                continue
+            job.status = IngestionJob.JobStatus.RUNNING
+            job.attempts += 1
+            job.locked_by = worker_id
+            job.locked_at = now
+            job.updated = now
+            jobs.append(job)
+
+        IngestionJob.objects.bulk_update(jobs, ['status', 'attempts', 'locked_by', 'locked_at', 'updated'])
+
+        for job in exhausted:
+            logger.error("Ingestion job %s lost its lease on its last attempt, failing it", job.id)
+            job.status = IngestionJob.JobStatus.FAILED
+            job.last_error = f"Ingestion did not finish after {job.attempts} attempts"
+            job.locked_by = None
+            job.locked_at = None
+            job.updated = now
+            FileSearchStore.objects.filter(id=job.store_id).update(
+                status=FileSearchStore.StoreStatus.FAILED,
+                error_message=job.last_error,
+                updated=now,
+            )
+            release_user_store(job.store_id)
+        IngestionJob.objects.bulk_update(exhausted, ['status', 'last_error', 'locked_by', 'locked_at', 'updated'])
+
+    return jobs
+
+
+def renew_leases(worker_id, job_ids):
+    """Extend the lease of jobs this worker is still running, so a long ingestion is not claimed twice."""
+
+    if not job_ids:
+        return 0
+
+    now = timezone.now()
+    return IngestionJob.objects.filter(
+        id__in=job_ids, status=IngestionJob.JobStatus.RUNNING, locked_by=worker_id,
+    ).update(locked_at=now, updated=now)
+
+
+def run_job(job):
+    """Run one claimed job and record its outcome (success, retry or terminal failure)."""
+
+    close_old_connections()
+    # Time the job sat in the queue after it became due (retries count from their backoff)
+    queue_wait = round(max((job.locked_at - max(job.run_after, job.created)).total_seconds(), 0.0), 4)
+    observe(INGESTION_STAGE_METRIC, queue_wait, stage='queue_wait')
+    try:
+        process_file_search_store(job.store_id, timings={'queue_wait': queue_wait})
+    except Exception as exc:
+        logger.exception("Ingestion job %s failed (attempt %s/%s)", job.id, job.attempts, job.max_attempts)
+        _record_failure(job, exc)
+    else:
+        # The upload was started (or is done): if remote processing fails later, the poller
+        # requeues the job (retry_failed_operations)
+        IngestionJob.objects.filter(id=job.id, locked_by=job.locked_by).update(
+            status=IngestionJob.JobStatus.SUCCEEDED,
+            locked_by=None,
+            locked_at=None,
+            updated=timezone.now(),
+        )
+    finally:
+        close_old_connections()
+
+
+def _record_failure(job, exc):
+    now = timezone.now()
+
+    if job.attempts < job.max_attempts:
+        IngestionJob.objects.filter(id=job.id, locked_by=job.locked_by).update(
+            status=IngestionJob.JobStatus.PENDING,
+            # Gemini circuit open / overloaded: not before it is worth trying again
+            run_after=now + timedelta(seconds=max(compute_retry_delay(job.attempts), getattr(exc, 'retry_after', 0))),
+            last_error=str(exc),
+            locked_by=None,
+            locked_at=None,
+            updated=now,
+        )
+        # Back in the queue; error_message keeps the last failure for the client.
+        FileSearchStore.objects.filter(id=job.store_id).update(
+            status=FileSearchStore.StoreStatus.CREATED,
+            updated=now,
+        )
+        return
+
+    IngestionJob.objects.filter(id=job.id, locked_by=job.locked_by).update(
+        status=IngestionJob.JobStatus.FAILED,
+        last_error=str(exc),
+        locked_by=None,
+        locked_at=None,
+        updated=now,
+    )
+    release_user_store(job.store_id)
+
+
+def retry_failed_operations(errors):
+    """
+    Requeue the ingestion of documents whose remote processing failed after the upload was started.
+
+    `errors` maps document ids to the failure the poller saw. The job already SUCCEEDED when the
+    upload was handed to the poller; it goes back to PENDING with the same backoff as a failed
+    attempt, or to FAILED once it used all its attempts. Returns the ids of the requeued documents.
+    """
+
+    now = timezone.now()
+    requeued = set()
+    # Latest job of each document
+    jobs = {job.store_id: job for job in IngestionJob.objects.filter(
+        store_id__in=errors, status=IngestionJob.JobStatus.SUCCEEDED,
+    ).order_by('id')}
+
+    for job in jobs.values():
+        error = errors[job.store_id]
+        if job.attempts < job.max_attempts:
+            updated = IngestionJob.objects.filter(id=job.id, status=IngestionJob.JobStatus.SUCCEEDED).update(
+                status=IngestionJob.JobStatus.PENDING,
+                run_after=now + timedelta(seconds=compute_retry_delay(job.attempts)),
+                last_error=error,
+                updated=now,
+            )
+            if updated:
+                requeued.add(job.store_id)
+        else:
+            IngestionJob.objects.filter(id=job.id, status=IngestionJob.JobStatus.SUCCEEDED).update(
+                status=IngestionJob.JobStatus.FAILED,
+                last_error=error,
+                updated=now,
+            )
+            release_user_store(job.store_id)
+    return requeued
+
+
+class IngestionWorker:
+    """Claims ingestion jobs from the database and runs up to `concurrency` of them at a time."""
+
+    def __init__(self, concurrency=None, poll_interval=None):
+        self.concurrency = concurrency or settings.INGESTION_WORKER_CONCURRENCY
+        self.poll_interval = poll_interval or settings.INGESTION_WORKER_POLL_INTERVAL
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}"
+        self._stop = threading.Event()
+        self._last_heartbeat = 0.0
+
+    def stop(self):
+        self._stop.set()
+
+    def run(self, once=False):
+        logger.info("Ingestion worker %s started with concurrency %s", self.worker_id, self.concurrency)
+        # {future: job id}
+        in_flight = {}
+
+        with ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix='ingestion') as executor:
+            while not self._stop.is_set():
+                in_flight = {future: job_id for future, job_id in in_flight.items() if not future.done()}
+                self.heartbeat(in_flight.values())
+
+                try:
+                    jobs = claim_jobs(self.worker_id, self.concurrency - len(in_flight))
+                except Exception:
+                    logger.exception("Failed to claim ingestion jobs")
+                    jobs = []
+
+                for job in jobs:
+                    in_flight[executor.submit(run_job, job)] = job.id
+
+                if once and not in_flight:
+                    break
+
+                # Poll quickly while there is spare capacity and work was found
+                if jobs and len(in_flight) < self.concurrency:
+                    continue
+                self._stop.wait(self.poll_interval)
+
+            # Jobs still finishing after a stop keep their leases until they are done
+            while in_flight:
+                done, _ = wait(in_flight, timeout=self.poll_interval)
+                in_flight = {future: job_id for future, job_id in in_flight.items() if future not in done}
+                self.heartbeat(in_flight.values())
+
+        logger.info("Ingestion worker %s stopped", self.worker_id)
+
+    def heartbeat(self, job_ids):
+        if time.monotonic() - self._last_heartbeat < settings.INGESTION_JOB_HEARTBEAT_INTERVAL:
+            return
+        self._last_heartbeat = time.monotonic()
+        try:
+            renew_leases(self.worker_id, list(job_ids))
+        except Exception:
+            logger.exception("Failed to renew ingestion job leases")
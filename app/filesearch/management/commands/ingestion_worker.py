@@ -0,0 +1,28 @@
+import signal
+
+from django.core.management.base import BaseCommand
+
+from app.filesearch.jobs import IngestionWorker
+
+
+class Command(BaseCommand):
+    help = 'Run the document ingestion worker. Safe to run on several nodes against the same database.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--concurrency', type=int, default=None,
+                            help='Number of jobs run concurrently (defaults to INGESTION_WORKER_CONCURRENCY)')
+        parser.add_argument('--poll-interval', type=float, default=None,
+                            help='Seconds to wait between queue polls (defaults to INGESTION_WORKER_POLL_INTERVAL)')
+        parser.add_argument('--once', action='store_true',
+                            help='Drain the currently runnable jobs and exit')
+
+    def handle(self, *args, **options):
+        worker = IngestionWorker(concurrency=options['concurrency'], poll_interval=options['poll_interval'])
+
+        # Finish in-flight jobs on SIGTERM/SIGINT instead of abandoning their leases
+        signal.signal(signal.SIGTERM, lambda *_: worker.stop())
+        signal.signal(signal.SIGINT, lambda *_: worker.stop())
+
+        self.stdout.write(f"Starting ingestion worker {worker.worker_id} (concurrency={worker.concurrency})")
+        worker.run(once=options['once'])
+        self.stdout.write(self.style.SUCCESS('Ingestion worker stopped'))
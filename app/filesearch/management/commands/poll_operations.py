@@ -0,0 +1,27 @@
+import signal
+
+from django.core.management.base import BaseCommand
+
+from app.filesearch.poller import OperationPoller
+
+
+class Command(BaseCommand):
+    help = 'Poll pending Gemini upload operations in batches and mark their documents READY/FAILED.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=None,
+                            help='Operations claimed per round (defaults to OPERATION_POLLER_BATCH_SIZE)')
+        parser.add_argument('--concurrency', type=int, default=None,
+                            help='Parallel status requests per round (defaults to OPERATION_POLLER_CONCURRENCY)')
+        parser.add_argument('--once', action='store_true',
+                            help='Poll the operations that are currently due and exit')
+
+    def handle(self, *args, **options):
+        poller = OperationPoller(batch_size=options['batch_size'], concurrency=options['concurrency'])
+
+        signal.signal(signal.SIGTERM, lambda *_: poller.stop())
+        signal.signal(signal.SIGINT, lambda *_: poller.stop())
+
+        self.stdout.write('Starting operation poller')
+        poller.run(once=options['once'])
+        self.stdout.write(self.style.SUCCESS('Operation poller stopped'))
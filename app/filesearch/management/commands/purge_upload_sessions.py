@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from app.filesearch.uploads import purge_expired_sessions
+
+
+class Command(BaseCommand):
+    help = 'Delete the partial files of expired resumable upload sessions.'
+
+    def handle(self, *args, **options):
+        count = purge_expired_sessions()
+        self.stdout.write(self.style.SUCCESS(f'Purged {count} expired upload sessions'))
@@ -0,0 +1,33 @@
+# Generated by Django 5.1.4 on 2026-10-17 12:50
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('filesearch', '0003_ingestionjob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='filesearchstore',
+            name='next_poll_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='filesearchstore',
+            name='operation_name',
+            field=models.CharField(blank=True, max_length=512, null=True),
+        ),
+        migrations.AddField(
+            model_name='filesearchstore',
+            name='operation_started',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='filesearchstore',
+            name='poll_attempts',
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.1.4 on 2026-10-17 12:50
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('filesearch', '0004_filesearchstore_next_poll_at_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='filesearchstore',
+            name='content_hash',
+            field=models.CharField(blank=True, db_index=True, max_length=64, null=True),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.1.4 on 2026-10-17 12:50
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('filesearch', '0007_filesearchstore_remote_document_name_userremotestore_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='filesearchstore',
+            name='ingestion_timings',
+            field=models.JSONField(blank=True, default=dict),
+        ),
+    ]
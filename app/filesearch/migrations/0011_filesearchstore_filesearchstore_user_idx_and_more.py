@@ -0,0 +1,33 @@
+# Generated by Django 5.1.4 on 2026-10-17 12:50
+
+import django.contrib.postgres.indexes
+import django.db.models.functions.text
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('filesearch', '0010_ratelimitbucket'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='filesearchstore',
+            index=models.Index(condition=models.Q(('is_active', True)), fields=['user', '-created'], name='filesearchstore_user_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='filesearchstore',
+            index=models.Index(condition=models.Q(('is_active', True)), fields=['user', 'status', '-created'], name='filesearchstore_status_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='filesearchstore',
+            index=models.Index(django.contrib.postgres.indexes.OpClass(django.db.models.functions.text.Upper('title'), name='text_pattern_ops'), condition=models.Q(('is_active', True)), name='filesearchstore_title_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='filesearchstore',
+            index=models.Index(condition=models.Q(('operation_name__isnull', False), ('status', 'PROCESSING')), fields=['next_poll_at'], name='filesearchstore_poll_idx'),
+        ),
+    ]
@@ -1,9 +1,27 @@
+import uuid
+
 from django.contrib.auth import get_user_model
+from django.contrib.postgres.indexes import OpClass
 from django.db import models
+from django.db.models import Q
+from django.db.models.functions import Upper
+from django.utils import timezone
 
 
 # Create your models here.
 
+class UserRemoteStore(models.Model):
+    """ Model: Remote file search store shared by several documents of one user (FILESEARCH_STORE_MODE='per_user') """
+
+    user = models.ForeignKey(get_user_model(), on_delete=models.CASCADE, related_name='remote_stores')
+    store_name = models.CharField(max_length=512, unique=True)
+    document_count = models.PositiveIntegerField(default=0)
+
+    created = models.DateTimeField(auto_now_add=True)
+    updated = models.DateTimeField(auto_now=True)
+    is_active = models.BooleanField(default=True)
+
+
 class FileSearchStore(models.Model):
 
     class StoreStatus(models.TextChoices):
@@ -18,13 +36,121 @@ class FileSearchStore(models.Model):
     title = models.CharField(max_length=255)
     file = models.FileField(upload_to='uploads/filesearch/')
     store_name = models.CharField(max_length=512, blank=True, null=True)
+    content_hash = models.CharField(max_length=64, blank=True, null=True, db_index=True)
+
+    # Set when the document lives in a shared per-user store; remote_document_name maps it to its remote file
+    remote_store = models.ForeignKey(UserRemoteStore, on_delete=models.SET_NULL, blank=True, null=True,
+                                     related_name='documents')
+    remote_document_name = models.CharField(max_length=512, blank=True, null=True)
+
     status = models.CharField(max_length=32, choices=StoreStatus.choices, default=StoreStatus.CREATED)
 
     error_message = models.TextField(blank=True, null=True)
 
+    # Pending remote upload operation, tracked by the shared poller (manage.py poll_operations)
+    operation_name = models.CharField(max_length=512, blank=True, null=True)
+    operation_started = models.DateTimeField(blank=True, null=True)
+    next_poll_at = models.DateTimeField(blank=True, null=True)
+    poll_attempts = models.PositiveIntegerField(default=0)
+
+    # Seconds spent per ingestion stage (create_store, upload, extract, chunk_index, ...)
+    ingestion_timings = models.JSONField(default=dict, blank=True)
+
 
     created = models.DateTimeField(auto_now_add=True)
     updated = models.DateTimeField(auto_now=True)
     is_active = models.BooleanField(default=True)
 
+    class Meta:
+        indexes = [
+            # Document list: user's active documents, newest first
+            models.Index(fields=['user', '-created'], condition=Q(is_active=True),
+                         name='filesearchstore_user_idx'),
+            # Query targets: user's active READY documents, newest first
+            models.Index(fields=['user', 'status', '-created'], condition=Q(is_active=True),
+                         name='filesearchstore_status_idx'),
+            # Document list title filter (istartswith compares UPPER(title) with LIKE 'X%')
+            models.Index(OpClass(Upper('title'), name='text_pattern_ops'), condition=Q(is_active=True),
+                         name='filesearchstore_title_idx'),
+            # Operation poller: due PROCESSING operations
+            models.Index(fields=['next_poll_at'], condition=Q(status='PROCESSING', operation_name__isnull=False),
+                         name='filesearchstore_poll_idx'),
+        ]
+
+
+class IngestionJob(models.Model):
+    """ Model: Durable ingestion job claimed by `manage.py ingestion_worker` """
+
+    class JobStatus(models.TextChoices):
+        PENDING = 'PENDING', 'Pending'
+        RUNNING = 'RUNNING', 'Running'
+        SUCCEEDED = 'SUCCEEDED', 'Succeeded'
+        FAILED = 'FAILED', 'Failed'
+
 
+    store = models.ForeignKey(FileSearchStore, on_delete=models.CASCADE, related_name='ingestion_jobs')
+    status = models.CharField(max_length=32, choices=JobStatus.choices, default=JobStatus.PENDING)
+
+    # Retry bookkeeping
+    attempts = models.PositiveIntegerField(default=0)
+    max_attempts = models.PositiveIntegerField(default=5)
+    run_after = models.DateTimeField(default=timezone.now)
+    last_error = models.TextField(blank=True, null=True)
+
+    # Lease held by the worker currently running the job
+    locked_by = models.CharField(max_length=255, blank=True, null=True)
+    locked_at = models.DateTimeField(blank=True, null=True)
+
+    created = models.DateTimeField(auto_now_add=True)
+    updated = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'run_after'], name='ingestionjob_status_run_idx'),
+        ]
+
+
+class UploadSession(models.Model):
+    """ Model: Resumable (tus-style) upload in progress """
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    user = models.ForeignKey(get_user_model(), on_delete=models.CASCADE, related_name='upload_sessions')
+    title = models.CharField(max_length=255)
+    filename = models.CharField(max_length=255)
+
+    # Byte accounting; the partial file always holds exactly `offset` bytes
+    upload_length = models.BigIntegerField()
+    offset = models.BigIntegerField(default=0)
+    partial_file = models.CharField(max_length=512)
+
+    # Set once the upload is finalized
+    document = models.ForeignKey(FileSearchStore, on_delete=models.SET_NULL, blank=True, null=True,
+                                 related_name='upload_sessions')
+
+    expires = models.DateTimeField()
+    created = models.DateTimeField(auto_now_add=True)
+    updated = models.DateTimeField(auto_now=True)
+    is_active = models.BooleanField(default=True)
+
+
+class QueryLock(models.Model):
+    """ Model: Cross-process single-flight lease on an in-flight query (see app.filesearch.singleflight) """
+
+    key = models.CharField(max_length=128, unique=True)
+    owner = models.CharField(max_length=255)
+    expires = models.DateTimeField(db_index=True)
+
+    created = models.DateTimeField(auto_now_add=True)
+
+
+class RateLimitBucket(models.Model):
+    """ Model: Token bucket shared by every worker calling Gemini (see app.filesearch.ratelimit) """
+
+    name = models.CharField(max_length=64, unique=True)
+    tokens = models.FloatField()
+    # Refill rate in tokens per second; lowered on quota errors, recovers towards the configured quota
+    rate = models.FloatField()
+    refilled = models.DateTimeField()
+    blocked_until = models.DateTimeField(blank=True, null=True)
+
+    updated = models.DateTimeField(auto_now=True)
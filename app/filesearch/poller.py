@@ -0,0 +1,176 @@
+import logging
+import random
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction, close_old_connections
+from django.db.models import Min
+from django.utils import timezone
+
+from app.core.metrics import INGESTION_STAGE_METRIC, observe
+from app.filesearch.cache import invalidate_answers
+from app.filesearch.gemini_client import get_client
+from app.filesearch.jobs import retry_failed_operations
+from app.filesearch.models import FileSearchStore
+from app.filesearch.processing import operation_error_message, remote_document_name
+
+logger = logging.getLogger(__name__)
+
+
+def compute_poll_delay(poll_attempts):
+    """Exponential backoff between polls of one operation, with +/-20% jitter."""
+
+    delay = settings.OPERATION_POLL_BASE_DELAY * (2 ** poll_attempts)
+    delay = min(delay, settings.OPERATION_POLL_MAX_DELAY)
+    return delay * random.uniform(0.8, 1.2)
+
+
+def pending_operations():
+    return FileSearchStore.objects.filter(
+        status=FileSearchStore.StoreStatus.PROCESSING,
+        operation_name__isnull=False,
+    )
+
+
+class OperationPoller:
+    """
+    Polls every pending upload operation from one place.
+
+    Each round claims the operations that are due (SELECT ... FOR UPDATE SKIP LOCKED, so
+    several pollers can run side by side), checks them with a small thread pool and writes
+    the outcomes back in bulk. Operations are looked up by the name stored on the row, so a
+    restarted poller resumes where the previous one stopped.
+    """
+
+    def __init__(self, batch_size=None, concurrency=None, max_idle=None):
+        self.batch_size = batch_size or settings.OPERATION_POLLER_BATCH_SIZE
+        self.concurrency = concurrency or settings.OPERATION_POLLER_CONCURRENCY
+        self.max_idle = max_idle or settings.OPERATION_POLL_MAX_DELAY
+        self._stop = threading.Event()
+
+    def stop(self):
+        self._stop.set()
+
+    def claim_due(self):
+        now = timezone.now()
+
+        with transaction.atomic():
+            stores = list(
+                pending_operations()
+                .select_for_update(skip_locked=True)
+                .filter(next_poll_at__lte=now)
+                .order_by('next_poll_at')[:self.batch_size]
+            )
+            # Lease the rows so other pollers skip them while we talk to the API
+            lease_until = now + timedelta(seconds=settings.OPERATION_POLL_MAX_DELAY)
+            FileSearchStore.objects.filter(id__in=[store.id for store in stores]).update(next_poll_at=lease_until)
+
+        return stores
+
+    def poll_once(self):
+        """Run one polling round. Returns the number of operations checked."""
+
+        stores = self.claim_due()
+        if not stores:
+            return 0
+
+        client = get_client()
+
+        def check(store):
+            try:
+                return store, client.get_operation(store.operation_name), None
+            except Exception as exc:
+                return store, None, exc
+
+        with ThreadPoolExecutor(max_workers=min(self.concurrency, len(stores))) as executor:
+            results = list(executor.map(check, stores))
+
+        now = timezone.now()
+        timeout = timedelta(seconds=settings.OPERATION_POLL_TIMEOUT)
+        ready, finished, pending = [], [], []
+
+        for store, operation, exc in results:
+            if operation is not None and operation.done:
+                error_message = operation_error_message(operation)
+                if error_message is None:
+                    store.status = FileSearchStore.StoreStatus.READY
+                    store.remote_document_name = remote_document_name(operation)
+                    if store.operation_started:
+                        remote_processing = round((now - store.operation_started).total_seconds(), 4)
+                        observe(INGESTION_STAGE_METRIC, remote_processing, stage='remote_processing')
+                        store.ingestion_timings = {
+                            **(store.ingestion_timings or {}),
+                            'remote_processing': remote_processing,
+                        }
+                    ready.append(store)
+                else:
+                    store.status = FileSearchStore.StoreStatus.FAILED
+                store.error_message = error_message
+            elif store.operation_started and now - store.operation_started > timeout:
+                store.status = FileSearchStore.StoreStatus.FAILED
+                store.error_message = 'Upload timeout'
+            else:
+                if exc is not None:
+                    logger.warning("Polling operation %s failed: %s", store.operation_name, exc)
+                store.poll_attempts += 1
+                store.next_poll_at = now + timedelta(seconds=compute_poll_delay(store.poll_attempts))
+                store.updated = now
+                pending.append(store)
+                continue
+
+            store.operation_name = None
+            store.next_poll_at = None
+            store.updated = now
+            finished.append(store)
+
+        requeued = set()
+        if finished:
+            with transaction.atomic():
+                # Failed remote processing is retried by the ingestion job, like a failed upload
+                requeued = retry_failed_operations({
+                    store.id: store.error_message for store in finished
+                    if store.status == FileSearchStore.StoreStatus.FAILED
+                })
+                for store in finished:
+                    if store.id in requeued:
+                        store.status = FileSearchStore.StoreStatus.CREATED
+                FileSearchStore.objects.bulk_update(
+                    finished,
+                    ['status', 'error_message', 'remote_document_name', 'ingestion_timings', 'operation_name',
+                     'next_poll_at', 'updated']
+                )
+        if ready:
+            invalidate_answers(*{store.store_name for store in ready})
+        if pending:
+            FileSearchStore.objects.bulk_update(pending, ['poll_attempts', 'next_poll_at', 'updated'])
+
+        logger.info("Polled %s operations: %s ready, %s failed (%s requeued), %s pending",
+                    len(results), len(ready), len(finished) - len(ready), len(requeued), len(pending))
+        return len(results)
+
+    def seconds_until_next_poll(self):
+        next_poll_at = pending_operations().aggregate(next_poll_at=Min('next_poll_at'))['next_poll_at']
+        if next_poll_at is None:
+            return self.max_idle
+        return min(max((next_poll_at - timezone.now()).total_seconds(), 0), self.max_idle)
+
+    def run(self, once=False):
+        logger.info("Operation poller started")
+
+        while not self._stop.is_set():
+            close_old_connections()
+            try:
+                checked = self.poll_once()
+                wait = 0 if checked >= self.batch_size else self.seconds_until_next_poll()
+            except Exception:
+                logger.exception("Operation polling round failed")
+                checked, wait = 0, settings.OPERATION_POLL_BASE_DELAY
+
+            if once and not checked:
+                break
+            self._stop.wait(wait)
+
+        close_old_connections()
+        logger.info("Operation poller stopped")
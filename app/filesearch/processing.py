@@ -1,45 +1,253 @@
+import hashlib
+import logging
+from datetime import timedelta
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.db.models import F, Q
 from django.shortcuts import get_object_or_404
+from django.utils import timezone
+
+from app.core.metrics import INGESTION_STAGE_METRIC, timed
+from app.filesearch.cache import invalidate_answers
+from app.filesearch.gemini_client import get_client
+from app.filesearch.models import FileSearchStore, UserRemoteStore
+
+logger = logging.getLogger(__name__)
+
+
+def compute_file_hash(file):
+    """SHA-256 of a Django File, read chunk by chunk."""
+
+    sha256 = hashlib.sha256()
+    for chunk in file.chunks():
+        sha256.update(chunk)
+    return sha256.hexdigest()
+
+
+def find_reusable_document(content_hash, user, exclude_id=None, lock=False):
+    """
+    Return the oldest active READY document with the same content, whose remote store can be reused.
+
+    Documents in a shared per-user store are only reused for the same user, since sharing the
+    store would expose the owner's whole library.
+    """
+
+    if not content_hash:
+        return None
+
+    queryset = FileSearchStore.objects.filter(
+        Q(remote_store__isnull=True) | Q(remote_store__user=user),
+        content_hash=content_hash,
+        status=FileSearchStore.StoreStatus.READY,
+        is_active=True,
+        store_name__isnull=False,
+    )
+    if exclude_id is not None:
+        queryset = queryset.exclude(id=exclude_id)
+    if lock:
+        queryset = queryset.select_for_update(of=('self',))
+
+    return queryset.order_by('id').first()
+
+
+def reuse_fields(source):
+    """Fields copied from an ingested document onto a duplicate of it."""
+
+    return {
+        'store_name': source.store_name,
+        'remote_store': source.remote_store,
+        'remote_document_name': source.remote_document_name,
+        'status': FileSearchStore.StoreStatus.READY,
+    }
+
+
+def acquire_user_store(user, client):
+    """
+    Pick the least loaded remote store from the user's pool, creating one while the pool
+    is smaller than FILESEARCH_USER_STORE_POOL_SIZE.
+    """
+
+    with transaction.atomic():
+        # Serialise pool changes per user
+        get_user_model().objects.select_for_update().filter(id=user.id).exists()
+
+        user_store = UserRemoteStore.objects.filter(user=user, is_active=True).order_by('document_count', 'id').first()
+        pool_size = UserRemoteStore.objects.filter(user=user, is_active=True).count()
+
+        if user_store is None or (pool_size < settings.FILESEARCH_USER_STORE_POOL_SIZE and user_store.document_count):
+            created_store = client.create_store(display_name=f"user-{user.id}-library-{pool_size + 1}")
+            user_store = UserRemoteStore.objects.create(user=user, store_name=created_store.name)
+
+        UserRemoteStore.objects.filter(id=user_store.id).update(document_count=F('document_count') + 1)
+
+    return user_store
+
+
+def release_user_store(store_id):
+    """
+    Give back the pool slot acquire_user_store took for a document whose ingestion failed for good.
+
+    Ingested documents hold their slot until release_document drops the last reference to their
+    remote file; a document that never got one would otherwise keep it forever.
+    """
+
+    with transaction.atomic():
+        store = FileSearchStore.objects.select_for_update().filter(
+            id=store_id, remote_store__isnull=False, remote_document_name__isnull=True,
+        ).first()
+        if store is None:
+            return
+        UserRemoteStore.objects.filter(id=store.remote_store_id, document_count__gt=0).update(
+            document_count=F('document_count') - 1
+        )
+        FileSearchStore.objects.filter(id=store.id).update(remote_store=None, store_name=None)
+
 
-from app.filesearch.gemini_client import GeminiClientWrapper
-from app.filesearch.models import FileSearchStore
+def release_document(document):
+    """
+    Soft delete a document and delete its remote data once no active document references it.
 
+    Deduplicated uploads share remote data, so it is reference counted through the active rows
+    pointing at it: the whole store for per-document stores, the remote file for shared
+    per-user stores.
+    """
 
-def process_file_search_store(store_id):
-    """Synchronous processing: create Gemini store + upload file."""
+    if document.remote_store_id:
+        shared = FileSearchStore.objects.filter(remote_document_name=document.remote_document_name)
+    else:
+        shared = FileSearchStore.objects.filter(store_name=document.store_name)
+    has_remote = bool(document.remote_document_name if document.remote_store_id else document.store_name)
+
+    with transaction.atomic():
+        if has_remote:
+            # Lock every row sharing the remote data so a concurrent upload cannot start reusing it
+            list(shared.select_for_update().values_list('id'))
+
+        document.is_active = False
+        document.save()
+
+        remaining = shared.filter(is_active=True).count() if has_remote else 0
+        if has_remote and remaining == 0 and document.remote_store_id:
+            UserRemoteStore.objects.filter(id=document.remote_store_id, document_count__gt=0).update(
+                document_count=F('document_count') - 1
+            )
+
+    invalidate_answers(document.store_name)
+
+    if not has_remote or remaining:
+        return
+
+    try:
+        if document.remote_store_id:
+            get_client().delete_document(document.remote_document_name)
+        else:
+            get_client().delete_store(document.store_name)
+    except Exception:
+        logger.exception("Failed to delete remote data of document %s", document.id)
+
+
+def remote_document_name(operation):
+    """Name of the remote document created by a finished upload operation."""
+
+    response = getattr(operation, 'response', None)
+    return getattr(response, 'document_name', None)
+
+
+def operation_error_message(operation):
+    """Return the error message of a finished operation, or None if it succeeded."""
+
+    error = getattr(operation, 'error', None)
+    if not error:
+        return None
+    if isinstance(error, dict):
+        return error.get('message') or str(error)
+    return getattr(error, 'message', None) or str(error)
+
+
+def process_file_search_store(store_id, timings=None):
+    """
+    Create Gemini store + start the file upload. Completion is tracked by the operation poller.
+
+    Stage durations in seconds (create_store, upload, db_update, plus `timings` the caller measured,
+    e.g. queue_wait) are stored in `ingestion_timings` and observed in the ingestion histogram.
+    """
 
     store = get_object_or_404(FileSearchStore, id=store_id)
+    timings = dict(timings or {})
+
+    logger.info("Processing document %s", store_id)
 
-    print("Inside process file search")
+    def save():
+        with timed(INGESTION_STAGE_METRIC, 'db_update', timings):
+            store.save()
 
     try:
         store.status = FileSearchStore.StoreStatus.UPLOADING
-        store.save()
+        save()
 
-        client = GeminiClientWrapper()
-        created_store = client.create_store()
-        store.store_name = created_store.name
-        store.status = FileSearchStore.StoreStatus.PROCESSING
-        store.save()
+        if not store.store_name:
+            with transaction.atomic():
+                # Locked like release_document does, so the source cannot be released (and its remote
+                # data deleted) between copying its store name and saving; a released source is skipped
+                source = find_reusable_document(store.content_hash, store.user, exclude_id=store.id, lock=True)
+                if source is not None:
+                    # Same content already ingested: share its remote data instead of uploading again
+                    for field, value in reuse_fields(source).items():
+                        setattr(store, field, value)
+                    store.error_message = None
+                    store.ingestion_timings = timings
+                    save()
+            if source is not None:
+                return
+
+        client = get_client()
+        if not store.store_name:
+            # A retried job keeps the store picked by the previous attempt
+            with timed(INGESTION_STAGE_METRIC, 'create_store', timings):
+                if settings.FILESEARCH_STORE_MODE == 'per_user':
+                    store.remote_store = acquire_user_store(store.user, client)
+                    store.store_name = store.remote_store.store_name
+                else:
+                    store.store_name = client.create_store().name
+            save()
 
         local_path = store.file.path
-        upload_op = client.upload_file_to_store(created_store.name, local_path)
-
-        # Poll until finished
-        max_wait = 300
-        waited = 0
-        while not upload_op.done:
-            if waited >= max_wait:
-                raise RuntimeError('Upload timeout')
-            import time
-            time.sleep(3)
-            waited += 3
-            upload_op = client.client.operations.get(upload_op)
-
-        store.status = FileSearchStore.StoreStatus.READY
-        store.save()
+        with timed(INGESTION_STAGE_METRIC, 'upload', timings):
+            upload_op = client.upload_file_to_store(
+                store.store_name,
+                local_path,
+                display_name=store.title,
+                metadata={'content_hash': store.content_hash} if store.content_hash else None,
+            )
+        # Backends that process the file locally report their own stages (extract, chunk_index, ...)
+        timings.update((getattr(upload_op, 'metadata', None) or {}).get('timings', {}))
+        store.ingestion_timings = timings
+
+        now = timezone.now()
+        if upload_op.done:
+            error_message = operation_error_message(upload_op)
+            if error_message:
+                raise RuntimeError(error_message)
+
+            store.status = FileSearchStore.StoreStatus.READY
+            store.remote_document_name = remote_document_name(upload_op)
+            store.error_message = None
+            save()
+            invalidate_answers(store.store_name)
+            return
+
+        # Hand the operation over to the shared poller
+        store.status = FileSearchStore.StoreStatus.PROCESSING
+        store.operation_name = upload_op.name
+        store.operation_started = now
+        store.next_poll_at = now + timedelta(seconds=settings.OPERATION_POLL_BASE_DELAY)
+        store.poll_attempts = 0
+        save()
 
     except Exception as exc:
         store.status = FileSearchStore.StoreStatus.FAILED
         store.error_message = str(exc)
         store.save()
-        raise
\ No newline at end of file
+        raise
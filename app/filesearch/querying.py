@@ -0,0 +1,388 @@
+import asyncio
+import time
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+
+from app.core.metrics import QUERY_STAGE_METRIC, timed, observe
+from app.filesearch.cache import get_answer_cache
+from app.filesearch.gemini_client import get_client
+from app.filesearch.semantic_cache import get_semantic_cache
+from app.filesearch.singleflight import get_single_flight
+from app.filesearch.models import FileSearchStore, UserRemoteStore
+
+# Add system instruction: forbid hallucination
+SYSTEM_PROMPT = (
+    "You must answer ONLY using the provided document chunks. "
+    "If the answer is not explicitly present in the document, reply exactly with: "
+    "'I don't know. The answer is not present in the document.'"
+)
+NO_ANSWER = "I don't know. The answer is not present in the document."
+# Bump whenever SYSTEM_PROMPT or response parsing changes, so cached answers are not reused
+PROMPT_VERSION = 2
+
+
+def document_metadata_filter(document):
+    """Restrict a shared per-user store to one document (matched on the metadata set at upload)."""
+
+    if document.remote_store_id and document.content_hash:
+        return f'content_hash="{document.content_hash}"'
+    return None
+
+
+def library_store_names(user):
+    """Remote stores holding the user's READY documents in shared per-user stores."""
+
+    return list(
+        UserRemoteStore.objects
+        .filter(
+            user=user,
+            is_active=True,
+            documents__is_active=True,
+            documents__status=FileSearchStore.StoreStatus.READY,
+        )
+        .values_list('store_name', flat=True)
+        .distinct()
+    )
+
+
+def resolve_query_target(user, document_id=None):
+    """
+    Return (document, library_store_names) for a query.
+
+    With a document id, only that READY document. Without one, the whole library in the user's
+    shared stores, otherwise the latest READY document. Both are empty when nothing matches.
+    """
+
+    documents = FileSearchStore.objects.filter(
+        user=user,
+        status=FileSearchStore.StoreStatus.READY,
+        is_active=True
+    )
+
+    if document_id is not None:
+        return documents.filter(id=document_id).first(), []
+
+    library_stores = library_store_names(user)
+    if library_stores:
+        return None, library_stores
+    return documents.order_by('-created').first(), []
+
+
+def resolve_query_documents(user, document_ids=None):
+    """The user's READY documents with a remote store, newest first; only `document_ids` when given."""
+
+    documents = FileSearchStore.objects.filter(
+        user=user,
+        status=FileSearchStore.StoreStatus.READY,
+        is_active=True,
+        store_name__isnull=False,
+    ).exclude(store_name='').order_by('-created')
+
+    if document_ids is not None:
+        documents = documents.filter(id__in=document_ids)
+    return list(documents)
+
+
+def documents_query_target(documents):
+    """
+    (store_names, metadata_filter) searching several documents in one FileSearch call.
+
+    Dedicated stores hold one document each and need no filter. As soon as one document lives in a
+    shared per-user store, the call is restricted to the selected documents' content hashes.
+    """
+
+    store_names = list(dict.fromkeys(document.store_name for document in documents))
+    if not any(document.remote_store_id for document in documents):
+        return store_names, None
+
+    content_hashes = sorted({document.content_hash for document in documents if document.content_hash})
+    return store_names, ' OR '.join(f'content_hash="{content_hash}"' for content_hash in content_hashes)
+
+
+def parse_response(response):
+    """Return (text_output, grounding_chunks) from a generate_content response."""
+
+    # --- Extract text output ---
+    text_output = None
+    if hasattr(response, "text") and response.text:
+        text_output = response.text
+    else:
+        # fallback to candidates
+        try:
+            text_output = response.candidates[0].content[0].text
+        except Exception:
+            text_output = ""
+
+    # --- Extract grounding chunks (actual retrieved text, not titles) ---
+    grounding_chunks = []
+    try:
+        grounding = response.candidates[0].grounding_metadata
+        if grounding and grounding.grounding_chunks:
+            grounding_chunks = [
+                c.retrieved_context.text for c in grounding.grounding_chunks
+                if hasattr(c, "retrieved_context") and c.retrieved_context.text
+            ]
+    except Exception:
+        grounding_chunks = []
+
+    # --- Enforce “no hallucination” rule ---
+    if not grounding_chunks:
+        text_output = NO_ANSWER
+
+    return text_output, grounding_chunks
+
+
+def parse_grounding_sources(response):
+    """
+    Where each grounding chunk (in parse_response order) came from: [{'title', 'document_name', 'score'}].
+
+    `score` is the retrieval score when the backend reports one, otherwise the best confidence of
+    the grounding supports citing the chunk, otherwise None.
+    """
+
+    try:
+        grounding = response.candidates[0].grounding_metadata
+        chunks = (grounding.grounding_chunks or []) if grounding else []
+    except Exception:
+        return []
+
+    confidences = {}
+    for support in getattr(grounding, 'grounding_supports', None) or []:
+        for index, confidence in zip(support.grounding_chunk_indices or [], support.confidence_scores or []):
+            confidences[index] = max(confidence, confidences.get(index, confidence))
+
+    sources = []
+    for index, chunk in enumerate(chunks):
+        context = getattr(chunk, 'retrieved_context', None)
+        if context is None or not context.text:
+            continue
+        score = getattr(chunk, 'score', None)
+        sources.append({
+            "title": getattr(context, 'title', None),
+            "document_name": getattr(context, 'document_name', None),
+            "score": score if score is not None else confidences.get(index),
+        })
+    return sources
+
+
+def attribute_sources(documents, result):
+    """
+    Grounding chunks of a result attributed to the FileSearchStore they came from, best score first:
+    [{'text', 'score', 'document_id', 'title'}]. `document_id` is None when the chunk can't be matched.
+    """
+
+    by_remote_name = {document.remote_document_name: document for document in documents
+                      if document.remote_document_name}
+    # Only dedicated stores identify a document by store name
+    by_store = {document.store_name: document for document in documents if not document.remote_store_id}
+    by_title = {document.title: document for document in documents}
+
+    attributed = []
+    sources = result.get("grounding_sources") or [{}] * len(result["grounding_chunks"])
+    for text, source in zip(result["grounding_chunks"], sources):
+        document_name = source.get("document_name") or ''
+        document = (
+            by_remote_name.get(document_name)
+            or by_store.get(document_name.split('/documents/')[0])
+            or by_title.get(source.get("title"))
+        )
+        attributed.append({
+            "text": text,
+            "score": source.get("score"),
+            "document_id": str(document.id) if document else None,
+            "title": document.title if document else source.get("title"),
+        })
+
+    # Stable: chunks without a score keep the backend's order
+    return sorted(attributed, key=lambda chunk: -(chunk["score"] or 0))
+
+
+class QueryCaching:
+    """Answer cache and near-duplicate query cache bookkeeping for one question on one set of stores."""
+
+    def __init__(self, store_names, query, metadata_filter=None, refresh=False):
+        self.answer_cache = get_answer_cache()
+        self.semantic_cache = get_semantic_cache()
+        self.query = query
+        self.refresh = refresh
+        self.scope = self.answer_cache.scope_key(store_names, metadata_filter, PROMPT_VERSION)
+        self.cache_key = self.answer_cache.make_key(self.scope, query) if settings.ANSWER_CACHE_ENABLED else None
+        self._query_vector = None
+
+    @property
+    def query_vector(self):
+        # Embedded once, used for both the lookup and storing the fresh answer
+        if self._query_vector is None and self.semantic_cache is not None:
+            self._query_vector = self.semantic_cache.embed(self.query)
+        return self._query_vector
+
+    def lookup(self):
+        """Cached result (with its `cache` marker), or None. Always None on refresh."""
+
+        if self.refresh:
+            return None
+
+        cached = self.answer_cache.get(self.cache_key) if self.cache_key else None
+        if cached is not None:
+            return {**cached, "cache": {"type": "exact"}}
+
+        if self.semantic_cache is not None:
+            match = self.semantic_cache.lookup(self.scope, self.query, self.query_vector)
+            if match is not None:
+                cached, similarity, matched_query = match
+                return {**cached, "cache": {"type": "semantic", "similarity": round(similarity, 4),
+                                           "matched_query": matched_query}}
+        return None
+
+    def lookup_exact(self):
+        return self.answer_cache.get(self.cache_key) if self.cache_key else None
+
+    def store(self, result):
+        if self.cache_key:
+            self.answer_cache.set(self.cache_key, result)
+        if self.semantic_cache is not None:
+            if self.refresh:
+                self.semantic_cache.record_override(self.scope, self.query, result, self.query_vector)
+            else:
+                self.semantic_cache.store(self.scope, self.query, result, self.query_vector)
+
+
+async def arun_query(store_names, query, metadata_filter=None, refresh=False):
+    """
+    Query one or more remote stores; returns {'response_text', 'grounding_chunks', 'cache'}.
+
+    `cache` is None for a fresh answer, or {'type': 'exact' | 'semantic' | 'coalesced', ...} when the
+    answer was served from the answer cache, the near-duplicate query cache, or shared with an
+    identical concurrent query. `refresh` skips both caches and replaces what they hold.
+
+    The Gemini call goes through the async client and never holds a thread.
+    """
+
+    # Cache bookkeeping is thread-safe and may do network I/O (shared tier): keep it off the event loop
+    with timed(QUERY_STAGE_METRIC, 'cache'):
+        caching = await sync_to_async(QueryCaching, thread_sensitive=False)(store_names, query, metadata_filter,
+                                                                            refresh)
+        cached = await sync_to_async(caching.lookup, thread_sensitive=False)()
+    if cached is not None:
+        return cached
+
+    async def call_upstream():
+        with timed(QUERY_STAGE_METRIC, 'gemini'):
+            response = await get_client().aquery_store(store_names, query, metadata_filter=metadata_filter,
+                                                       system_instruction=SYSTEM_PROMPT)
+        with timed(QUERY_STAGE_METRIC, 'parse'):
+            text_output, grounding_chunks = parse_response(response)
+
+            result = {
+                "response_text": text_output,
+                "grounding_chunks": grounding_chunks,
+                "grounding_sources": parse_grounding_sources(response),
+            }
+        with timed(QUERY_STAGE_METRIC, 'cache'):
+            await sync_to_async(caching.store, thread_sensitive=False)(result)
+        return result
+
+    if not settings.SINGLE_FLIGHT_ENABLED:
+        return {**(await call_upstream()), "cache": None}
+
+    # Identical concurrent questions share one upstream call
+    flight_key = caching.answer_cache.make_key(caching.scope, query)
+    lookup = caching.lookup_exact if caching.cache_key else None
+    result, shared = await get_single_flight().ado(flight_key, call_upstream, lookup=lookup)
+    return {**result, "cache": {"type": "coalesced"} if shared else None}
+
+
+async def astream_query(store_names, query, metadata_filter=None, refresh=False):
+    """
+    Streaming variant of arun_query: yields ('delta', text) events as the answer is generated, then
+    one ('done', result) event with the same payload arun_query returns.
+
+    The `done` event is authoritative: when the answer turns out to have no grounding, its
+    `response_text` is NO_ANSWER even though the streamed deltas said something else.
+    """
+
+    with timed(QUERY_STAGE_METRIC, 'cache'):
+        caching = await sync_to_async(QueryCaching, thread_sensitive=False)(store_names, query, metadata_filter,
+                                                                            refresh)
+        cached = await sync_to_async(caching.lookup, thread_sensitive=False)()
+    if cached is not None:
+        yield 'delta', cached["response_text"]
+        yield 'done', cached
+        return
+
+    parts = []
+    grounding_chunks = []
+    grounding_sources = []
+    started = time.perf_counter()
+    async for chunk in get_client().astream_query_store(store_names, query, metadata_filter=metadata_filter,
+                                                        system_instruction=SYSTEM_PROMPT):
+        text = getattr(chunk, 'text', None)
+        if text:
+            if not parts:
+                observe(QUERY_STAGE_METRIC, time.perf_counter() - started, stage='gemini_first_token')
+            parts.append(text)
+            yield 'delta', text
+        # Grounding metadata arrives with the last candidates of the stream
+        if getattr(chunk, 'candidates', None):
+            chunk_grounding = parse_response(chunk)[1]
+            if chunk_grounding:
+                grounding_chunks, grounding_sources = chunk_grounding, parse_grounding_sources(chunk)
+
+    # Includes the time the client took to read the deltas
+    observe(QUERY_STAGE_METRIC, time.perf_counter() - started, stage='gemini')
+
+    result = {
+        "response_text": ''.join(parts) if grounding_chunks else NO_ANSWER,
+        "grounding_chunks": grounding_chunks,
+        "grounding_sources": grounding_sources,
+    }
+    with timed(QUERY_STAGE_METRIC, 'cache'):
+        await sync_to_async(caching.store, thread_sensitive=False)(result)
+    yield 'done', {**result, "cache": None}
+
+
+async def aquery_document(document, query, refresh=False):
+    return await arun_query([document.store_name], query, metadata_filter=document_metadata_filter(document),
+                            refresh=refresh)
+
+
+async def aquery_library(store_names, query, refresh=False):
+    """Search every shared store of a user in one generate_content call."""
+
+    return await arun_query(store_names, query, refresh=refresh)
+
+
+async def abatch_query(store_names, queries, metadata_filter=None, refresh=False, concurrency=None):
+    """
+    Run many questions against the same stores, at most `concurrency` at a time.
+
+    Yields (index, result, error) in input order - a result as soon as it and every earlier
+    question are done, so callers can stream. A failed question yields its exception instead
+    of failing the batch. Questions not yet yielded are cancelled if the caller stops iterating.
+    """
+
+    semaphore = asyncio.Semaphore(concurrency or settings.BATCH_QUERY_CONCURRENCY)
+
+    async def run_one(query):
+        async with semaphore:
+            return await arun_query(store_names, query, metadata_filter, refresh)
+
+    tasks = [asyncio.create_task(run_one(query)) for query in queries]
+    try:
+        for index, task in enumerate(tasks):
+            try:
+                yield index, await task, None
+            except Exception as exc:
+                yield index, None, exc
+    finally:
+        for task in tasks:
+            task.cancel()
+
+
+async def aquery_documents(documents, query, refresh=False):
+    """Search several documents in one FileSearch call; adds `sources`, the chunks attributed to their document."""
+
+    store_names, metadata_filter = documents_query_target(documents)
+    result = await arun_query(store_names, query, metadata_filter=metadata_filter, refresh=refresh)
+    return {**result, "sources": attribute_sources(documents, result)}
@@ -0,0 +1,217 @@
+import asyncio
+import logging
+import re
+import time
+from datetime import timedelta
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from app.filesearch.models import RateLimitBucket
+from app.filesearch.resilience import GeminiUnavailable
+
+logger = logging.getLogger(__name__)
+
+INTERACTIVE = 'interactive'
+BACKGROUND = 'background'
+
+REQUESTS = 'gemini:requests'
+TOKENS = 'gemini:tokens'
+
+RETRY_DELAY_RE = re.compile(r'^(?P<seconds>\d+(?:\.\d+)?)s$')
+
+
+class RateLimited(GeminiUnavailable):
+    """Gemini quota (requests or tokens per minute) is used up for now."""
+
+
+def quota_retry_delay(exc):
+    """Seconds Gemini asked us to wait after a 429 (RetryInfo detail or Retry-After header), or None."""
+
+    details = getattr(exc, 'details', None)
+    error = details.get('error', details) if isinstance(details, dict) else {}
+    for detail in error.get('details', []) if isinstance(error, dict) else []:
+        match = RETRY_DELAY_RE.match(str(detail.get('retryDelay', '')))
+        if match:
+            return float(match.group('seconds'))
+
+    headers = getattr(getattr(exc, 'response', None), 'headers', None) or {}
+    try:
+        return float(headers.get('retry-after'))
+    except (TypeError, ValueError):
+        return None
+
+
+def response_tokens(response):
+    usage = getattr(response, 'usage_metadata', None)
+    return getattr(usage, 'total_token_count', None) if usage is not None else None
+
+
+class RateLimiter:
+    """
+    Token buckets for the Gemini requests-per-minute and tokens-per-minute quotas, kept in the
+    RateLimitBucket table so every worker (and every host sharing the database) draws from the
+    same quota.
+
+    Background calls (ingestion) may only use the part of a bucket above `background_reserve`;
+    the rest is kept for interactive calls (queries), which therefore go first when quota is short.
+
+    A 429 halves the bucket's rate and blocks it for the delay Gemini asked for; the rate then
+    climbs back to the configured quota over `recovery_seconds`. Queries reserve `query_tokens`
+    up front; the difference to the reported usage is settled after the call.
+    """
+
+    def __init__(self, requests_per_minute, tokens_per_minute, query_tokens, background_reserve,
+                 max_wait, background_max_wait, recovery_seconds, min_rate_fraction=0.1):
+        self.quotas = {name: per_minute for name, per_minute in
+                       ((REQUESTS, requests_per_minute), (TOKENS, tokens_per_minute)) if per_minute}
+        self.query_tokens = query_tokens
+        self.background_reserve = background_reserve
+        self.max_wait = {INTERACTIVE: max_wait, BACKGROUND: background_max_wait}
+        self.recovery_seconds = recovery_seconds
+        self.min_rate_fraction = min_rate_fraction
+        self._created = set()
+
+    def costs(self, priority, tokens=None):
+        costs = {REQUESTS: 1}
+        if priority == INTERACTIVE:
+            costs[TOKENS] = tokens or self.query_tokens
+        return {name: cost for name, cost in costs.items() if name in self.quotas}
+
+    # --- buckets -------------------------------------------------------------
+
+    def _locked_buckets(self, names, now):
+        for name in set(names) - self._created:
+            # get_or_create copes with another worker creating the row at the same time
+            RateLimitBucket.objects.get_or_create(name=name, defaults={
+                'tokens': self.quotas[name], 'rate': self.quotas[name] / 60, 'refilled': now,
+            })
+            self._created.add(name)
+        # Fixed lock order, so workers taking several buckets never deadlock
+        return list(RateLimitBucket.objects.select_for_update().filter(name__in=names).order_by('name'))
+
+    def _refill(self, bucket, now):
+        quota_rate = self.quotas[bucket.name] / 60
+        elapsed = max((now - bucket.refilled).total_seconds(), 0.0)
+        bucket.tokens = min(bucket.tokens + bucket.rate * elapsed, self.quotas[bucket.name])
+        bucket.rate = min(bucket.rate + quota_rate * elapsed / self.recovery_seconds, quota_rate)
+        bucket.refilled = now
+
+    def take(self, costs, priority):
+        """Take `costs` ({bucket: amount}) from every bucket or from none; returns 0 or the seconds to wait."""
+
+        now = timezone.now()
+        with transaction.atomic():
+            buckets = self._locked_buckets(list(costs), now)
+            wait = 0.0
+            taken = {}
+            for bucket in buckets:
+                self._refill(bucket, now)
+                capacity = self.quotas[bucket.name]
+                floor = capacity * self.background_reserve if priority == BACKGROUND else 0.0
+                # A call bigger than the bucket would wait forever: let it drain the bucket instead
+                taken[bucket.name] = cost = min(costs[bucket.name], capacity - floor)
+                if bucket.blocked_until and bucket.blocked_until > now:
+                    wait = max(wait, (bucket.blocked_until - now).total_seconds())
+                elif bucket.tokens - cost < floor:
+                    wait = max(wait, (floor + cost - bucket.tokens) / bucket.rate)
+
+            if not wait:
+                for bucket in buckets:
+                    bucket.tokens -= taken[bucket.name]
+            for bucket in buckets:
+                bucket.save(update_fields=['tokens', 'rate', 'refilled', 'updated'])
+        return wait
+
+    def settle(self, reserved, used):
+        """Charge the tokens bucket for what a call actually used (it may go negative and hold back later calls)."""
+
+        reserved = reserved.get(TOKENS) if reserved else None
+        if not reserved or used is None or used == reserved:
+            return
+        RateLimitBucket.objects.filter(name=TOKENS).update(tokens=F('tokens') - (used - reserved))
+
+    def refund(self, reserved):
+        """Give back what `acquire` took for a call that never reached Gemini (the next refill caps the buckets)."""
+
+        for name, cost in (reserved or {}).items():
+            RateLimitBucket.objects.filter(name=name).update(tokens=F('tokens') + cost)
+
+    def penalize(self, delay=None):
+        """Gemini answered 429: slow every bucket down and pause it for `delay` seconds."""
+
+        now = timezone.now()
+        blocked_until = now + timedelta(seconds=delay or 1.0)
+        with transaction.atomic():
+            for bucket in self._locked_buckets(list(self.quotas), now):
+                self._refill(bucket, now)
+                bucket.rate = max(bucket.rate / 2, self.quotas[bucket.name] / 60 * self.min_rate_fraction)
+                bucket.tokens = min(bucket.tokens, 0.0)
+                bucket.blocked_until = max(blocked_until, bucket.blocked_until or blocked_until)
+                bucket.save(update_fields=['tokens', 'rate', 'refilled', 'blocked_until', 'updated'])
+        logger.warning("Gemini quota exceeded, pausing calls for %.1fs", delay or 1.0)
+
+    # --- callers -------------------------------------------------------------
+
+    def acquire(self, priority, tokens=None):
+        """
+        Block until the call fits in the quota; RateLimited if that takes longer than the priority's max wait.
+        Returns what was taken ({bucket: amount}), for `settle` or `refund`.
+        """
+
+        costs = self.costs(priority, tokens)
+        deadline = time.monotonic() + self.max_wait[priority]
+        while True:
+            wait = self.take(costs, priority)
+            if not wait:
+                return costs
+            if time.monotonic() + wait > deadline:
+                raise RateLimited("Gemini quota exhausted", wait)
+            time.sleep(min(wait, 1.0))
+
+    async def aacquire(self, priority, tokens=None):
+        """
+        `acquire` for coroutines. The bucket transaction runs thread-sensitive, on the request's own
+        thread and connection, which Django closes when the request finishes; a pool thread would
+        keep its connection open for the life of the process.
+        """
+
+        costs = self.costs(priority, tokens)
+        deadline = time.monotonic() + self.max_wait[priority]
+        while True:
+            wait = await sync_to_async(self.take)(costs, priority)
+            if not wait:
+                return costs
+            if time.monotonic() + wait > deadline:
+                raise RateLimited("Gemini quota exhausted", wait)
+            await asyncio.sleep(min(wait, 1.0))
+
+    def snapshot(self):
+        return {
+            bucket.name: {
+                'tokens': round(bucket.tokens, 1),
+                'capacity': self.quotas.get(bucket.name),
+                'rate_per_minute': round(bucket.rate * 60, 1),
+                'blocked_until': bucket.blocked_until,
+            }
+            for bucket in RateLimitBucket.objects.filter(name__in=list(self.quotas))
+        }
+
+
+def build_rate_limiter():
+    """RateLimiter for the configured quotas, or None when no quota is configured."""
+
+    if not settings.GEMINI_RATE_LIMIT_RPM and not settings.GEMINI_RATE_LIMIT_TPM:
+        return None
+    return RateLimiter(
+        requests_per_minute=settings.GEMINI_RATE_LIMIT_RPM,
+        tokens_per_minute=settings.GEMINI_RATE_LIMIT_TPM,
+        query_tokens=settings.GEMINI_RATE_LIMIT_QUERY_TOKENS,
+        background_reserve=settings.GEMINI_RATE_LIMIT_BACKGROUND_RESERVE,
+        max_wait=settings.GEMINI_RATE_LIMIT_MAX_WAIT,
+        background_max_wait=settings.GEMINI_RATE_LIMIT_BACKGROUND_MAX_WAIT,
+        recovery_seconds=settings.GEMINI_RATE_LIMIT_RECOVERY_SECONDS,
+    )
@@ -0,0 +1,413 @@
+import asyncio
+import math
+import statistics
+import threading
+import time
+from collections import Counter, deque
+from contextlib import contextmanager, asynccontextmanager
+
+from django.conf import settings
+
+
+class GeminiUnavailable(Exception):
+    """Gemini is not called at all: callers should retry after `retry_after` seconds."""
+
+    def __init__(self, message, retry_after):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class CircuitOpen(GeminiUnavailable):
+    pass
+
+
+class ConcurrencyLimitExceeded(GeminiUnavailable):
+    pass
+
+
+# Call classes, each with its own concurrency limit: their latencies are not comparable (an upload
+# takes seconds per MB, an operation poll a few hundred ms), and slow ingestion must not squeeze queries
+QUERY_CALLS = 'query'
+UPLOAD_CALLS = 'upload'
+OPERATION_CALLS = 'operation'
+STORE_CALLS = 'store'
+
+
+def is_overload(exc):
+    """Errors meaning Gemini is failing or overloaded (as opposed to a bad request)."""
+
+    if isinstance(exc, (TimeoutError, asyncio.TimeoutError, ConnectionError)):
+        return True
+    code = getattr(exc, 'code', None)
+    if isinstance(code, int):
+        return code == 429 or code >= 500
+    # httpx transport errors (timeouts, refused/reset connections) surface unwrapped from the SDK
+    return type(exc).__module__.startswith('httpx') and type(exc).__name__.endswith(('Timeout', 'Error'))
+
+
+class CircuitBreaker:
+    """
+    Closed: calls go through and outcomes are recorded over the last `window` calls. Once at least
+    `min_calls` were seen and `failure_rate` of them failed, the circuit opens.
+
+    Open: calls fail immediately for `open_seconds`. Then half-open: up to `half_open_calls` probes
+    go through (everything else still fails fast); the circuit closes when they all succeed and
+    opens again on the first failure.
+    """
+
+    CLOSED, OPEN, HALF_OPEN = 'closed', 'open', 'half_open'
+
+    def __init__(self, window, min_calls, failure_rate, open_seconds, half_open_calls):
+        self.min_calls = min_calls
+        self.failure_rate = failure_rate
+        self.open_seconds = open_seconds
+        self.half_open_calls = half_open_calls
+        self.state = self.CLOSED
+        self._outcomes = deque(maxlen=window)
+        self._opened_at = 0.0
+        self._probes = 0
+        self._probe_successes = 0
+        self._lock = threading.Lock()
+        self.stats = Counter()
+
+    def retry_after(self):
+        return max(self._opened_at + self.open_seconds - time.monotonic(), 1.0)
+
+    def before_call(self):
+        """Raise CircuitOpen, or return whether this call is a half-open probe."""
+
+        with self._lock:
+            if self.state == self.OPEN and time.monotonic() - self._opened_at >= self.open_seconds:
+                self.state = self.HALF_OPEN
+                self._probes = self._probe_successes = 0
+
+            if self.state == self.CLOSED:
+                return False
+            if self.state == self.HALF_OPEN and self._probes < self.half_open_calls:
+                self._probes += 1
+                return True
+
+            self.stats['rejected'] += 1
+            raise CircuitOpen("Gemini circuit breaker is open", self.retry_after())
+
+    def record(self, failed, probe=False):
+        with self._lock:
+            self.stats['failures' if failed else 'successes'] += 1
+
+            if self.state == self.HALF_OPEN and probe:
+                if failed:
+                    self._open()
+                else:
+                    self._probe_successes += 1
+                    if self._probe_successes >= self.half_open_calls:
+                        self.state = self.CLOSED
+                        self._outcomes.clear()
+                return
+
+            if self.state != self.CLOSED:
+                return
+            self._outcomes.append(failed)
+            if len(self._outcomes) >= self.min_calls and \
+                    sum(self._outcomes) / len(self._outcomes) >= self.failure_rate:
+                self._open()
+
+    def cancel_probe(self):
+        """A probe admitted by before_call never reached Gemini: let another caller probe instead."""
+
+        with self._lock:
+            if self.state == self.HALF_OPEN and self._probes > 0:
+                self._probes -= 1
+
+    def _open(self):
+        self.state = self.OPEN
+        self._opened_at = time.monotonic()
+        self._outcomes.clear()
+        self.stats['opened'] += 1
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                'state': self.state,
+                'recent_failure_rate': round(sum(self._outcomes) / len(self._outcomes), 4) if self._outcomes else None,
+                'retry_after': round(self.retry_after(), 1) if self.state == self.OPEN else None,
+                'opened': self.stats['opened'],
+                'rejected': self.stats['rejected'],
+                'successes': self.stats['successes'],
+                'failures': self.stats['failures'],
+            }
+
+
+class AdaptiveLimiter:
+    """
+    Concurrency limit for one class of calls to Gemini, adjusted AIMD-style from what the calls observe:
+
+    - every success adds 1/limit (about +1 per round of `limit` calls);
+    - completed calls are looked at in windows of about one round (`limit` calls, at least `window`).
+      When the median latency of a window is above `latency_tolerance` times the median of the last
+      `baseline_window` latencies (Gemini is queueing), the limit is multiplied by `latency_backoff`;
+    - an overload error (429, 5xx, timeout) multiplies it by `error_backoff`.
+
+    The limit is cut at most once per window, so a slow round or a burst of errors costs one decrease.
+    Medians, not the minimum, keep ordinary latency variance from passing for queueing.
+
+    Callers over the limit wait up to `queue_timeout` seconds for a slot, then get
+    ConcurrencyLimitExceeded instead of piling up behind a slow upstream.
+    """
+
+    def __init__(self, initial, min_limit, max_limit, queue_timeout, latency_tolerance=2.0,
+                 latency_backoff=0.9, error_backoff=0.5, window=20, baseline_window=200):
+        self.limit = float(initial)
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.queue_timeout = queue_timeout
+        self.latency_tolerance = latency_tolerance
+        self.latency_backoff = latency_backoff
+        self.error_backoff = error_backoff
+        self.window = window
+        self.in_flight = 0
+        self._baseline = deque(maxlen=baseline_window)
+        self._window_latencies = []
+        self._window_calls = 0
+        self._decreased = False
+        self._lock = threading.Lock()
+        self._available = threading.Condition(self._lock)
+        self._async_waiters = deque()
+        self.stats = Counter()
+
+    def _has_slot(self):
+        return self.in_flight < int(self.limit)
+
+    def try_acquire(self):
+        with self._lock:
+            if self._has_slot():
+                self.in_flight += 1
+                return True
+            return False
+
+    def acquire(self):
+        with self._available:
+            if not self._available.wait_for(self._has_slot, self.queue_timeout):
+                self.stats['rejected'] += 1
+                raise ConcurrencyLimitExceeded("Too many concurrent Gemini calls", self.queue_timeout)
+            self.in_flight += 1
+
+    async def aacquire(self):
+        """`acquire` for coroutines: waits on a future woken by `release` instead of blocking a thread."""
+
+        deadline = time.monotonic() + self.queue_timeout
+        loop = asyncio.get_running_loop()
+        while True:
+            future = loop.create_future()
+            with self._lock:
+                # Checked and queued under one lock, so a release in between can't be missed
+                if self._has_slot():
+                    self.in_flight += 1
+                    return
+                self._async_waiters.append((loop, future))
+
+            remaining = deadline - time.monotonic()
+            try:
+                if remaining <= 0:
+                    raise asyncio.TimeoutError
+                await asyncio.wait_for(future, remaining)
+            except asyncio.TimeoutError:
+                with self._lock:
+                    self.stats['rejected'] += 1
+                raise ConcurrencyLimitExceeded("Too many concurrent Gemini calls", self.queue_timeout)
+            finally:
+                with self._lock:
+                    if (loop, future) in self._async_waiters:
+                        self._async_waiters.remove((loop, future))
+
+    def release(self, latency=None, overload=False):
+        with self._available:
+            self.in_flight -= 1
+            self._adjust(latency, overload)
+            self._available.notify()
+            waiters = [self._async_waiters.popleft()
+                       for _ in range(min(len(self._async_waiters), max(int(self.limit) - self.in_flight, 1)))]
+
+        # Woken waiters look for a slot again; one that lost the race simply waits again
+        for loop, future in waiters:
+            try:
+                loop.call_soon_threadsafe(self._wake, future)
+            except RuntimeError:
+                # The waiter's loop is closed
+                pass
+
+    @staticmethod
+    def _wake(future):
+        if not future.done():
+            future.set_result(None)
+
+    def _adjust(self, latency, overload):
+        if overload:
+            self._decrease(self.error_backoff)
+        elif latency is not None:
+            self._window_latencies.append(latency)
+            self.limit = min(self.limit + 1 / self.limit, self.max_limit)
+        else:
+            # Cancelled: says nothing about Gemini
+            return
+
+        self._window_calls += 1
+        if self._window_calls < max(self.window, int(self.limit)):
+            return
+
+        if self._window_latencies and self._baseline and \
+                statistics.median(self._window_latencies) > statistics.median(self._baseline) * self.latency_tolerance:
+            self._decrease(self.latency_backoff)
+        self._baseline.extend(self._window_latencies)
+        self._window_latencies = []
+        self._window_calls = 0
+        self._decreased = False
+
+    def _decrease(self, factor):
+        if self._decreased:
+            return
+        self._decreased = True
+        self.limit = max(self.limit * factor, self.min_limit)
+        self.stats['decreases'] += 1
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                'limit': int(self.limit),
+                'in_flight': self.in_flight,
+                'waiting': len(self._async_waiters),
+                'baseline_latency_ms': round(statistics.median(self._baseline) * 1000, 1) if self._baseline else None,
+                'rejected': self.stats['rejected'],
+                'decreases': self.stats['decreases'],
+            }
+
+
+class GuardedCall:
+    """Yielded by Bulkhead.guard/aguard. A streamed call marks its first response, which becomes its latency."""
+
+    def __init__(self):
+        self.started = time.monotonic()
+        self.latency = None
+
+    def first_response(self):
+        if self.latency is None:
+            self.latency = time.monotonic() - self.started
+
+
+class Bulkhead:
+    """
+    Circuit breaker around every Gemini call of a process, plus one adaptive concurrency limit per
+    call class (QUERY_CALLS, UPLOAD_CALLS, ...), created by `limiter_factory` on first use.
+    """
+
+    def __init__(self, breaker=None, limiter_factory=None):
+        self.breaker = breaker
+        self.limiter_factory = limiter_factory
+        self.limiters = {}
+        self._lock = threading.Lock()
+
+    def limiter(self, call_class):
+        if self.limiter_factory is None:
+            return None
+        with self._lock:
+            limiter = self.limiters.get(call_class)
+            if limiter is None:
+                limiter = self.limiters[call_class] = self.limiter_factory()
+            return limiter
+
+    def _enter(self):
+        return self.breaker.before_call() if self.breaker is not None else False
+
+    def _abort(self, probe):
+        if self.breaker is not None and probe:
+            self.breaker.cancel_probe()
+
+    def _exit(self, limiter, probe, call, exc=None, cancelled=False):
+        overload = exc is not None and is_overload(exc)
+        if self.breaker is not None:
+            if cancelled:
+                self._abort(probe)
+            else:
+                self.breaker.record(overload, probe)
+        if limiter is not None:
+            # Only successful calls say something about latency
+            latency = None
+            if exc is None and not cancelled:
+                latency = call.latency if call.latency is not None else time.monotonic() - call.started
+            limiter.release(latency=latency, overload=overload)
+
+    @contextmanager
+    def guard(self, call_class=QUERY_CALLS):
+        probe = self._enter()
+        limiter = self.limiter(call_class)
+        if limiter is not None:
+            try:
+                limiter.acquire()
+            except BaseException:
+                self._abort(probe)
+                raise
+        call = GuardedCall()
+        try:
+            yield call
+        except Exception as exc:
+            self._exit(limiter, probe, call, exc)
+            raise
+        except BaseException:
+            self._exit(limiter, probe, call, cancelled=True)
+            raise
+        self._exit(limiter, probe, call)
+
+    @asynccontextmanager
+    async def aguard(self, call_class=QUERY_CALLS):
+        probe = self._enter()
+        limiter = self.limiter(call_class)
+        if limiter is not None:
+            try:
+                await limiter.aacquire()
+            except BaseException:
+                self._abort(probe)
+                raise
+        call = GuardedCall()
+        try:
+            yield call
+        except Exception as exc:
+            self._exit(limiter, probe, call, exc)
+            raise
+        except BaseException:
+            # Cancelled (client went away): says nothing about Gemini's health
+            self._exit(limiter, probe, call, cancelled=True)
+            raise
+        self._exit(limiter, probe, call)
+
+    def snapshot(self):
+        return {
+            'circuit': self.breaker.snapshot() if self.breaker is not None else None,
+            'concurrency': {call_class: limiter.snapshot() for call_class, limiter in list(self.limiters.items())}
+            if self.limiter_factory is not None else None,
+        }
+
+
+def build_bulkhead():
+    breaker = limiter_factory = None
+    if settings.GEMINI_BREAKER_ENABLED:
+        breaker = CircuitBreaker(
+            window=settings.GEMINI_BREAKER_WINDOW,
+            min_calls=settings.GEMINI_BREAKER_MIN_CALLS,
+            failure_rate=settings.GEMINI_BREAKER_FAILURE_RATE,
+            open_seconds=settings.GEMINI_BREAKER_OPEN_SECONDS,
+            half_open_calls=settings.GEMINI_BREAKER_HALF_OPEN_CALLS,
+        )
+    if settings.GEMINI_LIMITER_ENABLED:
+        def limiter_factory():
+            return AdaptiveLimiter(
+                initial=settings.GEMINI_LIMITER_INITIAL,
+                min_limit=settings.GEMINI_LIMITER_MIN,
+                max_limit=settings.GEMINI_LIMITER_MAX,
+                queue_timeout=settings.GEMINI_LIMITER_QUEUE_TIMEOUT,
+                latency_tolerance=settings.GEMINI_LIMITER_LATENCY_TOLERANCE,
+                window=settings.GEMINI_LIMITER_WINDOW,
+            )
+    return Bulkhead(breaker, limiter_factory)
+
+
+def retry_after_header(exc):
+    return str(math.ceil(exc.retry_after))
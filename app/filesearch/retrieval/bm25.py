@@ -0,0 +1,155 @@
+import heapq
+import json
+import math
+import os
+import shutil
+import threading
+from collections import Counter, OrderedDict
+
+from app.filesearch.retrieval.extraction import tokenize
+
+CHUNKS_FILE = 'chunks.jsonl'
+INDEX_FILE = 'bm25.json'
+
+
+class BM25IndexWriter:
+    """
+    Builds a per-document inverted index incrementally.
+
+    Chunks are appended to `chunks.jsonl` as they arrive (only byte offsets are kept in memory);
+    postings are written to `bm25.json` on close. The index is built in a temporary directory
+    and moved into place, so readers never see a half-written index.
+    """
+
+    def __init__(self, index_dir, k1=1.5, b=0.75):
+        self.index_dir = index_dir
+        self.tmp_dir = f"{index_dir}.tmp"
+        self.k1 = k1
+        self.b = b
+
+        shutil.rmtree(self.tmp_dir, ignore_errors=True)
+        os.makedirs(self.tmp_dir)
+        self._chunks = open(os.path.join(self.tmp_dir, CHUNKS_FILE), 'wb')
+        self.offsets = []
+        self.lengths = []
+        self.postings = {}
+
+    @property
+    def chunk_count(self):
+        return len(self.offsets)
+
+    def add(self, chunk):
+        """Add {'page', 'text'}; returns the chunk id."""
+
+        chunk_id = len(self.offsets)
+        self.offsets.append(self._chunks.tell())
+        self._chunks.write(json.dumps(chunk, ensure_ascii=False).encode('utf-8') + b'\n')
+
+        terms = Counter(tokenize(chunk['text']))
+        self.lengths.append(sum(terms.values()))
+        for term, frequency in terms.items():
+            self.postings.setdefault(term, []).append([chunk_id, frequency])
+        return chunk_id
+
+    def close(self):
+        self._chunks.close()
+        index = {
+            'version': 1,
+            'k1': self.k1,
+            'b': self.b,
+            'avgdl': (sum(self.lengths) / len(self.lengths)) if self.lengths else 0.0,
+            'offsets': self.offsets,
+            'lengths': self.lengths,
+            'postings': self.postings,
+        }
+        with open(os.path.join(self.tmp_dir, INDEX_FILE), 'w', encoding='utf-8') as index_file:
+            json.dump(index, index_file, separators=(',', ':'))
+
+    def commit(self, extra_files=None):
+        """Publish the index; `extra_files` maps file names to JSON-serialisable content."""
+
+        for name, content in (extra_files or {}).items():
+            with open(os.path.join(self.tmp_dir, name), 'w', encoding='utf-8') as extra:
+                json.dump(content, extra)
+
+        shutil.rmtree(self.index_dir, ignore_errors=True)
+        os.replace(self.tmp_dir, self.index_dir)
+
+    def abort(self):
+        if not self._chunks.closed:
+            self._chunks.close()
+        shutil.rmtree(self.tmp_dir, ignore_errors=True)
+
+
+class BM25Index:
+    """Read side of a per-document index: Okapi BM25 scoring over the stored postings."""
+
+    def __init__(self, index_dir):
+        self.index_dir = index_dir
+        with open(os.path.join(index_dir, INDEX_FILE), encoding='utf-8') as index_file:
+            index = json.load(index_file)
+
+        self.k1 = index['k1']
+        self.b = index['b']
+        self.avgdl = index['avgdl'] or 1.0
+        self.offsets = index['offsets']
+        self.lengths = index['lengths']
+        self.postings = index['postings']
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def search(self, query, top_k):
+        """Return [(chunk_id, score)] of the best `top_k` chunks, best first."""
+
+        chunk_count = len(self.offsets)
+        scores = {}
+
+        for term in set(tokenize(query)):
+            postings = self.postings.get(term)
+            if not postings:
+                continue
+            idf = math.log(1 + (chunk_count - len(postings) + 0.5) / (len(postings) + 0.5))
+            for chunk_id, frequency in postings:
+                norm = self.k1 * (1 - self.b + self.b * self.lengths[chunk_id] / self.avgdl)
+                scores[chunk_id] = scores.get(chunk_id, 0.0) + idf * frequency * (self.k1 + 1) / (frequency + norm)
+
+        return heapq.nlargest(top_k, scores.items(), key=lambda item: item[1])
+
+    def get_chunks(self, chunk_ids):
+        """Read chunks by id, seeking straight to their offsets."""
+
+        chunks = []
+        with open(os.path.join(self.index_dir, CHUNKS_FILE), 'rb') as chunks_file:
+            for chunk_id in chunk_ids:
+                chunks_file.seek(self.offsets[chunk_id])
+                chunks.append(json.loads(chunks_file.readline()))
+        return chunks
+
+
+_cache = OrderedDict()
+_cache_lock = threading.Lock()
+
+
+def load_index(index_dir, max_cached=64):
+    """Load an index, keeping the `max_cached` most recently used ones in memory."""
+
+    mtime = os.path.getmtime(os.path.join(index_dir, INDEX_FILE))
+    with _cache_lock:
+        cached = _cache.get(index_dir)
+        if cached is not None and cached[0] == mtime:
+            _cache.move_to_end(index_dir)
+            return cached[1]
+
+    index = BM25Index(index_dir)
+    with _cache_lock:
+        _cache[index_dir] = (mtime, index)
+        _cache.move_to_end(index_dir)
+        while len(_cache) > max_cached:
+            _cache.popitem(last=False)
+    return index
+
+
+def evict_index(index_dir):
+    with _cache_lock:
+        _cache.pop(index_dir, None)
@@ -0,0 +1,95 @@
+import re
+from collections import deque
+
+try:
+    from pypdf import PdfReader
+except Exception:
+    PdfReader = None
+
+TOKEN_RE = re.compile(r'\w+')
+
+STOPWORDS = frozenset(
+    'a an and are as at be but by for from has have if in into is it its of on or such that the their then '
+    'there these they this to was were what when where which who will with'.split()
+)
+
+
+def tokenize(text):
+    """Lowercased word tokens without stopwords; shared by indexing and querying."""
+
+    return [token for token in TOKEN_RE.findall(text.lower()) if token not in STOPWORDS]
+
+
+def open_pdf(path):
+    if PdfReader is None:
+        raise RuntimeError('pypdf library is not available')
+    return PdfReader(path)
+
+
+def page_count(path):
+    return len(open_pdf(path).pages)
+
+
+def extract_pages(path):
+    """Yield (page_number, text) for each page of a PDF, 1-based."""
+
+    reader = open_pdf(path)
+    for page_number, page in enumerate(reader.pages, start=1):
+        yield page_number, page.extract_text() or ''
+
+
+def extract_page_range(path, start, stop):
+    """Return [(page_number, text)] for pages start..stop-1 (1-based). Runs in extraction worker processes."""
+
+    reader = open_pdf(path)
+    return [(page_number, reader.pages[page_number - 1].extract_text() or '') for page_number in range(start, stop)]
+
+
+def extract_pages_parallel(path, executor, pages_per_task, max_in_flight, total_pages=None):
+    """
+    Like `extract_pages`, with page ranges extracted concurrently on `executor`.
+
+    Pages are yielded in order. At most `max_in_flight` ranges are submitted ahead of the consumer,
+    so memory stays bounded by the window rather than the document size.
+    """
+
+    total_pages = page_count(path) if total_pages is None else total_pages
+    ranges = ((start, min(start + pages_per_task, total_pages + 1))
+              for start in range(1, total_pages + 1, pages_per_task))
+    in_flight = deque()
+
+    try:
+        for start, stop in ranges:
+            in_flight.append(executor.submit(extract_page_range, path, start, stop))
+            if len(in_flight) >= max_in_flight:
+                yield from in_flight.popleft().result()
+        while in_flight:
+            yield from in_flight.popleft().result()
+    finally:
+        for future in in_flight:
+            future.cancel()
+
+
+def chunk_pages(pages, chunk_words, overlap_words):
+    """
+    Split page texts into overlapping windows of `chunk_words` words.
+
+    Yields {'page': first page of the chunk, 'text': chunk text}. Only one window of words is
+    held in memory at a time.
+    """
+
+    step = max(chunk_words - overlap_words, 1)
+    window = []  # (page_number, word)
+    covered = 0  # words at the start of `window` already emitted in the previous chunk
+
+    for page_number, text in pages:
+        for word in text.split():
+            window.append((page_number, word))
+            if len(window) >= chunk_words:
+                yield {'page': window[0][0], 'text': ' '.join(word for _, word in window)}
+                window = window[step:]
+                covered = len(window)
+
+    # Trailing words not already covered by the last full window
+    if len(window) > covered:
+        yield {'page': window[0][0], 'text': ' '.join(word for _, word in window)}
@@ -0,0 +1,75 @@
+import math
+
+from app.filesearch.retrieval.extraction import tokenize
+
+
+def reciprocal_rank_fusion(rankings, k=60):
+    """
+    Merge ranked lists of keys into [(key, fused score)], best first.
+
+    Each list contributes 1 / (k + rank) per key, so only ranks matter and BM25 and cosine
+    scores never have to be put on a common scale.
+    """
+
+    fused = {}
+    for ranking in rankings:
+        for rank, key in enumerate(ranking, start=1):
+            fused[key] = fused.get(key, 0.0) + 1.0 / (k + rank)
+    return sorted(fused.items(), key=lambda item: item[1], reverse=True)
+
+
+def term_coverage(query_terms, query_bigrams, text):
+    """Share of query terms (and adjacent query term pairs) that occur in `text`."""
+
+    tokens = tokenize(text)
+    terms = set(tokens)
+    coverage = len(query_terms & terms) / len(query_terms)
+    if not query_bigrams:
+        return coverage
+    bigrams = set(zip(tokens, tokens[1:]))
+    return 0.7 * coverage + 0.3 * len(query_bigrams & bigrams) / len(query_bigrams)
+
+
+def rerank(query, candidates, weight=0.5):
+    """
+    Cheap local reranker over [(key, score, text)]: blends the normalised retrieval score with
+    query term coverage. Returns [(key, score, text)], best first.
+    """
+
+    query_tokens = tokenize(query)
+    query_terms = set(query_tokens)
+    if not candidates or not query_terms:
+        return list(candidates)
+
+    query_bigrams = set(zip(query_tokens, query_tokens[1:]))
+    top_score = max(score for _, score, _ in candidates) or 1.0
+    reranked = [
+        (key, (1 - weight) * score / top_score + weight * term_coverage(query_terms, query_bigrams, text), text)
+        for key, score, text in candidates
+    ]
+    return sorted(reranked, key=lambda candidate: candidate[1], reverse=True)
+
+
+def estimate_tokens(text):
+    # ~4 characters per token for English text; good enough for budgeting
+    return math.ceil(len(text) / 4)
+
+
+def apply_token_budget(candidates, budget, limit):
+    """
+    Keep the best candidates (key, score, text) that fit in `budget` tokens, at most `limit`.
+    A candidate that does not fit is skipped in favour of smaller ones further down.
+    The best candidate is always kept.
+    """
+
+    selected = []
+    used = 0
+    for candidate in candidates:
+        if len(selected) >= limit:
+            break
+        tokens = estimate_tokens(candidate[2])
+        if selected and budget and used + tokens > budget:
+            continue
+        selected.append(candidate)
+        used += tokens
+    return selected
@@ -0,0 +1,129 @@
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+from app.filesearch.retrieval.bm25 import BM25IndexWriter
+from app.filesearch.retrieval.extraction import extract_pages, extract_pages_parallel, chunk_pages, page_count
+from app.filesearch.retrieval.vectors import VectorIndexWriter
+
+META_FILE = 'meta.json'
+
+_pools = {}
+_pools_lock = threading.Lock()
+_embedder = None
+
+
+def get_extraction_pool():
+    """Bounded process pool for PDF extraction, one per process (shared by ingestion threads)."""
+
+    pid = os.getpid()
+    pool = _pools.get(pid)
+    if pool is None:
+        with _pools_lock:
+            pool = _pools.get(pid)
+            if pool is None:
+                pool = ProcessPoolExecutor(max_workers=settings.LOCAL_EXTRACTION_WORKERS)
+                _pools.clear()
+                _pools[pid] = pool
+    return pool
+
+
+def get_embedder():
+    """The LOCAL_EMBEDDER instance shared by indexing and querying, or None if dense retrieval is off."""
+
+    global _embedder
+    if not settings.LOCAL_EMBEDDER:
+        return None
+    if _embedder is None:
+        _embedder = import_string(settings.LOCAL_EMBEDDER)()
+    return _embedder
+
+
+def iter_pages(file_path):
+    """Pages of a PDF in order; large documents are extracted in parallel page ranges."""
+
+    total_pages = page_count(file_path)
+    if settings.LOCAL_EXTRACTION_WORKERS <= 1 or total_pages <= settings.LOCAL_EXTRACTION_PAGES_PER_TASK:
+        return total_pages, extract_pages(file_path)
+
+    pages = extract_pages_parallel(
+        file_path,
+        get_extraction_pool(),
+        pages_per_task=settings.LOCAL_EXTRACTION_PAGES_PER_TASK,
+        max_in_flight=settings.LOCAL_EXTRACTION_WORKERS * 2,
+        total_pages=total_pages,
+    )
+    return total_pages, pages
+
+
+def timed(iterable, timings, key):
+    """Yield from `iterable`, adding the time spent waiting on it to timings[key]."""
+
+    iterator = iter(iterable)
+    while True:
+        started = time.perf_counter()
+        try:
+            item = next(iterator)
+        except StopIteration:
+            return
+        finally:
+            timings[key] = timings.get(key, 0.0) + time.perf_counter() - started
+        yield item
+
+
+def index_document(file_path, index_dir, display_name=None, metadata=None):
+    """
+    Extract, chunk and index one PDF into `index_dir`.
+
+    Returns {'pages', 'chunks', 'timings'}, timings in seconds per stage.
+    """
+
+    timings = {}
+    started = time.perf_counter()
+    writer = BM25IndexWriter(index_dir)
+    vector_writer = None
+    try:
+        embedder = get_embedder()
+        if embedder is not None:
+            # Written next to the BM25 files, so both are published by the same commit
+            vector_writer = VectorIndexWriter(writer.tmp_dir, embedder, batch_size=settings.LOCAL_EMBEDDING_BATCH_SIZE)
+
+        total_pages, pages = iter_pages(file_path)
+        chunks = chunk_pages(
+            timed(pages, timings, 'extract'),
+            settings.LOCAL_RETRIEVAL_CHUNK_WORDS,
+            settings.LOCAL_RETRIEVAL_CHUNK_OVERLAP_WORDS,
+        )
+        for chunk in chunks:
+            writer.add(chunk)
+            if vector_writer is not None:
+                vector_writer.add(chunk['text'])
+        if vector_writer is not None:
+            # Embed the last batch before the write stage starts, so it is only counted in `embed`
+            vector_writer.flush()
+            timings['embed'] = vector_writer.seconds
+        stage_started = time.perf_counter()
+        timings['chunk_index'] = stage_started - started - timings.get('extract', 0.0) - timings.get('embed', 0.0)
+        writer.close()
+        if vector_writer is not None:
+            vector_writer.close()
+        meta = {
+            'display_name': display_name,
+            'metadata': metadata or {},
+            'pages': total_pages,
+            'embedder': embedder.name if embedder is not None else None,
+        }
+        writer.commit({META_FILE: meta})
+        timings['write'] = time.perf_counter() - stage_started
+    except Exception:
+        if vector_writer is not None:
+            vector_writer.abort()
+        writer.abort()
+        raise
+
+    timings = {stage: round(seconds, 4) for stage, seconds in timings.items()}
+    return {'pages': total_pages, 'chunks': writer.chunk_count, 'timings': timings}
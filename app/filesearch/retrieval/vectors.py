@@ -0,0 +1,175 @@
+import hashlib
+import math
+import os
+import threading
+import time
+from collections import Counter, OrderedDict
+
+try:
+    import numpy as np
+    from numpy.lib.format import open_memmap
+except Exception:
+    np = None
+    open_memmap = None
+
+from app.filesearch.retrieval.extraction import tokenize
+
+VECTORS_FILE = 'vectors.npy'
+RAW_VECTORS_FILE = 'vectors.f32'
+
+
+def require_numpy():
+    if np is None:
+        raise RuntimeError('numpy library is not available')
+
+
+class HashingEmbedder:
+    """
+    Deterministic offline embedder: unigrams and bigrams hashed into `dim` signed buckets,
+    sublinear tf weighting, L2-normalised. No model download, same vectors on every machine.
+
+    Any class with `name`, `dim` and `embed(texts) -> float32 array (len(texts), dim)` can be
+    configured instead through LOCAL_EMBEDDER.
+    """
+
+    def __init__(self, dim=384):
+        self.dim = dim
+        self.name = f"hashing-{dim}"
+
+    def features(self, text):
+        tokens = tokenize(text)
+        return Counter(tokens + [f"{left} {right}" for left, right in zip(tokens, tokens[1:])])
+
+    def bucket(self, feature):
+        digest = hashlib.blake2b(feature.encode('utf-8'), digest_size=8).digest()
+        value = int.from_bytes(digest, 'little')
+        return value % self.dim, (1.0 if value >> 63 else -1.0)
+
+    def embed(self, texts):
+        require_numpy()
+        vectors = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            for feature, count in self.features(text).items():
+                column, sign = self.bucket(feature)
+                vectors[row, column] += sign * (1.0 + math.log(count))
+
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        np.divide(vectors, norms, out=vectors, where=norms > 0)
+        return vectors
+
+
+class VectorIndexWriter:
+    """
+    Embeds chunks in batches and writes them as a float32 `.npy` matrix.
+
+    Batches are appended to a raw file as they are embedded, then copied into the `.npy` file
+    once the row count is known, so the full matrix is never held in memory.
+    """
+
+    def __init__(self, index_dir, embedder, batch_size=64):
+        require_numpy()
+        self.index_dir = index_dir
+        self.embedder = embedder
+        self.batch_size = batch_size
+        self.rows = 0
+        self.seconds = 0.0  # time spent embedding
+        self._batch = []
+        self._raw_path = os.path.join(index_dir, RAW_VECTORS_FILE)
+        self._raw = open(self._raw_path, 'wb')
+
+    def add(self, text):
+        self._batch.append(text)
+        if len(self._batch) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if not self._batch:
+            return
+        started = time.perf_counter()
+        vectors = np.ascontiguousarray(self.embedder.embed(self._batch), dtype=np.float32)
+        self.seconds += time.perf_counter() - started
+        self._raw.write(vectors.tobytes())
+        self.rows += len(self._batch)
+        self._batch = []
+
+    def close(self):
+        self.flush()
+        self._raw.close()
+
+        matrix = open_memmap(os.path.join(self.index_dir, VECTORS_FILE), mode='w+', dtype=np.float32,
+                             shape=(self.rows, self.embedder.dim))
+        if self.rows:
+            raw = np.memmap(self._raw_path, dtype=np.float32, mode='r', shape=(self.rows, self.embedder.dim))
+            for start in range(0, self.rows, self.batch_size * 16):
+                matrix[start:start + self.batch_size * 16] = raw[start:start + self.batch_size * 16]
+            del raw
+        matrix.flush()
+        del matrix
+        os.remove(self._raw_path)
+
+    def abort(self):
+        if not self._raw.closed:
+            self._raw.close()
+
+
+class VectorIndex:
+    """Read side: the matrix is memory-mapped, so pages are only read when a search touches them."""
+
+    def __init__(self, index_dir):
+        require_numpy()
+        self.index_dir = index_dir
+        self.vectors = np.load(os.path.join(index_dir, VECTORS_FILE), mmap_mode='r')
+
+    def __len__(self):
+        return self.vectors.shape[0]
+
+    @property
+    def dim(self):
+        return self.vectors.shape[1]
+
+    def search(self, query_vector, top_k):
+        """Return [(chunk_id, cosine score)] of the best `top_k` chunks, best first."""
+
+        count = len(self)
+        if not count or top_k <= 0:
+            return []
+
+        scores = self.vectors @ np.asarray(query_vector, dtype=np.float32)
+        if top_k < count:
+            candidates = np.argpartition(scores, -top_k)[-top_k:]
+        else:
+            candidates = np.arange(count)
+        best = candidates[np.argsort(scores[candidates])[::-1]]
+        return [(int(chunk_id), float(scores[chunk_id])) for chunk_id in best if scores[chunk_id] > 0]
+
+
+_cache = OrderedDict()
+_cache_lock = threading.Lock()
+
+
+def load_vector_index(index_dir, max_cached=256):
+    """Open a vector index, keeping the `max_cached` most recently used mappings open."""
+
+    path = os.path.join(index_dir, VECTORS_FILE)
+    if not os.path.isfile(path):
+        return None
+
+    mtime = os.path.getmtime(path)
+    with _cache_lock:
+        cached = _cache.get(index_dir)
+        if cached is not None and cached[0] == mtime:
+            _cache.move_to_end(index_dir)
+            return cached[1]
+
+    index = VectorIndex(index_dir)
+    with _cache_lock:
+        _cache[index_dir] = (mtime, index)
+        _cache.move_to_end(index_dir)
+        while len(_cache) > max_cached:
+            _cache.popitem(last=False)
+    return index
+
+
+def evict_vector_index(index_dir):
+    with _cache_lock:
+        _cache.pop(index_dir, None)
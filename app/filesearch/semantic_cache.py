@@ -0,0 +1,210 @@
+import re
+import threading
+from collections import Counter, OrderedDict
+
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+from app.filesearch.retrieval.extraction import STOPWORDS
+
+try:
+    import numpy as np
+except Exception:
+    np = None
+
+# Phrasing that does not change what is being asked ("what is X" / "explain X" / "define X")
+QUESTION_WORDS = frozenset(
+    'what whats explain describe define definition meaning mean means tell me please give '
+    'briefly short overview about does do can you'.split()
+)
+# Interrogatives that do: "how does X work" and "why does X work" are different questions
+INTERROGATIVES = frozenset('how why when where who which'.split())
+# Words, keeping the symbols that make a different term: "B+ tree", "B-tree", "C#" and "C++" stay apart
+TERM_RE = re.compile(r'\w+(?:[-+#]\w*)*')
+SYMBOL_RE = re.compile(r'[-+#]')
+PLURAL_RE = re.compile(r'(?<=[^s])s$')
+
+
+def query_terms(query):
+    """Content words and interrogatives of a question, with filler phrasing dropped and naive plural folding."""
+
+    return ' '.join(
+        PLURAL_RE.sub('', token) for token in TERM_RE.findall(query.lower())
+        if token in INTERROGATIVES or (token not in QUESTION_WORDS and token not in STOPWORDS)
+    )
+
+
+def query_signature(query):
+    """
+    Terms a near-duplicate must share exactly, on top of embedding similarity: the interrogatives
+    and symbol-bearing terms, which a bag-of-words embedding barely tells apart in a long question.
+    """
+
+    return ' '.join(sorted({
+        term for term in query_terms(query).split() if term in INTERROGATIVES or SYMBOL_RE.search(term)
+    }))
+
+
+class ScopeEntries:
+    """Past queries of one scope: a growable float32 matrix of query vectors plus their signatures and answers."""
+
+    def __init__(self, dim, capacity):
+        self.capacity = capacity
+        self.vectors = np.zeros((min(capacity, 16), dim), dtype=np.float32)
+        self.queries = []
+        self.signatures = []
+        self.answers = []
+        self.last_used = []
+        self.clock = 0
+
+    def __len__(self):
+        return len(self.answers)
+
+    def best(self, vector, signature):
+        """(row, cosine similarity) of the closest past query with the same signature, or (None, 0.0)."""
+
+        rows = [row for row, other in enumerate(self.signatures) if other == signature]
+        if not rows:
+            return None, 0.0
+        scores = self.vectors[rows] @ vector
+        best = int(np.argmax(scores))
+        return rows[best], float(scores[best])
+
+    def touch(self, row):
+        self.clock += 1
+        self.last_used[row] = self.clock
+
+    def put(self, vector, query, signature, answer, row=None):
+        if row is None and len(self.answers) >= self.capacity:
+            # Size-bounded: overwrite the least recently used past query
+            row = min(range(len(self.answers)), key=self.last_used.__getitem__)
+        if row is None:
+            row = len(self.answers)
+            if row >= self.vectors.shape[0]:
+                grown = np.zeros((min(self.vectors.shape[0] * 2, self.capacity), self.vectors.shape[1]),
+                                 dtype=np.float32)
+                grown[:row] = self.vectors
+                self.vectors = grown
+            self.queries.append(query)
+            self.signatures.append(signature)
+            self.answers.append(answer)
+            self.last_used.append(0)
+        else:
+            self.queries[row] = query
+            self.signatures[row] = signature
+            self.answers[row] = answer
+        self.vectors[row] = vector
+        self.touch(row)
+        return row
+
+
+class SemanticCache:
+    """
+    Near-duplicate query cache: answers are reused when a new question's embedding is within
+    SEMANTIC_CACHE_THRESHOLD cosine similarity of a past question on the same scope (store
+    contents, metadata filter, model, prompt version - see AnswerCache.scope_key) that also
+    has the same query_signature.
+
+    In-process only. Each scope keeps at most `max_entries` queries, and at most `max_scopes`
+    scopes are kept (least recently used first out). A scope key changes when its stores are
+    invalidated, so stale scopes simply age out.
+    """
+
+    def __init__(self, embedder, threshold, max_entries, max_scopes):
+        if np is None:
+            raise RuntimeError('numpy library is not available')
+        self.embedder = embedder
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.max_scopes = max_scopes
+        self._scopes = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats = Counter()
+
+    def embed(self, query):
+        return self.embedder.embed([query_terms(query) or query])[0]
+
+    def lookup(self, scope, query, vector=None):
+        """Return (answer, similarity, matched query) for a near-duplicate, or None."""
+
+        vector = self.embed(query) if vector is None else vector
+        with self._lock:
+            self.stats['lookups'] += 1
+            entries = self._scopes.get(scope)
+            if entries is None:
+                self.stats['misses'] += 1
+                return None
+            self._scopes.move_to_end(scope)
+            row, similarity = entries.best(vector, query_signature(query))
+            if row is None or similarity < self.threshold:
+                self.stats['misses'] += 1
+                return None
+            entries.touch(row)
+            self.stats['hits'] += 1
+            return entries.answers[row], similarity, entries.queries[row]
+
+    def record_override(self, scope, query, answer, vector=None):
+        """
+        A caller asked for a fresh answer (refresh) to a question the cache would have answered:
+        count it as a false hit and replace the cached answer.
+        """
+
+        vector = self.embed(query) if vector is None else vector
+        signature = query_signature(query)
+        with self._lock:
+            entries = self._scopes.get(scope)
+            row, similarity = entries.best(vector, signature) if entries is not None else (None, 0.0)
+            if row is not None and similarity >= self.threshold:
+                self.stats['overridden'] += 1
+                entries.put(vector, query, signature, answer, row=row)
+                return True
+        self.store(scope, query, answer, vector)
+        return False
+
+    def store(self, scope, query, answer, vector=None):
+        vector = self.embed(query) if vector is None else vector
+        with self._lock:
+            entries = self._scopes.get(scope)
+            if entries is None:
+                entries = self._scopes[scope] = ScopeEntries(self.embedder.dim, self.max_entries)
+                while len(self._scopes) > self.max_scopes:
+                    self._scopes.popitem(last=False)
+            self._scopes.move_to_end(scope)
+            entries.put(vector, query, query_signature(query), answer)
+
+    def snapshot(self):
+        with self._lock:
+            hits = self.stats['hits']
+            return {
+                'scopes': len(self._scopes),
+                'entries': sum(len(entries) for entries in self._scopes.values()),
+                'threshold': self.threshold,
+                'lookups': self.stats['lookups'],
+                'hits': hits,
+                'misses': self.stats['misses'],
+                'hit_rate': round(hits / self.stats['lookups'], 4) if self.stats['lookups'] else None,
+                'overridden': self.stats['overridden'],
+                'false_hit_rate': round(self.stats['overridden'] / hits, 4) if hits else None,
+            }
+
+
+_semantic_cache = None
+_semantic_cache_lock = threading.Lock()
+
+
+def get_semantic_cache():
+    """The process-wide SemanticCache, or None when disabled or numpy is missing."""
+
+    global _semantic_cache
+    if not settings.SEMANTIC_CACHE_ENABLED or np is None:
+        return None
+    if _semantic_cache is None:
+        with _semantic_cache_lock:
+            if _semantic_cache is None:
+                _semantic_cache = SemanticCache(
+                    embedder=import_string(settings.SEMANTIC_CACHE_EMBEDDER)(),
+                    threshold=settings.SEMANTIC_CACHE_THRESHOLD,
+                    max_entries=settings.SEMANTIC_CACHE_MAX_ENTRIES,
+                    max_scopes=settings.SEMANTIC_CACHE_MAX_SCOPES,
+                )
+    return _semantic_cache
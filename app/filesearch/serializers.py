@@ -1,13 +1,17 @@
+from django.conf import settings
 from rest_framework import serializers
 
-from app.filesearch.models import FileSearchStore
+from app.filesearch.models import FileSearchStore, UploadSession
+from app.global_constants import ErrorMessage
 
 
 class FileSearchStoreSerializer(serializers.ModelSerializer):
     class Meta:
         model = FileSearchStore
-        fields = ['id', 'user', 'title', 'file', 'store_name', 'status', 'error_message', 'created', 'updated']
-        read_only_fields = ['id', 'user', 'store_name', 'status', 'error_message', 'created', 'updated']
+        fields = ['id', 'user', 'title', 'file', 'store_name', 'content_hash', 'status', 'error_message',
+                  'ingestion_timings', 'created', 'updated']
+        read_only_fields = ['id', 'user', 'store_name', 'content_hash', 'status', 'error_message', 'ingestion_timings',
+                            'created', 'updated']
 
 
 class FileUploadSerializer(serializers.Serializer):
@@ -17,16 +21,56 @@ class FileUploadSerializer(serializers.Serializer):
 
 class QuerySerializer(serializers.Serializer):
     query = serializers.CharField()
-    document_id = serializers.IntegerField()
+    document_id = serializers.IntegerField(required=False)
+    document_ids = serializers.ListField(child=serializers.IntegerField(), min_length=1, required=False)
+    all_documents = serializers.BooleanField(required=False, default=False)
+    refresh = serializers.BooleanField(required=False, default=False)
+
+    def validate(self, attrs):
+        targets = [attrs.get('document_id') is not None, attrs.get('document_ids') is not None, attrs['all_documents']]
+        if sum(targets) > 1:
+            raise serializers.ValidationError(ErrorMessage.QUERY_TARGET_CONFLICT.value)
+        return attrs
+
+
+class BatchQuerySerializer(serializers.Serializer):
+    queries = serializers.ListField(child=serializers.CharField(), min_length=1,
+                                    max_length=settings.BATCH_QUERY_MAX_QUESTIONS)
+    document_id = serializers.IntegerField(required=False)
+    refresh = serializers.BooleanField(required=False, default=False)
+    ndjson = serializers.BooleanField(required=False, default=False)
 
 
 class FileStoreCreateSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = FileSearchStore
-        fields = ['title', 'file', 'user', 'status']
+        fields = ['title', 'file', 'user', 'status', 'content_hash']
 
 class FileSearchStoreListDisplaySerializer(serializers.ModelSerializer):
     class Meta:
         model = FileSearchStore
-        fields = ['id', 'title',]
\ No newline at end of file
+        fields = ['id', 'title',]
+
+
+class UploadSessionCreateSerializer(serializers.Serializer):
+    filename = serializers.CharField(max_length=255)
+    size = serializers.IntegerField(min_value=1)
+    title = serializers.CharField(required=False, allow_blank=True, max_length=255)
+
+    def validate_filename(self, value):
+        if not value.lower().endswith('.pdf'):
+            raise serializers.ValidationError(ErrorMessage.PDF_FILE_REQUIRED.value)
+        return value
+
+    def validate_size(self, value):
+        if value > settings.RESUMABLE_UPLOAD_MAX_SIZE:
+            raise serializers.ValidationError(ErrorMessage.UPLOAD_TOO_LARGE.value)
+        return value
+
+
+class UploadSessionSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = UploadSession
+        fields = ['id', 'title', 'filename', 'upload_length', 'offset', 'document', 'expires', 'created', 'updated']
+        read_only_fields = fields
@@ -0,0 +1,172 @@
+import asyncio
+import concurrent.futures
+import logging
+import os
+import socket
+import threading
+import time
+import uuid
+from collections import Counter
+from datetime import timedelta
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+
+from app.filesearch.models import QueryLock
+
+logger = logging.getLogger(__name__)
+
+
+class SingleFlightTimeout(Exception):
+    """An identical call is still running and did not finish within the single-flight timeout."""
+
+
+class LeaderCancelled(Exception):
+    """The leader of a coalesced call was cancelled (its client went away); a waiter takes over."""
+
+
+class SingleFlight:
+    """
+    Coalesces identical concurrent calls: the first caller for a key runs the function, callers
+    arriving while it runs wait for its result (or its exception) instead of running it again.
+
+    Across processes, the leader also takes a row in QueryLock (SINGLE_FLIGHT_CROSS_PROCESS).
+    Leaders of other processes then wait for the row to go away and read the result through
+    `lookup` - typically the shared answer cache - before falling back to calling upstream
+    themselves.
+    """
+
+    def __init__(self, timeout, cross_process=False, poll_interval=0.1):
+        self.timeout = timeout
+        self.cross_process = cross_process
+        self.poll_interval = poll_interval
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        # {key: concurrent.futures.Future of the leader's result}
+        self._calls = {}
+        self._lock = threading.Lock()
+        self.stats = Counter()
+
+    async def ado(self, key, coro_fn, lookup=None):
+        """
+        Return (result, shared) where `shared` is True if another caller's result was reused.
+
+        Duplicates await the leader's concurrent.futures.Future, which is not bound to an event
+        loop: under WSGI every async view runs in a loop of its own, and its calls are coalesced
+        with those of the other requests of the process all the same. If the leader is cancelled,
+        a waiter runs the call itself rather than failing.
+        """
+
+        deadline = time.monotonic() + self.timeout
+        while True:
+            with self._lock:
+                future = self._calls.get(key)
+                leader = future is None
+                if leader:
+                    future = self._calls[key] = concurrent.futures.Future()
+                    self.stats['leaders'] += 1
+                else:
+                    self.stats['coalesced'] += 1
+
+            if leader:
+                break
+            try:
+                # Shielded: a waiter giving up must not cancel the leader's future
+                remaining = max(deadline - time.monotonic(), 0)
+                return await asyncio.wait_for(asyncio.shield(asyncio.wrap_future(future)), remaining), True
+            except LeaderCancelled:
+                # Nothing went wrong with the call itself: run it again, as the new leader or behind one
+                continue
+            except asyncio.TimeoutError:
+                with self._lock:
+                    self.stats['timeouts'] += 1
+                raise SingleFlightTimeout(f"Identical call still running after {self.timeout}s")
+
+        try:
+            result, shared = await self._alead(key, coro_fn, lookup)
+        except BaseException as exc:
+            # Forgotten before waiters wake up, so the one retrying does not find the same future again
+            self._forget(key)
+            future.set_exception(exc if isinstance(exc, Exception) else LeaderCancelled())
+            raise
+        self._forget(key)
+        future.set_result(result)
+        return result, shared
+
+    def _forget(self, key):
+        with self._lock:
+            self._calls.pop(key, None)
+
+    async def _alead(self, key, coro_fn, lookup):
+        if not self.cross_process:
+            return await coro_fn(), False
+
+        deadline = time.monotonic() + self.timeout
+        while not await sync_to_async(self.acquire)(key):
+            if time.monotonic() >= deadline:
+                with self._lock:
+                    self.stats['timeouts'] += 1
+                raise SingleFlightTimeout(f"Identical call still running in another process after {self.timeout}s")
+            await asyncio.sleep(self.poll_interval)
+            if await sync_to_async(self.is_released)(key):
+                result = await sync_to_async(lookup)() if lookup is not None else None
+                if result is not None:
+                    with self._lock:
+                        self.stats['coalesced_remote'] += 1
+                    return result, True
+
+        try:
+            return await coro_fn(), False
+        finally:
+            await sync_to_async(self.release)(key)
+
+    # --- cross-process lock table --------------------------------------------
+
+    def acquire(self, key):
+        now = timezone.now()
+        QueryLock.objects.filter(key=key, expires__lt=now).delete()
+        try:
+            with transaction.atomic():
+                QueryLock.objects.create(key=key, owner=self.owner,
+                                         expires=now + timedelta(seconds=self.timeout))
+            return True
+        except IntegrityError:
+            return False
+
+    def is_released(self, key):
+        return not QueryLock.objects.filter(key=key, expires__gte=timezone.now()).exists()
+
+    def release(self, key):
+        try:
+            QueryLock.objects.filter(key=key, owner=self.owner).delete()
+        except Exception:
+            # The lease expires on its own
+            logger.exception("Failed to release query lock %s", key)
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                'in_flight': len(self._calls),
+                'leaders': self.stats['leaders'],
+                'coalesced': self.stats['coalesced'],
+                'coalesced_remote': self.stats['coalesced_remote'],
+                'timeouts': self.stats['timeouts'],
+            }
+
+
+_single_flight = None
+_single_flight_lock = threading.Lock()
+
+
+def get_single_flight():
+    global _single_flight
+    if _single_flight is None:
+        with _single_flight_lock:
+            if _single_flight is None:
+                _single_flight = SingleFlight(
+                    timeout=settings.SINGLE_FLIGHT_TIMEOUT,
+                    cross_process=settings.SINGLE_FLIGHT_CROSS_PROCESS,
+                    poll_interval=settings.SINGLE_FLIGHT_POLL_INTERVAL,
+                )
+    return _single_flight
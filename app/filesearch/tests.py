@@ -1,3 +1,1604 @@
-from django.test import TestCase
+import asyncio
+import fcntl
+import math
+import hashlib
+import io
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from unittest import mock
 
-# Create your tests here.
+from asgiref.sync import async_to_sync
+from django.contrib.auth import get_user_model
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.files.uploadhandler import StopFutureHandlers
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from app.filesearch.backends.fake import FakeAPIError, FakeBackend
+from app.filesearch.backends.gemini import build_http_options, httpx, types as genai_types
+from app.filesearch.backends.local import LocalBackend
+from app.filesearch.cache import AnswerCache, normalize_query
+from app.filesearch.gemini_client import GeminiClientWrapper, get_client, reset_clients, warm_up
+from app.filesearch.jobs import claim_jobs, compute_retry_delay, renew_leases, retry_failed_operations, _record_failure
+from app.filesearch.models import (
+    FileSearchStore, IngestionJob, QueryLock, RateLimitBucket, UploadSession, UserRemoteStore,
+)
+from app.filesearch.poller import OperationPoller
+from app.filesearch.singleflight import SingleFlight, SingleFlightTimeout
+from app.filesearch.semantic_cache import SemanticCache, query_signature, query_terms
+from app.filesearch.querying import (
+    NO_ANSWER, abatch_query, arun_query, astream_query, attribute_sources, documents_query_target,
+    resolve_query_documents, resolve_query_target,
+)
+from app.filesearch.processing import (
+    acquire_user_store, compute_file_hash, find_reusable_document, process_file_search_store, release_document,
+    release_user_store,
+)
+from app.filesearch.ratelimit import (
+    BACKGROUND, INTERACTIVE, REQUESTS, TOKENS, RateLimited, RateLimiter, quota_retry_delay,
+)
+from app.filesearch.resilience import (
+    QUERY_CALLS, UPLOAD_CALLS, AdaptiveLimiter, Bulkhead, CircuitBreaker, CircuitOpen, ConcurrencyLimitExceeded,
+    is_overload,
+)
+from app.filesearch.retrieval.bm25 import BM25IndexWriter, load_index
+from app.filesearch.retrieval.hybrid import apply_token_budget, reciprocal_rank_fusion, rerank
+from app.filesearch.retrieval.extraction import chunk_pages, extract_pages_parallel, tokenize
+from app.filesearch.retrieval.indexing import index_document
+from app.filesearch.retrieval.vectors import HashingEmbedder, VectorIndexWriter, load_vector_index
+from app.filesearch.upload_handlers import HashingMemoryFileUploadHandler
+from app.filesearch.uploads import (
+    UploadBusy, UploadClosed, UploadIncomplete, UploadOffsetMismatch, UploadTooLarge, append_chunk, create_session,
+    discard_session, finalize_session,
+)
+from app.global_constants import GlobalValues
+from app.role.models import Role
+
+# Fake Gemini backend without simulated latency or faults
+FAKE_BACKEND = {
+    'seed': 1,
+    'latency': {method: {'median_ms': 0} for method in (
+        'default', 'create_store', 'upload_file_to_store', 'get_operation', 'query_store', 'generate')},
+    'stream': {'first_token': {'median_ms': 0}, 'delta_interval_ms': 0},
+    'operation_duration': {'median_ms': 0},
+}
+
+
+def create_user(email='reader@example.com'):
+    role, _ = Role.objects.get_or_create(id=GlobalValues.USER.value, defaults={'name': 'User'})
+    return get_user_model().objects.create_user(email, 'secret', first_name='Test', last_name='Reader', role=role)
+
+
+def create_store(user, **fields):
+    return FileSearchStore.objects.create(user=user, title=fields.pop('title', 'Notes'),
+                                          file=fields.pop('file', 'uploads/filesearch/notes.pdf'), **fields)
+
+
+class IngestionJobQueueTests(TestCase):
+
+    def setUp(self):
+        self.store = create_store(create_user())
+
+    def test_claim_jobs_takes_due_pending_jobs_in_order(self):
+        now = timezone.now()
+        later = IngestionJob.objects.create(store=self.store, run_after=now - timedelta(seconds=10))
+        first = IngestionJob.objects.create(store=self.store, run_after=now - timedelta(seconds=60))
+        IngestionJob.objects.create(store=self.store, run_after=now + timedelta(minutes=5))
+
+        jobs = claim_jobs('worker-a', 5)
+
+        self.assertEqual([job.id for job in jobs], [first.id, later.id])
+        for job in IngestionJob.objects.filter(id__in=[first.id, later.id]):
+            self.assertEqual(job.status, IngestionJob.JobStatus.RUNNING)
+            self.assertEqual(job.attempts, 1)
+            self.assertEqual(job.locked_by, 'worker-a')
+
+    def test_claim_jobs_respects_limit_and_skips_claimed_jobs(self):
+        for _ in range(3):
+            IngestionJob.objects.create(store=self.store)
+
+        self.assertEqual(claim_jobs('worker-a', 0), [])
+        self.assertEqual(len(claim_jobs('worker-a', 2)), 2)
+        self.assertEqual(len(claim_jobs('worker-b', 5)), 1)
+        self.assertEqual(claim_jobs('worker-c', 5), [])
+
+    @override_settings(INGESTION_JOB_LEASE_TIMEOUT=60)
+    def test_claim_jobs_reclaims_expired_leases(self):
+        job = IngestionJob.objects.create(
+            store=self.store, status=IngestionJob.JobStatus.RUNNING, attempts=1,
+            locked_by='crashed', locked_at=timezone.now() - timedelta(seconds=120),
+        )
+
+        jobs = claim_jobs('worker-a', 5)
+
+        self.assertEqual([claimed.id for claimed in jobs], [job.id])
+        job.refresh_from_db()
+        self.assertEqual(job.locked_by, 'worker-a')
+        self.assertEqual(job.attempts, 2)
+
+    @override_settings(INGESTION_JOB_LEASE_TIMEOUT=60)
+    def test_claim_jobs_fails_expired_leases_on_their_last_attempt(self):
+        job = IngestionJob.objects.create(
+            store=self.store, status=IngestionJob.JobStatus.RUNNING, attempts=3, max_attempts=3,
+            locked_by='crashed', locked_at=timezone.now() - timedelta(seconds=120),
+        )
+
+        self.assertEqual(claim_jobs('worker-a', 5), [])
+
+        job.refresh_from_db()
+        self.assertEqual(job.status, IngestionJob.JobStatus.FAILED)
+        self.assertIsNone(job.locked_by)
+        self.assertEqual(job.last_error, 'Ingestion did not finish after 3 attempts')
+        self.store.refresh_from_db()
+        self.assertEqual(self.store.status, FileSearchStore.StoreStatus.FAILED)
+        self.assertEqual(self.store.error_message, job.last_error)
+
+    @override_settings(INGESTION_JOB_LEASE_TIMEOUT=60)
+    def test_renew_leases_keeps_running_jobs_from_being_reclaimed(self):
+        stale = timezone.now() - timedelta(seconds=120)
+        own = IngestionJob.objects.create(store=self.store, status=IngestionJob.JobStatus.RUNNING,
+                                          locked_by='worker-a', locked_at=stale)
+        other = IngestionJob.objects.create(store=self.store, status=IngestionJob.JobStatus.RUNNING,
+                                            locked_by='worker-b', locked_at=stale)
+
+        self.assertEqual(renew_leases('worker-a', [own.id, other.id]), 1)
+        self.assertEqual(renew_leases('worker-a', []), 0)
+
+        self.assertEqual([job.id for job in claim_jobs('worker-c', 5)], [other.id])
+
+    @override_settings(INGESTION_JOB_RETRY_BASE_DELAY=10, INGESTION_JOB_RETRY_MAX_DELAY=60)
+    def test_compute_retry_delay_doubles_with_jitter_up_to_the_cap(self):
+        for attempts, delay in ((1, 10), (2, 20), (3, 40), (4, 60), (10, 60)):
+            for _ in range(20):
+                self.assertTrue(delay / 2 <= compute_retry_delay(attempts) <= delay)
+
+    def test_record_failure_requeues_until_max_attempts(self):
+        IngestionJob.objects.create(store=self.store, max_attempts=2)
+        job = claim_jobs('worker-a', 1)[0]
+
+        _record_failure(job, RuntimeError('upload failed'))
+
+        job.refresh_from_db()
+        self.assertEqual(job.status, IngestionJob.JobStatus.PENDING)
+        self.assertIsNone(job.locked_by)
+        self.assertGreater(job.run_after, timezone.now())
+        self.assertEqual(job.last_error, 'upload failed')
+
+        IngestionJob.objects.filter(id=job.id).update(run_after=timezone.now())
+        job = claim_jobs('worker-a', 1)[0]
+        _record_failure(job, RuntimeError('upload failed again'))
+
+        job.refresh_from_db()
+        self.assertEqual(job.status, IngestionJob.JobStatus.FAILED)
+        self.assertEqual(job.attempts, 2)
+
+    def test_retry_failed_operations_requeues_succeeded_jobs_until_max_attempts(self):
+        retried = IngestionJob.objects.create(store=self.store, status=IngestionJob.JobStatus.SUCCEEDED, attempts=1)
+        other = create_store(self.store.user)
+        exhausted = IngestionJob.objects.create(store=other, status=IngestionJob.JobStatus.SUCCEEDED,
+                                                attempts=5, max_attempts=5)
+
+        requeued = retry_failed_operations({self.store.id: 'processing failed', other.id: 'processing failed'})
+
+        self.assertEqual(requeued, {self.store.id})
+        retried.refresh_from_db()
+        self.assertEqual(retried.status, IngestionJob.JobStatus.PENDING)
+        self.assertGreater(retried.run_after, timezone.now())
+        self.assertEqual(retried.last_error, 'processing failed')
+        exhausted.refresh_from_db()
+        self.assertEqual(exhausted.status, IngestionJob.JobStatus.FAILED)
+
+
+def fake_operation_name(store_name, done_at, outcome='ok'):
+    return f"{store_name}/upload/operations/fake-0123456789abcdef-{int(done_at * 1000)}-{outcome}"
+
+
+@override_settings(FILESEARCH_BACKEND='app.filesearch.backends.fake.FakeBackend', FAKE_FILESEARCH_BACKEND=FAKE_BACKEND)
+class OperationPollerTests(TestCase):
+
+    def setUp(self):
+        reset_clients()
+        self.addCleanup(reset_clients)
+        self.user = create_user()
+
+    def create_pending(self, outcome='ok', done_at=None, **fields):
+        store_name = f"fileSearchStores/fake-{FileSearchStore.objects.count()}"
+        return create_store(
+            self.user, store_name=store_name, status=FileSearchStore.StoreStatus.PROCESSING,
+            operation_name=fake_operation_name(store_name, time.time() - 1 if done_at is None else done_at, outcome),
+            operation_started=fields.pop('operation_started', timezone.now() - timedelta(seconds=5)),
+            next_poll_at=fields.pop('next_poll_at', timezone.now() - timedelta(seconds=1)), **fields,
+        )
+
+    def test_poll_once_marks_finished_operations_ready_or_failed(self):
+        ready = self.create_pending()
+        failed = self.create_pending(outcome='fail')
+
+        self.assertEqual(OperationPoller(concurrency=2).poll_once(), 2)
+
+        ready.refresh_from_db()
+        self.assertEqual(ready.status, FileSearchStore.StoreStatus.READY)
+        self.assertTrue(ready.remote_document_name.startswith(f"{ready.store_name}/documents/"))
+        self.assertIsNone(ready.operation_name)
+        self.assertIsNone(ready.next_poll_at)
+        self.assertIn('remote_processing', ready.ingestion_timings)
+
+        failed.refresh_from_db()
+        self.assertEqual(failed.status, FileSearchStore.StoreStatus.FAILED)
+        self.assertEqual(failed.error_message, 'Injected ingestion failure')
+
+    def test_poll_once_backs_off_running_operations(self):
+        store = self.create_pending(done_at=time.time() + 3600)
+
+        self.assertEqual(OperationPoller().poll_once(), 1)
+
+        store.refresh_from_db()
+        self.assertEqual(store.status, FileSearchStore.StoreStatus.PROCESSING)
+        self.assertEqual(store.poll_attempts, 1)
+        self.assertGreater(store.next_poll_at, timezone.now())
+        # Not due again yet
+        self.assertEqual(OperationPoller().poll_once(), 0)
+
+    def test_poll_once_requeues_the_ingestion_job_of_failed_operations(self):
+        store = self.create_pending(outcome='fail')
+        job = IngestionJob.objects.create(store=store, status=IngestionJob.JobStatus.SUCCEEDED, attempts=1)
+
+        OperationPoller().poll_once()
+
+        store.refresh_from_db()
+        self.assertEqual(store.status, FileSearchStore.StoreStatus.CREATED)
+        self.assertEqual(store.error_message, 'Injected ingestion failure')
+        self.assertIsNone(store.operation_name)
+        job.refresh_from_db()
+        self.assertEqual(job.status, IngestionJob.JobStatus.PENDING)
+
+    @override_settings(OPERATION_POLL_TIMEOUT=60)
+    def test_poll_once_fails_operations_past_the_timeout(self):
+        store = self.create_pending(done_at=time.time() + 3600,
+                                    operation_started=timezone.now() - timedelta(seconds=120))
+
+        OperationPoller().poll_once()
+
+        store.refresh_from_db()
+        self.assertEqual(store.status, FileSearchStore.StoreStatus.FAILED)
+        self.assertEqual(store.error_message, 'Upload timeout')
+
+    def test_poll_once_claims_at_most_one_batch_of_due_operations(self):
+        for _ in range(3):
+            self.create_pending()
+        self.create_pending(next_poll_at=timezone.now() + timedelta(minutes=5))
+
+        self.assertEqual(OperationPoller(batch_size=2).poll_once(), 2)
+        self.assertEqual(OperationPoller(batch_size=2).poll_once(), 1)
+        self.assertEqual(OperationPoller(batch_size=2).poll_once(), 0)
+
+
+class DeduplicationTests(TestCase):
+
+    def setUp(self):
+        self.user = create_user()
+        self.content = b'%PDF-1.4 lecture notes ' * 5000
+        self.content_hash = hashlib.sha256(self.content).hexdigest()
+
+    def test_compute_file_hash_reads_every_chunk(self):
+        self.assertEqual(compute_file_hash(ContentFile(self.content, name='notes.pdf')), self.content_hash)
+
+    def test_upload_handler_hashes_the_file_while_receiving_it(self):
+        handler = HashingMemoryFileUploadHandler()
+        handler.handle_raw_input(None, {}, len(self.content), 'boundary')
+        with self.assertRaises(StopFutureHandlers):
+            handler.new_file('file', 'notes.pdf', 'application/pdf', len(self.content))
+        for start in range(0, len(self.content), 4096):
+            self.assertIsNone(handler.receive_data_chunk(self.content[start:start + 4096], start))
+
+        self.assertEqual(handler.file_complete(len(self.content)).content_hash, self.content_hash)
+
+    def test_find_reusable_document_only_returns_ready_documents(self):
+        create_store(self.user, content_hash=self.content_hash, store_name='fileSearchStores/pending')
+        source = create_store(self.user, content_hash=self.content_hash, store_name='fileSearchStores/ready',
+                              status=FileSearchStore.StoreStatus.READY)
+
+        self.assertEqual(find_reusable_document(self.content_hash, self.user), source)
+        self.assertIsNone(find_reusable_document(self.content_hash, self.user, exclude_id=source.id))
+        self.assertIsNone(find_reusable_document(None, self.user))
+
+    def test_find_reusable_document_keeps_shared_stores_to_their_owner(self):
+        remote_store = UserRemoteStore.objects.create(user=self.user, store_name='fileSearchStores/library')
+        create_store(self.user, content_hash=self.content_hash, store_name=remote_store.store_name,
+                     remote_store=remote_store, status=FileSearchStore.StoreStatus.READY)
+
+        self.assertIsNotNone(find_reusable_document(self.content_hash, self.user))
+        self.assertIsNone(find_reusable_document(self.content_hash, create_user('other@example.com')))
+
+    def test_duplicate_upload_reuses_the_ingested_document(self):
+        source = create_store(self.user, content_hash=self.content_hash, store_name='fileSearchStores/ready',
+                              remote_document_name='fileSearchStores/ready/documents/1',
+                              status=FileSearchStore.StoreStatus.READY)
+        duplicate = create_store(self.user, content_hash=self.content_hash)
+
+        with mock.patch('app.filesearch.processing.find_reusable_document', wraps=find_reusable_document) as find:
+            process_file_search_store(duplicate.id)
+
+        # The source row is locked against a concurrent release_document while it is copied
+        find.assert_called_once_with(self.content_hash, mock.ANY, exclude_id=duplicate.id, lock=True)
+        duplicate.refresh_from_db()
+        self.assertEqual(duplicate.status, FileSearchStore.StoreStatus.READY)
+        self.assertEqual(duplicate.store_name, source.store_name)
+        self.assertEqual(duplicate.remote_document_name, source.remote_document_name)
+
+
+class ResumableUploadTests(TestCase):
+
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root, ignore_errors=True)
+        settings_override = override_settings(MEDIA_ROOT=media_root, RESUMABLE_UPLOAD_READ_SIZE=1024)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+        self.user = create_user()
+        self.content = os.urandom(10000)
+        self.session = create_session(self.user, 'notes.pdf', len(self.content), title='Notes')
+
+    def read_partial(self):
+        with default_storage.open(self.session.partial_file, 'rb') as partial:
+            return partial.read()
+
+    def upload(self, data, offset):
+        return append_chunk(self.session, io.BytesIO(data), offset, len(data))
+
+    def test_append_chunk_advances_the_offset(self):
+        self.assertEqual(self.upload(self.content[:4000], 0), 4000)
+        self.assertEqual(self.upload(self.content[4000:], 4000), len(self.content))
+
+        self.session.refresh_from_db()
+        self.assertEqual(self.session.offset, len(self.content))
+        self.assertEqual(self.read_partial(), self.content)
+
+    def test_append_chunk_rejects_wrong_offsets_and_oversized_chunks(self):
+        self.upload(self.content[:4000], 0)
+
+        with self.assertRaises(UploadOffsetMismatch):
+            self.upload(self.content[:4000], 0)
+        with self.assertRaises(UploadTooLarge):
+            self.upload(self.content[4000:] + b'extra', 4000)
+        self.assertEqual(self.read_partial(), self.content[:4000])
+
+    def test_append_chunk_keeps_the_bytes_of_an_interrupted_body(self):
+        # The client announced 6000 bytes but the connection dropped after 2500
+        offset = append_chunk(self.session, io.BytesIO(self.content[:2500]), 0, 6000)
+
+        self.assertEqual(offset, 2500)
+        self.session.refresh_from_db()
+        self.assertEqual(self.session.offset, 2500)
+        self.assertEqual(self.upload(self.content[2500:], 2500), len(self.content))
+        self.assertEqual(self.read_partial(), self.content)
+
+    def test_append_chunk_refuses_concurrent_writers(self):
+        with open(default_storage.path(self.session.partial_file), 'rb') as partial:
+            fcntl.flock(partial, fcntl.LOCK_EX)
+            with self.assertRaises(UploadBusy):
+                self.upload(self.content, 0)
+
+        self.assertEqual(self.upload(self.content, 0), len(self.content))
+
+    def test_finalize_session_creates_the_document_and_queues_ingestion(self):
+        with self.assertRaises(UploadIncomplete):
+            finalize_session(self.session)
+        self.upload(self.content, 0)
+
+        document = finalize_session(self.session)
+
+        self.assertEqual(document.status, FileSearchStore.StoreStatus.CREATED)
+        self.assertEqual(document.content_hash, hashlib.sha256(self.content).hexdigest())
+        self.assertEqual(document.file.read(), self.content)
+        document.file.close()
+        self.assertFalse(default_storage.exists(self.session.partial_file))
+        self.assertTrue(IngestionJob.objects.filter(store=document).exists())
+        self.session.refresh_from_db()
+        self.assertFalse(self.session.is_active)
+        self.assertEqual(self.session.document, document)
+
+    def test_append_chunk_refuses_finalized_and_discarded_sessions(self):
+        self.upload(self.content, 0)
+        stale = UploadSession.objects.get(id=self.session.id)
+        finalize_session(self.session)
+
+        # The partial file was moved into place
+        with self.assertRaises(UploadClosed):
+            append_chunk(stale, io.BytesIO(b''), len(self.content), 0)
+
+        session = create_session(self.user, 'notes.pdf', len(self.content))
+        stale = UploadSession.objects.get(id=session.id)
+        discard_session(session)
+        with self.assertRaises(UploadClosed):
+            append_chunk(stale, io.BytesIO(self.content), 0, len(self.content))
+
+    def test_upload_closed_while_sending_a_chunk_is_not_found(self):
+        client = APIClient()
+        client.force_authenticate(self.user)
+
+        with mock.patch('app.filesearch.views.append_chunk', side_effect=UploadClosed):
+            response = client.put(reverse('filesearch-upload-session', args=[self.session.id]), self.content,
+                                  content_type='application/offset+octet-stream', HTTP_UPLOAD_OFFSET='0')
+
+        self.assertEqual(response.status_code, 404)
+
+    def test_finalize_session_reuses_an_ingested_copy(self):
+        source = create_store(self.user, content_hash=hashlib.sha256(self.content).hexdigest(),
+                              store_name='fileSearchStores/ready', status=FileSearchStore.StoreStatus.READY)
+        self.upload(self.content, 0)
+
+        document = finalize_session(self.session)
+
+        self.assertEqual(document.status, FileSearchStore.StoreStatus.READY)
+        self.assertEqual(document.store_name, source.store_name)
+        self.assertFalse(IngestionJob.objects.filter(store=document).exists())
+        self.assertFalse(default_storage.exists(self.session.partial_file))
+
+
+class SharedRemoteDataTests(TestCase):
+
+    def setUp(self):
+        self.user = create_user()
+        patcher = mock.patch('app.filesearch.processing.get_client')
+        self.client = patcher.start().return_value
+        self.addCleanup(patcher.stop)
+
+    def test_release_document_deletes_a_store_with_its_last_document(self):
+        first, second = (create_store(self.user, store_name='fileSearchStores/notes',
+                                      status=FileSearchStore.StoreStatus.READY) for _ in range(2))
+
+        release_document(first)
+        self.client.delete_store.assert_not_called()
+
+        release_document(second)
+        self.client.delete_store.assert_called_once_with('fileSearchStores/notes')
+        self.assertFalse(FileSearchStore.objects.filter(is_active=True).exists())
+
+    def test_release_document_deletes_a_shared_file_with_its_last_document(self):
+        remote_store = UserRemoteStore.objects.create(user=self.user, store_name='fileSearchStores/library',
+                                                      document_count=2)
+        fields = {'store_name': remote_store.store_name, 'remote_store': remote_store,
+                  'status': FileSearchStore.StoreStatus.READY}
+        first = create_store(self.user, remote_document_name='fileSearchStores/library/documents/a', **fields)
+        duplicate = create_store(self.user, remote_document_name='fileSearchStores/library/documents/a', **fields)
+        other = create_store(self.user, remote_document_name='fileSearchStores/library/documents/b', **fields)
+
+        release_document(first)
+        self.client.delete_document.assert_not_called()
+        remote_store.refresh_from_db()
+        self.assertEqual(remote_store.document_count, 2)
+
+        release_document(duplicate)
+        self.client.delete_document.assert_called_once_with('fileSearchStores/library/documents/a')
+        self.client.delete_store.assert_not_called()
+        remote_store.refresh_from_db()
+        self.assertEqual(remote_store.document_count, 1)
+        self.assertTrue(FileSearchStore.objects.get(id=other.id).is_active)
+
+    def test_release_document_without_remote_data_only_deactivates(self):
+        document = create_store(self.user, status=FileSearchStore.StoreStatus.FAILED)
+
+        release_document(document)
+
+        self.assertFalse(FileSearchStore.objects.get(id=document.id).is_active)
+        self.client.delete_store.assert_not_called()
+        self.client.delete_document.assert_not_called()
+
+
+@override_settings(FILESEARCH_BACKEND='app.filesearch.backends.fake.FakeBackend', FAKE_FILESEARCH_BACKEND=FAKE_BACKEND,
+                   FILESEARCH_USER_STORE_POOL_SIZE=2)
+class UserStorePoolTests(TestCase):
+
+    def setUp(self):
+        reset_clients()
+        self.addCleanup(reset_clients)
+        self.user = create_user()
+
+    def test_acquire_user_store_fills_the_pool_then_picks_the_least_loaded(self):
+        client = get_client()
+
+        first = acquire_user_store(self.user, client)
+        self.assertEqual(acquire_user_store(self.user, client), UserRemoteStore.objects.exclude(id=first.id).get())
+        self.assertEqual(acquire_user_store(self.user, client), first)
+
+        self.assertEqual(UserRemoteStore.objects.filter(user=self.user).count(), 2)
+        self.assertEqual(sorted(UserRemoteStore.objects.values_list('document_count', flat=True)), [1, 2])
+        # Another user's documents never land in this pool
+        self.assertNotIn(acquire_user_store(create_user('other@example.com'), client),
+                         UserRemoteStore.objects.filter(user=self.user))
+
+    def test_final_ingestion_failure_gives_the_pool_slot_back(self):
+        user_store = acquire_user_store(self.user, get_client())
+        store = create_store(self.user, remote_store=user_store, store_name=user_store.store_name)
+        IngestionJob.objects.create(store=store, max_attempts=1)
+        job = claim_jobs('worker-a', 1)[0]
+
+        _record_failure(job, RuntimeError('upload failed'))
+        # Released once only
+        release_user_store(store.id)
+
+        user_store.refresh_from_db()
+        self.assertEqual(user_store.document_count, 0)
+        store.refresh_from_db()
+        self.assertIsNone(store.remote_store)
+        self.assertIsNone(store.store_name)
+
+
+@override_settings(FILESEARCH_BACKEND='app.filesearch.backends.fake.FakeBackend', FAKE_FILESEARCH_BACKEND=FAKE_BACKEND)
+class GeminiClientTests(SimpleTestCase):
+
+    def setUp(self):
+        reset_clients()
+        self.addCleanup(reset_clients)
+        health = mock.patch.dict('app.filesearch.gemini_client._health', {'checked': 0.0, 'result': None})
+        health.start()
+        self.addCleanup(health.stop)
+
+    def test_get_client_is_shared_per_process(self):
+        client = get_client()
+        self.assertIs(get_client(), client)
+
+        # A forked worker opens its own connections
+        with mock.patch('app.filesearch.gemini_client.os.getpid', return_value=os.getpid() + 1):
+            forked = get_client()
+        self.assertIsNot(forked, client)
+
+    def test_warm_up_pings_once_enabled_and_swallows_errors(self):
+        with override_settings(GEMINI_WARMUP_ON_START=False), \
+                mock.patch('app.filesearch.gemini_client.get_client') as client:
+            self.assertFalse(warm_up())
+        client.assert_not_called()
+
+        with override_settings(GEMINI_WARMUP_ON_START=True):
+            self.assertTrue(warm_up())
+            with override_settings(FAKE_FILESEARCH_BACKEND={**FAKE_BACKEND, 'error_rates': {500: 1.0}}), \
+                    self.assertLogs('app.filesearch.gemini_client', 'ERROR'):
+                reset_clients()
+                self.assertFalse(warm_up())
+
+    def test_health_endpoint_reports_the_circuit_state(self):
+        response = self.client.get(reverse('filesearch-health'))
+
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.data['results']['healthy'])
+        self.assertEqual(response.data['results']['circuit'], get_client().bulkhead.breaker.state)
+
+    @override_settings(GEMINI_HEALTH_CHECK_TTL=60)
+    def test_health_endpoint_hides_the_error_and_caches_the_result(self):
+        client = mock.Mock(**{'ping.side_effect': RuntimeError('upstream said: key AIza-secret is invalid')})
+        client.bulkhead.breaker.state = 'open'
+
+        with mock.patch('app.filesearch.gemini_client.get_client', return_value=client):
+            first = self.client.get(reverse('filesearch-health'))
+            second = self.client.get(reverse('filesearch-health'))
+
+        self.assertEqual((first.status_code, second.status_code), (503, 503))
+        self.assertIsNone(first.data['results']['error'])
+        self.assertNotIn(b'AIza-secret', first.content)
+        self.assertEqual(client.ping.call_count, 1)
+
+    @unittest.skipIf(genai_types is None or httpx is None, 'google-genai and httpx are not installed')
+    @override_settings(GEMINI_HTTP_TIMEOUT_MS=1500, GEMINI_HTTP_MAX_CONNECTIONS=8,
+                       GEMINI_HTTP_MAX_KEEPALIVE_CONNECTIONS=4, GEMINI_HTTP_KEEPALIVE_EXPIRY=30)
+    def test_build_http_options_sets_the_pool_limits_and_timeout(self):
+        options = build_http_options()
+
+        # Milliseconds, as google-genai expects
+        self.assertEqual(options.timeout, 1500)
+        limits = httpx.Limits(max_connections=8, max_keepalive_connections=4, keepalive_expiry=30)
+        self.assertEqual(options.client_args['limits'], limits)
+        self.assertEqual(options.async_client_args['limits'], limits)
+
+
+class FakeBackendTests(SimpleTestCase):
+
+    def backend(self, **config):
+        return FakeBackend({**FAKE_BACKEND, **config})
+
+    def test_error_rates_inject_api_errors(self):
+        with self.assertRaises(FakeAPIError) as raised:
+            self.backend(error_rates={429: 1.0}, quota_retry_delay=7).create_store()
+        self.assertEqual(raised.exception.code, 429)
+        self.assertEqual(quota_retry_delay(raised.exception), 7.0)
+
+        with self.assertRaises(FakeAPIError) as raised:
+            self.backend(error_rates={500: 1.0}).query_store(['fileSearchStores/a'], 'question')
+        self.assertEqual(raised.exception.code, 500)
+        self.assertIsNone(quota_retry_delay(raised.exception))
+
+    def test_operations_finish_after_their_duration(self):
+        running = self.backend(operation_duration={'median_ms': 60000, 'sigma': 0}).upload_file_to_store(
+            'fileSearchStores/a', 'notes.pdf')
+        self.assertFalse(running.done)
+
+        # Completion time and outcome are encoded in the name, so any process can poll it
+        finished = self.backend().get_operation(fake_operation_name('fileSearchStores/a', time.time() - 1))
+        self.assertTrue(finished.done)
+        self.assertIsNone(finished.error)
+        self.assertTrue(finished.response.document_name.startswith('fileSearchStores/a/documents/'))
+
+        failed = self.backend(operation_failure_rate=1.0).upload_file_to_store('fileSearchStores/a', 'notes.pdf')
+        self.assertTrue(failed.done)
+        self.assertEqual(failed.error['message'], 'Injected ingestion failure')
+
+        with self.assertRaises(FakeAPIError):
+            self.backend().get_operation('operations/unknown')
+
+    def test_response_sizes_follow_the_config(self):
+        response = self.backend(grounding_chunks=3, grounding_chunk_chars=50, answer_chars=120).query_store(
+            ['fileSearchStores/a'], 'question')
+
+        self.assertEqual(len(response.text), 120)
+        chunks = response.candidates[0].grounding_metadata.grounding_chunks
+        self.assertEqual([len(chunk.retrieved_context.text) for chunk in chunks], [50, 50, 50])
+
+    def test_seed_makes_latencies_reproducible(self):
+        def latencies(seed):
+            backend = FakeBackend({'seed': seed})
+            with mock.patch('app.filesearch.backends.fake.time.sleep') as sleep:
+                for _ in range(5):
+                    backend.generate('prompt')
+            return [call.args[0] for call in sleep.call_args_list]
+
+        self.assertEqual(latencies(7), latencies(7))
+        self.assertNotEqual(latencies(7), latencies(8))
+
+
+class ChunkingTests(SimpleTestCase):
+
+    def test_tokenize_lowercases_and_drops_stopwords(self):
+        self.assertEqual(tokenize('What is the B-Tree of a Database?'), ['b', 'tree', 'database'])
+
+    def test_chunk_pages_yields_overlapping_windows_across_pages(self):
+        pages = [(1, 'w1 w2 w3 w4'), (2, 'w5 w6 w7'), (3, '')]
+
+        chunks = list(chunk_pages(pages, chunk_words=4, overlap_words=1))
+
+        self.assertEqual(chunks, [
+            {'page': 1, 'text': 'w1 w2 w3 w4'},
+            {'page': 1, 'text': 'w4 w5 w6 w7'},
+        ])
+
+    def test_chunk_pages_emits_the_uncovered_tail(self):
+        chunks = list(chunk_pages([(1, 'w1 w2 w3 w4 w5 w6')], chunk_words=4, overlap_words=2))
+
+        self.assertEqual([chunk['text'] for chunk in chunks], ['w1 w2 w3 w4', 'w3 w4 w5 w6'])
+        self.assertEqual([chunk['text'] for chunk in chunk_pages([(1, 'w1 w2 w3 w4 w5 w6 w7')], 4, 2)],
+                         ['w1 w2 w3 w4', 'w3 w4 w5 w6', 'w5 w6 w7'])
+        self.assertEqual(list(chunk_pages([(2, 'short page')], 4, 2)), [{'page': 2, 'text': 'short page'}])
+        self.assertEqual(list(chunk_pages([(1, '  ')], 4, 2)), [])
+
+
+class BM25IndexTests(SimpleTestCase):
+
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory, ignore_errors=True)
+        self.index_dir = os.path.join(directory, 'index')
+
+    def build(self, texts):
+        writer = BM25IndexWriter(self.index_dir)
+        for page, text in enumerate(texts, start=1):
+            writer.add({'page': page, 'text': text})
+        writer.close()
+        writer.commit()
+        return load_index(self.index_dir)
+
+    def test_search_ranks_chunks_by_bm25_score(self):
+        index = self.build([
+            'binary search trees keep keys ordered',
+            'hash tables trade ordering for constant time lookups',
+            'b trees are search trees for disks; search trees again',
+        ])
+
+        results = index.search('search trees', top_k=5)
+
+        self.assertEqual([chunk_id for chunk_id, _ in results], [2, 0])
+        self.assertGreater(results[0][1], results[1][1])
+        self.assertEqual(index.search('trees', top_k=1)[0][0], 2)
+        self.assertEqual(index.search('graphs', top_k=5), [])
+
+    def test_rare_terms_weigh_more_than_common_ones(self):
+        index = self.build(['lecture one memory', 'lecture two cache', 'lecture three memory cache'])
+
+        self.assertEqual(index.search('lecture two', top_k=1)[0][0], 1)
+
+    def test_get_chunks_reads_chunks_by_id(self):
+        index = self.build(['first chunk', 'second chunk', 'third chunk'])
+
+        self.assertEqual(index.get_chunks([2, 0]), [{'page': 3, 'text': 'third chunk'},
+                                                    {'page': 1, 'text': 'first chunk'}])
+
+    def test_aborted_index_leaves_the_published_one_in_place(self):
+        self.build(['published chunk'])
+
+        writer = BM25IndexWriter(self.index_dir)
+        writer.add({'page': 1, 'text': 'replacement chunk'})
+        writer.abort()
+
+        self.assertFalse(os.path.exists(f"{self.index_dir}.tmp"))
+        self.assertEqual(load_index(self.index_dir).search('published', top_k=1)[0][0], 0)
+
+
+class ParallelExtractionTests(SimpleTestCase):
+
+    def test_extract_pages_parallel_yields_pages_in_order_with_a_bounded_window(self):
+        lock = threading.Lock()
+        submitted = []
+
+        def extract_page_range(path, start, stop):
+            with lock:
+                submitted.append(start)
+            # Later ranges finish first
+            time.sleep(0.01 * (10 - start) / 10)
+            return [(page, f"page {page}") for page in range(start, stop)]
+
+        def consume(pages):
+            for page, text in pages:
+                # Ranges submitted ahead of the consumer: the current one plus at most two more
+                self.assertLessEqual(max(submitted), page + 2 * 2)
+                yield page, text
+
+        with mock.patch('app.filesearch.retrieval.extraction.extract_page_range', extract_page_range), \
+                ThreadPoolExecutor(max_workers=3) as executor:
+            pages = list(consume(extract_pages_parallel('notes.pdf', executor, pages_per_task=2, max_in_flight=2,
+                                                        total_pages=9)))
+
+        self.assertEqual(pages, [(page, f"page {page}") for page in range(1, 10)])
+        self.assertEqual(sorted(submitted), [1, 3, 5, 7, 9])
+
+    @override_settings(LOCAL_EMBEDDER=None, LOCAL_RETRIEVAL_CHUNK_WORDS=4, LOCAL_RETRIEVAL_CHUNK_OVERLAP_WORDS=1)
+    def test_index_document_streams_pages_into_the_index_and_times_the_stages(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory, ignore_errors=True)
+        index_dir = os.path.join(directory, 'index')
+        pages = [(1, 'memory hierarchy cache lines'), (2, 'virtual memory pages tables')]
+
+        with mock.patch('app.filesearch.retrieval.indexing.iter_pages', return_value=(2, iter(pages))):
+            result = index_document('notes.pdf', index_dir, display_name='Notes')
+
+        self.assertEqual(result['pages'], 2)
+        self.assertEqual(result['chunks'], 3)
+        self.assertEqual(set(result['timings']), {'extract', 'chunk_index', 'write'})
+        index = load_index(index_dir)
+        self.assertEqual(index.search('tables', top_k=1)[0][0], 2)
+        # A chunk that starts on page 1 and runs into page 2 is attributed to page 1
+        self.assertEqual(index.get_chunks([1]), [{'page': 1, 'text': 'lines virtual memory pages'}])
+        self.assertFalse(os.path.exists(f"{index_dir}.tmp"))
+
+
+    @override_settings(LOCAL_EMBEDDING_BATCH_SIZE=64, LOCAL_RETRIEVAL_CHUNK_WORDS=4,
+                       LOCAL_RETRIEVAL_CHUNK_OVERLAP_WORDS=1)
+    def test_index_document_counts_the_last_embedding_batch_once(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory, ignore_errors=True)
+        embedder = HashingEmbedder(dim=16)
+        embed = embedder.embed
+
+        def slow_embed(texts):
+            time.sleep(0.1)
+            return embed(texts)
+
+        embedder.embed = slow_embed
+        pages = [(1, 'memory hierarchy cache lines'), (2, 'virtual memory pages tables')]
+
+        with mock.patch('app.filesearch.retrieval.indexing.iter_pages', return_value=(2, iter(pages))), \
+                mock.patch('app.filesearch.retrieval.indexing.get_embedder', return_value=embedder):
+            timings = index_document('notes.pdf', os.path.join(directory, 'index'))['timings']
+
+        # Every chunk fits in the last batch, embedded before the write stage starts
+        self.assertGreaterEqual(timings['embed'], 0.1)
+        self.assertLess(timings['write'], 0.1)
+        self.assertGreaterEqual(timings['chunk_index'], 0)
+
+
+class VectorIndexTests(SimpleTestCase):
+
+    def setUp(self):
+        self.index_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.index_dir, ignore_errors=True)
+        self.embedder = HashingEmbedder(dim=64)
+
+    def test_hashing_embedder_is_deterministic_and_normalised(self):
+        texts = ['cache misses and memory latency', 'cache misses and memory latency', '']
+        vectors = self.embedder.embed(texts)
+
+        self.assertEqual(vectors.shape, (3, 64))
+        self.assertEqual(vectors[0].tolist(), vectors[1].tolist())
+        self.assertEqual(vectors[0].tolist(), HashingEmbedder(dim=64).embed([texts[0]])[0].tolist())
+        self.assertTrue(math.isclose(float((vectors[0] ** 2).sum()), 1.0, rel_tol=1e-5))
+        self.assertFalse(vectors[2].any())
+
+    def test_written_vectors_are_searched_by_cosine_similarity(self):
+        texts = ['cache misses and memory latency', 'sorting algorithms compared', 'memory latency of disks',
+                 'graph traversal with queues', 'sorting networks']
+        writer = VectorIndexWriter(self.index_dir, self.embedder, batch_size=2)
+        for text in texts:
+            writer.add(text)
+        writer.close()
+
+        index = load_vector_index(self.index_dir)
+
+        self.assertEqual((len(index), index.dim), (5, 64))
+        self.assertEqual(index.vectors.tolist(), self.embedder.embed(texts).tolist())
+        results = index.search(self.embedder.embed(['memory latency'])[0], top_k=2)
+        self.assertEqual(sorted(chunk_id for chunk_id, _ in results), [0, 2])
+        self.assertGreaterEqual(results[0][1], results[1][1])
+        self.assertEqual(index.search(self.embedder.embed(['memory latency'])[0], top_k=0), [])
+
+    def test_load_vector_index_without_vectors_returns_none(self):
+        self.assertIsNone(load_vector_index(self.index_dir))
+
+
+class HybridRetrievalTests(SimpleTestCase):
+
+    def test_reciprocal_rank_fusion_sums_reciprocal_ranks(self):
+        fused = reciprocal_rank_fusion([['a', 'b', 'c'], ['b', 'd']], k=60)
+
+        self.assertEqual([key for key, _ in fused], ['b', 'a', 'd', 'c'])
+        self.assertAlmostEqual(dict(fused)['b'], 1 / 62 + 1 / 61)
+        self.assertEqual(reciprocal_rank_fusion([]), [])
+
+    def test_rerank_favours_chunks_covering_the_query(self):
+        candidates = [('loose', 1.0, 'memory is mentioned here'), ('exact', 0.8, 'virtual memory explained')]
+
+        self.assertEqual([key for key, _, _ in rerank('virtual memory', candidates)], ['exact', 'loose'])
+        self.assertEqual([key for key, _, _ in rerank('virtual memory', candidates, weight=0)], ['loose', 'exact'])
+        self.assertEqual(rerank('the', candidates), candidates)
+
+    def test_apply_token_budget_skips_candidates_that_do_not_fit(self):
+        candidates = [('best', 3, 'x' * 400), ('large', 2, 'x' * 800), ('small', 1, 'x' * 200), ('tiny', 0, 'x' * 4)]
+
+        self.assertEqual([key for key, _, _ in apply_token_budget(candidates, 160, 5)], ['best', 'small', 'tiny'])
+        self.assertEqual([key for key, _, _ in apply_token_budget(candidates, 160, 2)], ['best', 'small'])
+        # The best candidate is kept even when it alone exceeds the budget
+        self.assertEqual([key for key, _, _ in apply_token_budget(candidates, 10, 5)], ['best'])
+        self.assertEqual(len(apply_token_budget(candidates, 0, 5)), 4)
+
+    @override_settings(LOCAL_RETRIEVAL_MODE='hybrid', LOCAL_EMBEDDER='app.filesearch.retrieval.vectors.HashingEmbedder',
+                       LOCAL_RETRIEVAL_CHUNK_WORDS=6, LOCAL_RETRIEVAL_CHUNK_OVERLAP_WORDS=0,
+                       LOCAL_RETRIEVAL_TOKEN_BUDGET=0)
+    def test_local_backend_retrieves_across_documents_with_metadata_filters(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root, ignore_errors=True)
+        documents = {
+            'Caches': [(1, 'cache lines hold recently used memory'), (2, 'write back caches delay memory writes')],
+            'Graphs': [(1, 'breadth first search visits graph levels'), (2, 'depth first search uses a stack')],
+        }
+
+        with override_settings(MEDIA_ROOT=media_root):
+            backend = LocalBackend()
+            store_name = backend.create_store().name
+            for title, pages in documents.items():
+                with mock.patch('app.filesearch.retrieval.indexing.iter_pages', return_value=(2, iter(pages))):
+                    backend.upload_file_to_store(store_name, f"{title}.pdf", display_name=title,
+                                                 metadata={'title': title})
+
+            results = backend.retrieve([store_name], 'memory writes', top_k=2)
+            filtered = backend.retrieve([store_name], 'search memory', metadata_filter='title="Caches"', top_k=4)
+
+        self.assertEqual([(text, title) for _, text, title, _ in results],
+                         [('write back caches delay memory writes', 'Caches'),
+                          ('cache lines hold recently used memory', 'Caches')])
+        self.assertEqual({title for _, _, title, _ in filtered}, {'Caches'})
+
+
+LOCMEM_CACHES = {
+    'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'default'},
+    'answers': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'answers'},
+}
+
+
+class AnswerCacheTests(SimpleTestCase):
+
+    def setUp(self):
+        self.cache = AnswerCache(max_entries=2, ttl=60)
+
+    def test_normalize_query_ignores_case_whitespace_and_trailing_punctuation(self):
+        self.assertEqual(normalize_query('  What is  a B-Tree?! '), 'what is a b-tree')
+
+    def test_trivially_different_questions_share_a_key(self):
+        scope = self.cache.scope_key(['stores/b', 'stores/a'])
+
+        self.assertEqual(scope, self.cache.scope_key(['stores/a', 'stores/b', 'stores/a']))
+        self.assertEqual(self.cache.make_key(scope, 'What is a B-tree?'),
+                         self.cache.make_key(scope, 'what is a b-tree'))
+        self.assertNotEqual(scope, self.cache.scope_key(['stores/a', 'stores/b'], metadata_filter='title="x"'))
+        self.assertNotEqual(scope, self.cache.scope_key(['stores/a', 'stores/b'], prompt_version='v2'))
+
+    def test_invalidation_moves_every_scope_of_the_store_to_new_keys(self):
+        scope = self.cache.scope_key(['stores/a', 'stores/b'])
+        other = self.cache.scope_key(['stores/c'])
+        self.cache.set(self.cache.make_key(scope, 'question'), 'answer')
+
+        self.cache.invalidate(['stores/b', None])
+
+        new_scope = self.cache.scope_key(['stores/a', 'stores/b'])
+        self.assertNotEqual(new_scope, scope)
+        self.assertIsNone(self.cache.get(self.cache.make_key(new_scope, 'question')))
+        self.assertEqual(other, self.cache.scope_key(['stores/c']))
+        self.assertEqual(self.cache.snapshot()['invalidations'], 1)
+
+    def test_entries_expire_and_are_evicted_least_recently_used_first(self):
+        with mock.patch('app.filesearch.cache.time.monotonic', return_value=1000.0):
+            for key in ('a', 'b'):
+                self.cache.set(key, key.upper())
+            self.assertEqual(self.cache.get('a'), 'A')
+            self.cache.set('c', 'C')
+
+            self.assertIsNone(self.cache.get('b'))
+            self.assertEqual((self.cache.get('a'), self.cache.get('c')), ('A', 'C'))
+
+        with mock.patch('app.filesearch.cache.time.monotonic', return_value=1061.0):
+            self.assertIsNone(self.cache.get('a'))
+
+        snapshot = self.cache.snapshot()
+        self.assertEqual((snapshot['local_hits'], snapshot['misses'], snapshot['evictions']), (3, 2, 1))
+
+    @override_settings(CACHES=LOCMEM_CACHES)
+    def test_shared_tier_spreads_entries_and_invalidations_across_processes(self):
+        first = AnswerCache(max_entries=10, ttl=60, shared_alias='answers')
+        second = AnswerCache(max_entries=10, ttl=60, shared_alias='answers')
+        self.addCleanup(first.shared.clear)
+        scope = first.scope_key(['stores/a'])
+        first.set(first.make_key(scope, 'question'), 'answer')
+
+        self.assertEqual(second.get(second.make_key(second.scope_key(['stores/a']), 'question')), 'answer')
+        self.assertEqual(second.snapshot()['shared_hits'], 1)
+
+        first.invalidate(['stores/a'])
+
+        self.assertNotEqual(second.scope_key(['stores/a']), scope)
+
+
+class SemanticCacheTests(SimpleTestCase):
+
+    def setUp(self):
+        self.cache = SemanticCache(HashingEmbedder(), threshold=0.9, max_entries=2, max_scopes=2)
+
+    def test_query_terms_drop_phrasing_but_keep_interrogatives_and_symbols(self):
+        self.assertEqual(query_terms('What is a B-tree?'), 'b-tree')
+        self.assertEqual(query_terms('Explain B-trees'), 'b-tree')
+        self.assertEqual(query_terms('How does C++ handle memory'), 'how c++ handle memory')
+        self.assertEqual(query_signature('Why does a B+ tree split nodes'), 'b+ why')
+        self.assertEqual(query_signature('explain database indexes'), '')
+
+    def test_rephrased_question_hits_the_cache(self):
+        self.cache.store('scope', 'What is a B-tree?', 'answer')
+
+        answer, similarity, matched = self.cache.lookup('scope', 'explain B-trees')
+
+        self.assertEqual((answer, matched), ('answer', 'What is a B-tree?'))
+        self.assertGreaterEqual(similarity, 0.9)
+        self.assertIsNone(self.cache.lookup('other scope', 'explain B-trees'))
+
+    def test_questions_differing_in_interrogative_or_symbol_miss(self):
+        self.cache.store('scope', 'How does a B+ tree split nodes when a page is full', 'how answer')
+
+        self.assertIsNone(self.cache.lookup('scope', 'Why does a B+ tree split nodes when a page is full'))
+        self.assertIsNone(self.cache.lookup('scope', 'How does a B- tree split nodes when a page is full'))
+        self.assertEqual(self.cache.lookup('scope', 'how does a B+ tree split nodes when pages are full')[0],
+                         'how answer')
+
+    def test_entries_and_scopes_are_bounded(self):
+        for query in ('memory hierarchy', 'graph coloring'):
+            self.cache.store('scope', query, query)
+        self.cache.lookup('scope', 'memory hierarchy')
+        self.cache.store('scope', 'sorting networks', 'sorting networks')
+
+        self.assertIsNone(self.cache.lookup('scope', 'graph coloring'))
+        self.assertIsNotNone(self.cache.lookup('scope', 'memory hierarchy'))
+
+        self.cache.store('second', 'memory hierarchy', 'second')
+        self.cache.store('third', 'memory hierarchy', 'third')
+        self.assertIsNone(self.cache.lookup('scope', 'memory hierarchy'))
+        self.assertEqual(self.cache.snapshot()['scopes'], 2)
+
+    def test_record_override_replaces_the_answer_and_counts_a_false_hit(self):
+        self.cache.store('scope', 'What is a B-tree?', 'stale')
+
+        self.assertTrue(self.cache.record_override('scope', 'explain B-trees', 'fresh'))
+        self.assertFalse(self.cache.record_override('scope', 'graph coloring', 'new'))
+
+        self.assertEqual(self.cache.lookup('scope', 'what is a b-tree')[0], 'fresh')
+        snapshot = self.cache.snapshot()
+        self.assertEqual((snapshot['overridden'], snapshot['entries']), (1, 2))
+
+
+class SingleFlightTests(TestCase):
+
+    def setUp(self):
+        self.single_flight = SingleFlight(timeout=5, poll_interval=0.01)
+        self.calls = 0
+
+    async def slow_answer(self):
+        self.calls += 1
+        number = self.calls
+        await asyncio.sleep(0.05)
+        return f"answer {number}"
+
+    def test_identical_concurrent_calls_share_one_result(self):
+        async def ask():
+            return await asyncio.gather(*(self.single_flight.ado('key', self.slow_answer) for _ in range(5)),
+                                        self.single_flight.ado('other key', self.slow_answer))
+
+        results = asyncio.run(ask())
+
+        self.assertEqual(self.calls, 2)
+        self.assertEqual([shared for _, shared in results[:5]], [False, True, True, True, True])
+        self.assertEqual({result for result, _ in results[:5]}, {'answer 1'})
+        snapshot = self.single_flight.snapshot()
+        self.assertEqual((snapshot['leaders'], snapshot['coalesced'], snapshot['in_flight']), (2, 4, 0))
+        # Finished calls are not reused
+        self.assertEqual(asyncio.run(self.single_flight.ado('key', self.slow_answer)), ('answer 3', False))
+
+    def test_waiters_receive_the_leader_exception(self):
+        async def failing():
+            await asyncio.sleep(0.05)
+            raise ValueError('upstream failed')
+
+        async def ask():
+            return await asyncio.gather(*(self.single_flight.ado('key', failing) for _ in range(3)),
+                                        return_exceptions=True)
+
+        self.assertEqual([type(result) for result in asyncio.run(ask())], [ValueError] * 3)
+        self.assertEqual(self.single_flight.snapshot()['in_flight'], 0)
+
+    def test_a_waiter_takes_over_when_the_leader_is_cancelled(self):
+        async def ask():
+            leader = asyncio.ensure_future(self.single_flight.ado('key', self.slow_answer))
+            await asyncio.sleep(0)
+            waiters = [asyncio.ensure_future(self.single_flight.ado('key', self.slow_answer)) for _ in range(2)]
+            await asyncio.sleep(0.01)
+            # Client disconnect
+            leader.cancel()
+            return await asyncio.gather(*waiters)
+
+        results = asyncio.run(ask())
+
+        # One waiter ran the call again, the other shared its result
+        self.assertEqual(self.calls, 2)
+        self.assertEqual(sorted(results, key=lambda result: result[1]), [('answer 2', False), ('answer 2', True)])
+        self.assertEqual(self.single_flight.snapshot()['in_flight'], 0)
+
+    def test_waiters_give_up_after_the_timeout(self):
+        self.single_flight.timeout = 0.05
+
+        async def ask():
+            leader = asyncio.ensure_future(self.single_flight.ado('key', lambda: asyncio.sleep(0.2, 'late')))
+            await asyncio.sleep(0)
+            with self.assertRaises(SingleFlightTimeout):
+                await self.single_flight.ado('key', self.slow_answer)
+            return await leader
+
+        self.assertEqual(asyncio.run(ask()), ('late', False))
+        self.assertEqual(self.calls, 0)
+
+    def test_lock_rows_keep_other_processes_out_until_released(self):
+        other = SingleFlight(timeout=5)
+
+        self.assertTrue(self.single_flight.acquire('key'))
+        self.assertFalse(other.acquire('key'))
+        self.assertFalse(other.is_released('key'))
+
+        other.release('key')
+        self.assertFalse(self.single_flight.is_released('key'))
+        self.single_flight.release('key')
+        self.assertTrue(other.is_released('key'))
+        self.assertTrue(other.acquire('key'))
+
+    def test_expired_lock_rows_are_taken_over(self):
+        QueryLock.objects.create(key='key', owner='crashed', expires=timezone.now() - timedelta(seconds=1))
+
+        self.assertTrue(self.single_flight.acquire('key'))
+        self.assertEqual(QueryLock.objects.get(key='key').owner, self.single_flight.owner)
+
+    def test_cross_process_leader_reads_the_result_of_another_process(self):
+        single_flight = SingleFlight(timeout=5, cross_process=True, poll_interval=0.01)
+        # Another process is answering and releases (here: its lease runs out) shortly
+        QueryLock.objects.create(key='key', owner='other', expires=timezone.now() + timedelta(seconds=0.1))
+
+        result = async_to_sync(single_flight.ado)('key', self.slow_answer, lookup=lambda: 'their answer')
+
+        self.assertEqual(result, ('their answer', True))
+        self.assertEqual(self.calls, 0)
+        self.assertEqual(single_flight.snapshot()['coalesced_remote'], 1)
+
+    def test_cross_process_leader_calls_upstream_and_releases_its_lock(self):
+        single_flight = SingleFlight(timeout=5, cross_process=True, poll_interval=0.01)
+
+        self.assertEqual(async_to_sync(single_flight.ado)('key', self.slow_answer), ('answer 1', False))
+        self.assertFalse(QueryLock.objects.exists())
+
+
+@override_settings(FILESEARCH_BACKEND='app.filesearch.backends.fake.FakeBackend', FAKE_FILESEARCH_BACKEND=FAKE_BACKEND)
+class QueryTestCase(SimpleTestCase):
+    """Queries against the fake backend, with caches and single-flight of their own."""
+
+    def setUp(self):
+        reset_clients()
+        self.addCleanup(reset_clients)
+        self.answer_cache = AnswerCache(max_entries=100, ttl=60)
+        self.semantic_cache = SemanticCache(HashingEmbedder(), threshold=0.9, max_entries=10, max_scopes=10)
+        self.single_flight = SingleFlight(timeout=5)
+        for name, value in (('get_answer_cache', self.answer_cache), ('get_semantic_cache', self.semantic_cache),
+                            ('get_single_flight', self.single_flight)):
+            patcher = mock.patch(f'app.filesearch.querying.{name}', return_value=value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def stream(self, *args, **kwargs):
+        async def collect():
+            return [event async for event in astream_query(*args, **kwargs)]
+        return asyncio.run(collect())
+
+
+class StreamingQueryTests(QueryTestCase):
+
+    def test_stream_yields_deltas_then_the_full_result(self):
+        events = self.stream(['fileSearchStores/notes'], 'what is a heap')
+
+        kinds = [kind for kind, _ in events]
+        self.assertEqual(kinds, ['delta'] * (len(events) - 1) + ['done'])
+        self.assertGreater(len(events), 2)
+        result = events[-1][1]
+        self.assertEqual(''.join(delta for _, delta in events[:-1]), result['response_text'])
+        self.assertEqual(len(result['grounding_chunks']), 5)
+        self.assertEqual(len(result['grounding_sources']), 5)
+        self.assertIsNone(result['cache'])
+
+    def test_streamed_answer_is_cached_for_the_next_query(self):
+        answer = self.stream(['fileSearchStores/notes'], 'what is a heap')[-1][1]
+
+        events = self.stream(['fileSearchStores/notes'], 'What is a heap?')
+        self.assertEqual(events, [('delta', answer['response_text']),
+                                  ('done', {**answer, 'cache': {'type': 'exact'}})])
+        self.assertEqual(asyncio.run(arun_query(['fileSearchStores/notes'], 'what is a heap'))['cache'],
+                         {'type': 'exact'})
+
+    @override_settings(FAKE_FILESEARCH_BACKEND={**FAKE_BACKEND, 'grounding_chunks': 0})
+    def test_ungrounded_stream_ends_with_no_answer(self):
+        events = self.stream(['fileSearchStores/notes'], 'what is a heap')
+
+        self.assertTrue(events[0][1])
+        self.assertEqual(events[-1][1]['response_text'], NO_ANSWER)
+
+
+class AsyncQueryTests(QueryTestCase):
+
+    def test_arun_query_reports_where_the_answer_came_from(self):
+        fresh = asyncio.run(arun_query(['fileSearchStores/notes'], 'What is a B-tree?'))
+        exact = asyncio.run(arun_query(['fileSearchStores/notes'], 'what is a b-tree'))
+        semantic = asyncio.run(arun_query(['fileSearchStores/notes'], 'explain B-trees'))
+        refreshed = asyncio.run(arun_query(['fileSearchStores/notes'], 'explain B-trees', refresh=True))
+
+        self.assertIsNone(fresh['cache'])
+        self.assertEqual(exact, {**fresh, 'cache': {'type': 'exact'}})
+        self.assertEqual(semantic['cache']['type'], 'semantic')
+        self.assertEqual(semantic['cache']['matched_query'], 'What is a B-tree?')
+        self.assertIsNone(refreshed['cache'])
+        self.assertEqual(self.semantic_cache.snapshot()['overridden'], 1)
+
+    @override_settings(FAKE_FILESEARCH_BACKEND={
+        **FAKE_BACKEND, 'latency': {**FAKE_BACKEND['latency'], 'query_store': {'median_ms': 100}},
+    })
+    def test_identical_queries_from_separate_event_loops_share_one_call(self):
+        # Under WSGI every async view runs in an event loop of its own
+        barrier = threading.Barrier(5)
+        results = []
+
+        def ask():
+            barrier.wait()
+            results.append(asyncio.run(arun_query(['fileSearchStores/notes'], 'what is a heap')))
+
+        with mock.patch('app.filesearch.backends.fake.FakeBackend.aquery_store', autospec=True,
+                        side_effect=FakeBackend.aquery_store) as aquery_store:
+            threads = [threading.Thread(target=ask) for _ in range(5)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+        self.assertEqual(aquery_store.call_count, 1)
+        self.assertEqual(len({result['response_text'] for result in results}), 1)
+        self.assertEqual(sorted(str(result['cache']) for result in results),
+                         ['None'] + ["{'type': 'coalesced'}"] * 4)
+
+
+class BatchQueryTests(QueryTestCase):
+
+    def batch(self, queries, **kwargs):
+        async def collect():
+            return [item async for item in abatch_query(['fileSearchStores/notes'], queries, **kwargs)]
+        return asyncio.run(collect())
+
+    def test_batch_yields_results_in_input_order(self):
+        queries = [f"question {index}" for index in range(6)]
+
+        results = self.batch(queries, concurrency=2)
+
+        self.assertEqual([index for index, _, _ in results], list(range(6)))
+        self.assertTrue(all(result['response_text'] and error is None for _, result, error in results))
+        # Answers are cached like those of single queries
+        self.assertEqual(asyncio.run(arun_query(['fileSearchStores/notes'], 'question 0'))['cache'], {'type': 'exact'})
+
+    def test_batch_runs_at_most_concurrency_questions_at_a_time(self):
+        running = 0
+        peak = 0
+
+        async def aquery_store(store_names, query, **kwargs):
+            nonlocal running, peak
+            running += 1
+            peak = max(peak, running)
+            await asyncio.sleep(0.01)
+            running -= 1
+            if query == 'broken':
+                raise ValueError('upstream failed')
+            return FakeBackend(FAKE_BACKEND)._response('answer', [])
+
+        with mock.patch('app.filesearch.querying.get_client') as get_client:
+            get_client.return_value.aquery_store = aquery_store
+            results = self.batch(['one', 'broken', 'three', 'four', 'five'], concurrency=2)
+
+        self.assertEqual(peak, 2)
+        self.assertEqual([type(error) for _, _, error in results], [type(None), ValueError] + [type(None)] * 3)
+        self.assertIsNone(results[1][1])
+
+
+class LibraryQueryTests(TestCase):
+
+    def setUp(self):
+        self.user = create_user()
+        self.library = UserRemoteStore.objects.create(user=self.user, store_name='fileSearchStores/library')
+
+    def create_ready(self, title, **fields):
+        return create_store(self.user, title=title, status=FileSearchStore.StoreStatus.READY, **fields)
+
+    def test_resolve_query_target_prefers_the_library_over_the_latest_document(self):
+        dedicated = self.create_ready('Dedicated', store_name='fileSearchStores/dedicated')
+        self.assertEqual(resolve_query_target(self.user), (dedicated, []))
+
+        self.create_ready('Shared', store_name=self.library.store_name, remote_store=self.library, content_hash='a')
+        self.assertEqual(resolve_query_target(self.user), (None, ['fileSearchStores/library']))
+        self.assertEqual(resolve_query_target(self.user, dedicated.id), (dedicated, []))
+        self.assertEqual(resolve_query_target(create_user('other@example.com'), dedicated.id), (None, []))
+
+    def test_resolve_query_documents_returns_ready_documents_with_a_store(self):
+        first = self.create_ready('First', store_name='fileSearchStores/first')
+        second = self.create_ready('Second', store_name='fileSearchStores/second')
+        self.create_ready('No store')
+        create_store(self.user, title='Processing', store_name='fileSearchStores/processing',
+                     status=FileSearchStore.StoreStatus.PROCESSING)
+
+        self.assertEqual(resolve_query_documents(self.user), [second, first])
+        self.assertEqual(resolve_query_documents(self.user, [first.id]), [first])
+
+    def test_documents_query_target_filters_shared_stores_by_content_hash(self):
+        dedicated = self.create_ready('Dedicated', store_name='fileSearchStores/dedicated')
+        shared = [self.create_ready(f"Shared {content_hash}", store_name=self.library.store_name,
+                                    remote_store=self.library, content_hash=content_hash)
+                  for content_hash in ('bbb', 'aaa')]
+
+        self.assertEqual(documents_query_target([dedicated]), (['fileSearchStores/dedicated'], None))
+        self.assertEqual(documents_query_target([dedicated, *shared]),
+                         (['fileSearchStores/dedicated', 'fileSearchStores/library'],
+                          'content_hash="aaa" OR content_hash="bbb"'))
+
+    def test_attribute_sources_matches_chunks_to_their_documents(self):
+        dedicated = self.create_ready('Dedicated', store_name='fileSearchStores/dedicated')
+        shared = self.create_ready('Shared', store_name=self.library.store_name, remote_store=self.library,
+                                   remote_document_name='fileSearchStores/library/documents/shared')
+        result = {
+            'grounding_chunks': ['from dedicated', 'from shared', 'unknown'],
+            'grounding_sources': [
+                {'title': 'x', 'document_name': 'fileSearchStores/dedicated/documents/1', 'score': 0.2},
+                {'title': 'y', 'document_name': 'fileSearchStores/library/documents/shared', 'score': 0.9},
+                {'title': 'Elsewhere', 'document_name': 'fileSearchStores/library/documents/gone', 'score': None},
+            ],
+        }
+
+        self.assertEqual(attribute_sources([dedicated, shared], result), [
+            {'text': 'from shared', 'score': 0.9, 'document_id': str(shared.id), 'title': 'Shared'},
+            {'text': 'from dedicated', 'score': 0.2, 'document_id': str(dedicated.id), 'title': 'Dedicated'},
+            {'text': 'unknown', 'score': None, 'document_id': None, 'title': 'Elsewhere'},
+        ])
+
+
+class CircuitBreakerTests(SimpleTestCase):
+
+    def setUp(self):
+        self.now = 1000.0
+        patcher = mock.patch('app.filesearch.resilience.time.monotonic', side_effect=lambda: self.now)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.breaker = CircuitBreaker(window=10, min_calls=4, failure_rate=0.5, open_seconds=30, half_open_calls=2)
+
+    def open_circuit(self):
+        for failed in (False, True, False, True):
+            self.assertFalse(self.breaker.before_call())
+            self.breaker.record(failed)
+
+    def test_opens_once_enough_calls_failed(self):
+        self.breaker.record(True)
+        self.breaker.record(True)
+        # Below min_calls
+        self.assertEqual(self.breaker.state, CircuitBreaker.CLOSED)
+
+        self.breaker.record(False)
+        self.breaker.record(False)
+        self.assertEqual(self.breaker.state, CircuitBreaker.OPEN)
+
+        with self.assertRaises(CircuitOpen) as raised:
+            self.breaker.before_call()
+        self.assertEqual(raised.exception.retry_after, 30)
+        self.assertEqual(self.breaker.snapshot()['rejected'], 1)
+
+    def test_half_open_probes_close_the_circuit(self):
+        self.open_circuit()
+        self.now += 30
+
+        self.assertTrue(self.breaker.before_call())
+        self.assertTrue(self.breaker.before_call())
+        self.assertEqual(self.breaker.state, CircuitBreaker.HALF_OPEN)
+        # Only `half_open_calls` probes at a time
+        with self.assertRaises(CircuitOpen):
+            self.breaker.before_call()
+
+        self.breaker.record(False, probe=True)
+        self.breaker.record(False, probe=True)
+        self.assertEqual(self.breaker.state, CircuitBreaker.CLOSED)
+        self.assertFalse(self.breaker.before_call())
+
+    def test_failed_probe_opens_the_circuit_again(self):
+        self.open_circuit()
+        self.now += 30
+        self.assertTrue(self.breaker.before_call())
+
+        self.breaker.record(True, probe=True)
+
+        self.assertEqual(self.breaker.state, CircuitBreaker.OPEN)
+        self.assertEqual(self.breaker.snapshot()['opened'], 2)
+
+    def test_cancelled_probe_frees_its_slot(self):
+        self.open_circuit()
+        self.now += 30
+        self.breaker.before_call()
+        self.breaker.before_call()
+
+        self.breaker.cancel_probe()
+
+        self.assertTrue(self.breaker.before_call())
+
+
+class AdaptiveLimiterTests(SimpleTestCase):
+
+    def make_limiter(self, **kwargs):
+        return AdaptiveLimiter(**{'initial': 10, 'min_limit': 2, 'max_limit': 100, 'queue_timeout': 0.05,
+                                  'window': 10, **kwargs})
+
+    def complete(self, limiter, latencies):
+        for latency in latencies:
+            limiter.acquire()
+            limiter.release(latency=latency)
+
+    def test_successes_raise_the_limit_by_about_one_per_round(self):
+        limiter = self.make_limiter()
+
+        self.complete(limiter, [0.1] * 10)
+
+        self.assertEqual(int(limiter.limit), 10)
+        self.assertGreater(limiter.limit, 10.9)
+        self.assertLessEqual(self.make_limiter(initial=100).limit, 100)
+
+    def test_latency_noise_does_not_cut_the_limit(self):
+        limiter = self.make_limiter()
+
+        self.complete(limiter, [0.05, 0.1, 0.2, 0.1, 0.15] * 20)
+
+        self.assertEqual(limiter.snapshot()['decreases'], 0)
+
+    def test_queueing_latency_cuts_the_limit_once_per_window(self):
+        limiter = self.make_limiter()
+        self.complete(limiter, [0.1] * 40)
+        # Finish the window in progress, so the slow calls fill the next one
+        while limiter._window_calls:
+            self.complete(limiter, [0.1])
+        limit = limiter.limit
+
+        # One round, plus the call the limit grew by meanwhile
+        self.complete(limiter, [0.5] * (int(limiter.limit) + 1))
+
+        self.assertEqual(limiter.snapshot()['decreases'], 1)
+        self.assertLess(limiter.limit, limit)
+        self.assertEqual(limiter.snapshot()['baseline_latency_ms'], 100.0)
+
+    def test_a_burst_of_errors_costs_one_decrease(self):
+        limiter = self.make_limiter(initial=20)
+
+        for _ in range(8):
+            limiter.acquire()
+            limiter.release(overload=True)
+
+        self.assertEqual(limiter.limit, 10)
+        self.assertEqual(limiter.snapshot()['decreases'], 1)
+
+    def test_callers_over_the_limit_wait_then_give_up(self):
+        limiter = self.make_limiter(initial=2)
+        limiter.acquire()
+        limiter.acquire()
+
+        with self.assertRaises(ConcurrencyLimitExceeded):
+            limiter.acquire()
+        with self.assertRaises(ConcurrencyLimitExceeded):
+            asyncio.run(limiter.aacquire())
+        self.assertEqual(limiter.snapshot()['rejected'], 2)
+
+    def test_release_wakes_an_async_waiter(self):
+        limiter = self.make_limiter(initial=2, queue_timeout=1)
+        limiter.acquire()
+        limiter.acquire()
+
+        async def wait_for_slot():
+            waiter = asyncio.ensure_future(limiter.aacquire())
+            await asyncio.sleep(0.01)
+            self.assertEqual(limiter.snapshot()['waiting'], 1)
+            threading.Thread(target=limiter.release, kwargs={'latency': 0.1}).start()
+            await waiter
+
+        asyncio.run(wait_for_slot())
+        self.assertEqual(limiter.in_flight, 2)
+
+
+class BulkheadTests(SimpleTestCase):
+
+    def setUp(self):
+        self.bulkhead = Bulkhead(
+            CircuitBreaker(window=10, min_calls=2, failure_rate=0.5, open_seconds=30, half_open_calls=1),
+            lambda: AdaptiveLimiter(initial=1, min_limit=1, max_limit=10, queue_timeout=0.01),
+        )
+
+    def test_each_call_class_has_its_own_limit(self):
+        with self.bulkhead.guard(UPLOAD_CALLS):
+            with self.bulkhead.guard(QUERY_CALLS):
+                with self.assertRaises(ConcurrencyLimitExceeded):
+                    with self.bulkhead.guard(QUERY_CALLS):
+                        pass
+
+        self.assertEqual(set(self.bulkhead.snapshot()['concurrency']), {QUERY_CALLS, UPLOAD_CALLS})
+
+    def test_only_overload_errors_count_against_the_circuit(self):
+        for exc in (ValueError('bad request'), FakeAPIError(400, 'bad request')):
+            with self.assertRaises(type(exc)):
+                with self.bulkhead.guard():
+                    raise exc
+        self.assertEqual(self.bulkhead.breaker.state, CircuitBreaker.CLOSED)
+
+        for _ in range(2):
+            with self.assertRaises(FakeAPIError):
+                with self.bulkhead.guard():
+                    raise FakeAPIError(503, 'overloaded')
+        with self.assertRaises(CircuitOpen):
+            with self.bulkhead.guard():
+                pass
+
+    def test_streamed_calls_report_the_time_to_the_first_response(self):
+        async def stream():
+            async with self.bulkhead.aguard(QUERY_CALLS) as call:
+                call.first_response()
+                # The client reads the rest slowly
+                await asyncio.sleep(0.1)
+
+        limiter = self.bulkhead.limiter(QUERY_CALLS)
+        with mock.patch.object(limiter, 'release', wraps=limiter.release) as release:
+            asyncio.run(stream())
+
+        self.assertLess(release.call_args.kwargs['latency'], 0.05)
+
+    def test_is_overload(self):
+        self.assertTrue(is_overload(FakeAPIError(429, 'quota')))
+        self.assertTrue(is_overload(FakeAPIError(500, 'internal')))
+        self.assertTrue(is_overload(TimeoutError()))
+        self.assertFalse(is_overload(FakeAPIError(404, 'not found')))
+        self.assertFalse(is_overload(ValueError()))
+
+
+class RateLimiterTests(TestCase):
+
+    def setUp(self):
+        self.limiter = RateLimiter(requests_per_minute=60, tokens_per_minute=6000, query_tokens=1000,
+                                   background_reserve=0.5, max_wait=0, background_max_wait=0, recovery_seconds=60)
+
+    def tokens(self):
+        return dict(RateLimitBucket.objects.values_list('name', 'tokens'))
+
+    def test_take_draws_from_every_bucket(self):
+        self.assertEqual(self.limiter.take({REQUESTS: 1, TOKENS: 1000}, INTERACTIVE), 0)
+
+        tokens = self.tokens()
+        self.assertAlmostEqual(tokens[REQUESTS], 59, places=0)
+        self.assertAlmostEqual(tokens[TOKENS], 5000, places=-1)
+
+    def test_take_returns_the_wait_and_takes_nothing_when_a_bucket_is_short(self):
+        for _ in range(6):
+            self.assertEqual(self.limiter.take({REQUESTS: 1, TOKENS: 1000}, INTERACTIVE), 0)
+
+        # Tokens run out first; about one second of refill (100 tokens/s) short of another 100
+        wait = self.limiter.take({REQUESTS: 1, TOKENS: 100}, INTERACTIVE)
+
+        self.assertGreater(wait, 0.9)
+        self.assertLessEqual(wait, 1.0)
+        self.assertAlmostEqual(self.tokens()[REQUESTS], 54, places=0)
+
+    def test_background_calls_leave_the_reserve_to_interactive_ones(self):
+        for _ in range(30):
+            self.assertEqual(self.limiter.take({REQUESTS: 1}, BACKGROUND), 0)
+
+        self.assertGreater(self.limiter.take({REQUESTS: 1}, BACKGROUND), 0)
+        self.assertEqual(self.limiter.take({REQUESTS: 1}, INTERACTIVE), 0)
+
+    def test_acquire_raises_rate_limited_past_the_max_wait(self):
+        self.limiter.take({REQUESTS: 1, TOKENS: 6000}, INTERACTIVE)
+
+        with self.assertRaises(RateLimited) as raised:
+            self.limiter.acquire(INTERACTIVE)
+        self.assertGreater(raised.exception.retry_after, 0)
+
+    def test_settle_and_refund_correct_the_reservation(self):
+        reserved = self.limiter.acquire(INTERACTIVE)
+        self.assertEqual(reserved, {REQUESTS: 1, TOKENS: 1000})
+
+        self.limiter.settle(reserved, used=1500)
+        self.assertAlmostEqual(self.tokens()[TOKENS], 4500, places=-1)
+
+        self.limiter.refund(self.limiter.acquire(INTERACTIVE))
+        tokens = self.tokens()
+        self.assertAlmostEqual(tokens[TOKENS], 4500, places=-1)
+        self.assertAlmostEqual(tokens[REQUESTS], 59, places=0)
+
+    def test_penalize_halves_the_rate_and_blocks_the_buckets(self):
+        with self.assertLogs('app.filesearch.ratelimit', 'WARNING'):
+            self.limiter.penalize(delay=5)
+
+        wait = self.limiter.take({REQUESTS: 1}, INTERACTIVE)
+        self.assertGreater(wait, 4)
+        self.assertLessEqual(wait, 5)
+        bucket = RateLimitBucket.objects.get(name=REQUESTS)
+        self.assertAlmostEqual(bucket.rate, 0.5, places=2)
+        self.assertLessEqual(bucket.tokens, 0.1)
+
+    def test_quota_retry_delay_reads_retry_info(self):
+        self.assertEqual(quota_retry_delay(FakeAPIError(429, 'quota', retry_delay=7)), 7.0)
+        self.assertIsNone(quota_retry_delay(FakeAPIError(429, 'quota')))
+
+    def test_client_refunds_quota_when_the_circuit_refuses_the_call(self):
+        breaker = CircuitBreaker(window=1, min_calls=1, failure_rate=1, open_seconds=30, half_open_calls=1)
+        breaker.record(True)
+        client = GeminiClientWrapper(FakeBackend(FAKE_BACKEND), Bulkhead(breaker), self.limiter)
+
+        with self.assertRaises(CircuitOpen):
+            client.query_store(['fileSearchStores/notes'], 'what is a heap')
+
+        tokens = self.tokens()
+        self.assertAlmostEqual(tokens[REQUESTS], 60, places=0)
+        self.assertAlmostEqual(tokens[TOKENS], 6000, places=-1)
+
+    def test_client_slows_down_on_quota_errors(self):
+        client = GeminiClientWrapper(FakeBackend({**FAKE_BACKEND, 'error_rates': {429: 1.0}, 'quota_retry_delay': 3}),
+                                     Bulkhead(), self.limiter)
+
+        with self.assertLogs('app.filesearch.ratelimit', 'WARNING'), self.assertRaises(RateLimited) as raised:
+            client.query_store(['fileSearchStores/notes'], 'what is a heap')
+
+        self.assertEqual(raised.exception.retry_after, 3)
+        self.assertGreater(self.limiter.take({REQUESTS: 1}, INTERACTIVE), 2)
@@ -0,0 +1,197 @@
+import fcntl
+import hashlib
+import os
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.db import transaction
+from django.utils import timezone
+
+from app.filesearch.jobs import enqueue_ingestion
+from app.filesearch.models import FileSearchStore, UploadSession
+from app.filesearch.processing import find_reusable_document, reuse_fields
+
+PARTIAL_UPLOAD_DIR = 'uploads/filesearch/partial/'
+
+
+class UploadOffsetMismatch(Exception):
+    """The client sent a chunk for a different offset than the server holds."""
+
+
+class UploadTooLarge(Exception):
+    """The chunk would grow the file beyond the declared upload length."""
+
+
+class UploadBusy(Exception):
+    """Another request is still writing to this upload session."""
+
+
+class UploadClosed(Exception):
+    """The session was finalized or discarded while the chunk was being sent."""
+
+
+class UploadIncomplete(Exception):
+    """Finalize was called before all bytes were received."""
+
+
+def create_session(user, filename, upload_length, title=None):
+    """Create an upload session and its empty partial file."""
+
+    session = UploadSession(
+        user=user,
+        title=title or filename,
+        filename=os.path.basename(filename),
+        upload_length=upload_length,
+        expires=timezone.now() + timedelta(seconds=settings.RESUMABLE_UPLOAD_EXPIRY),
+    )
+    session.partial_file = f"{PARTIAL_UPLOAD_DIR}{session.id}.part"
+
+    path = default_storage.path(session.partial_file)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    open(path, 'wb').close()
+
+    session.save()
+    return session
+
+
+def append_chunk(session, stream, offset, length):
+    """
+    Append `length` bytes read from `stream` at `offset`.
+
+    The body is copied in RESUMABLE_UPLOAD_READ_SIZE pieces straight into the partial file,
+    so memory use does not depend on the chunk size. Bytes received before a dropped
+    connection are kept and reflected in the returned offset.
+
+    Writers of the same session are serialised by an exclusive lock on the partial file, not
+    by a database transaction: a slow client must not hold a connection and a row lock for
+    the whole body. The offset only moves under the file lock, so it is re-read once held,
+    along with whether the session was closed in the meantime.
+    """
+
+    try:
+        partial = open(default_storage.path(session.partial_file), 'r+b')
+    except FileNotFoundError:
+        # Moved into place by finalize_session (or removed by discard_session) since the session was read
+        raise UploadClosed()
+
+    with partial:
+        try:
+            fcntl.flock(partial, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            raise UploadBusy()
+
+        session.refresh_from_db(fields=['offset', 'is_active'])
+        if not session.is_active:
+            raise UploadClosed()
+        if offset != session.offset:
+            raise UploadOffsetMismatch()
+        if offset + length > session.upload_length:
+            raise UploadTooLarge()
+
+        written = 0
+        try:
+            # Drop any tail written by a request that died before saving its offset
+            partial.seek(offset)
+            partial.truncate()
+
+            while written < length:
+                data = stream.read(min(settings.RESUMABLE_UPLOAD_READ_SIZE, length - written))
+                if not data:
+                    break
+                partial.write(data)
+                written += len(data)
+        finally:
+            partial.flush()
+            session.offset = offset + written
+            session.updated = timezone.now()
+            UploadSession.objects.filter(id=session.id).update(offset=session.offset, updated=session.updated)
+
+    return session.offset
+
+
+def finalize_session(session):
+    """
+    Turn a complete upload into a FileSearchStore and start ingestion.
+
+    The partial file is hashed in chunks and moved into place without copying. An identical,
+    already ingested PDF is reused exactly like in DocumentUploadView.
+    """
+
+    if session.offset != session.upload_length:
+        raise UploadIncomplete()
+
+    partial_path = default_storage.path(session.partial_file)
+    content_hash = _hash_file(partial_path)
+
+    with transaction.atomic():
+        source = find_reusable_document(content_hash, session.user, lock=True)
+        if source is not None:
+            document = FileSearchStore.objects.create(
+                user=session.user,
+                title=session.title,
+                file=source.file.name,
+                content_hash=content_hash,
+                **reuse_fields(source)
+            )
+        else:
+            file_name = _move_into_place(partial_path, session.filename)
+            document = FileSearchStore.objects.create(
+                user=session.user,
+                title=session.title,
+                file=file_name,
+                content_hash=content_hash,
+                status=FileSearchStore.StoreStatus.CREATED,
+            )
+            enqueue_ingestion(document)
+
+        session.document = document
+        session.is_active = False
+        session.save()
+
+    if source is not None:
+        _remove_partial(session)
+
+    return document
+
+
+def discard_session(session):
+    session.is_active = False
+    session.save()
+    _remove_partial(session)
+
+
+def purge_expired_sessions():
+    """Delete partial files of abandoned sessions. Returns the number of sessions purged."""
+
+    sessions = UploadSession.objects.filter(is_active=True, expires__lt=timezone.now())
+    count = 0
+    for session in sessions.iterator():
+        discard_session(session)
+        count += 1
+    return count
+
+
+def _hash_file(path):
+    sha256 = hashlib.sha256()
+    with open(path, 'rb') as partial:
+        for data in iter(lambda: partial.read(settings.RESUMABLE_UPLOAD_READ_SIZE), b''):
+            sha256.update(data)
+    return sha256.hexdigest()
+
+
+def _move_into_place(partial_path, filename):
+    field = FileSearchStore._meta.get_field('file')
+    file_name = default_storage.get_available_name(field.generate_filename(None, filename))
+
+    final_path = default_storage.path(file_name)
+    os.makedirs(os.path.dirname(final_path), exist_ok=True)
+    os.replace(partial_path, final_path)
+    return file_name
+
+
+def _remove_partial(session):
+    try:
+        os.remove(default_storage.path(session.partial_file))
+    except FileNotFoundError:
+        pass
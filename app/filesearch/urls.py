@@ -1,15 +1,23 @@
 from django.urls import path
 
 from app.filesearch.views import TestAPIView, CreateFileSearchStoreView, DocumentUploadView, QueryDocumentView, \
-    FileSearchStoreListView, FileSearchStoreDetailView
+    FileSearchStoreListView, FileSearchStoreDetailView, UploadSessionCreateView, UploadSessionDetailView, \
+    UploadSessionFinalizeView, GeminiHealthView, AnswerCacheStatsView, QueryStreamView, BatchQueryView
 
 urlpatterns = [
     # Document ingestion endpoints
     path('test/', TestAPIView.as_view(), name='document-upload'),
     path('stores/', CreateFileSearchStoreView.as_view(), name='filesearch-create-store'),
     path('upload/', DocumentUploadView.as_view(), name='filesearch-upload'),
+    path('uploads/', UploadSessionCreateView.as_view(), name='filesearch-upload-session-create'),
+    path('uploads/<uuid:pk>/', UploadSessionDetailView.as_view(), name='filesearch-upload-session'),
+    path('uploads/<uuid:pk>/finalize/', UploadSessionFinalizeView.as_view(), name='filesearch-upload-session-finalize'),
     path('query/', QueryDocumentView.as_view(), name='filesearch-query'),
+    path('query/stream/', QueryStreamView.as_view(), name='filesearch-query-stream'),
+    path('query/batch/', BatchQueryView.as_view(), name='filesearch-query-batch'),
     path('stores/list-filter/', FileSearchStoreListView.as_view(), name='filesearch-list'),
     path('stores/<int:pk>/', FileSearchStoreDetailView.as_view(), name='filesearch-detail'),
+    path('health/', GeminiHealthView.as_view(), name='filesearch-health'),
+    path('cache/stats/', AnswerCacheStatsView.as_view(), name='filesearch-cache-stats'),
 ]
 
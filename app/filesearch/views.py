@@ -1,20 +1,38 @@
+import json
+import re
+
+from asgiref.sync import sync_to_async
 from django.conf import settings
+from django.db import transaction
+from django.http import StreamingHttpResponse
+from django.urls import reverse
+from django.utils import timezone
 from drf_yasg import openapi
 from drf_yasg.utils import swagger_auto_schema
 from rest_framework import status
-from rest_framework.generics import GenericAPIView, get_object_or_404, ListAPIView, RetrieveAPIView
+from rest_framework.generics import GenericAPIView, get_object_or_404, RetrieveAPIView
 from rest_framework.parsers import MultiPartParser, FormParser
-from rest_framework.permissions import IsAuthenticated
+from rest_framework.permissions import IsAuthenticated, AllowAny
 
+from app.core.metrics import QUERY_STAGE_METRIC, timed
 from app.global_constants import SuccessMessage, ErrorMessage
 from app.utils import get_response_schema
-from permissions import IsUser
-from .gemini_client import GeminiClientWrapper
-from .models import FileSearchStore
-from .processing import process_file_search_store
+from permissions import IsUser, IsSuperAdmin
+from .cache import get_answer_cache
+from .models import FileSearchStore, UploadSession
+from .semantic_cache import get_semantic_cache
+from .singleflight import get_single_flight, SingleFlightTimeout
+from .gemini_client import health_check, get_client
+from .jobs import enqueue_ingestion
+from .resilience import GeminiUnavailable, retry_after_header
+from .processing import compute_file_hash, find_reusable_document, release_document, reuse_fields
+from .querying import resolve_query_target, aquery_document, aquery_library, astream_query, abatch_query, \
+    document_metadata_filter, resolve_query_documents, aquery_documents, documents_query_target, attribute_sources
 from .serializers import FileSearchStoreSerializer, FileUploadSerializer, QuerySerializer, FileStoreCreateSerializer, \
-    FileSearchStoreListDisplaySerializer
-from ..core.views import CustomPageNumberPagination
+    FileSearchStoreListDisplaySerializer, BatchQuerySerializer, UploadSessionCreateSerializer, UploadSessionSerializer
+from .uploads import create_session, append_chunk, finalize_session, discard_session, UploadOffsetMismatch, \
+    UploadTooLarge, UploadIncomplete, UploadBusy, UploadClosed
+from ..core.views import CustomPageNumberPagination, AsyncAPIView
 
 
 class TestAPIView(GenericAPIView):
@@ -28,6 +46,42 @@ import logging
 logger = logging.getLogger(__name__)
 
 
+class GeminiHealthView(GenericAPIView):
+    """Health of the pooled Gemini client. GET /api/filesearch/health/"""
+    authentication_classes = []
+    permission_classes = [AllowAny]
+
+    @swagger_auto_schema(responses={200: 'Gemini reachable', 503: 'Gemini unreachable'})
+    def get(self, request):
+        result = health_check()
+        if result['healthy']:
+            return get_response_schema(result, SuccessMessage.SERVICE_HEALTHY.value, status.HTTP_200_OK)
+        # Don't leak upstream error details to anonymous callers
+        result['error'] = None
+        return get_response_schema(result, ErrorMessage.SERVICE_UNAVAILABLE.value,
+                                   status.HTTP_503_SERVICE_UNAVAILABLE)
+
+
+class AnswerCacheStatsView(GenericAPIView):
+    """
+    Answer cache, semantic cache, single-flight and Gemini bulkhead counters of this process, and the
+    shared Gemini quota buckets. GET /api/filesearch/cache/stats/
+    """
+    permission_classes = [IsSuperAdmin]
+
+    @swagger_auto_schema(responses={200: 'Answer cache counters'})
+    def get(self, request):
+        semantic_cache = get_semantic_cache()
+        return_data = {
+            'answers': get_answer_cache().snapshot(),
+            'semantic': semantic_cache.snapshot() if semantic_cache is not None else None,
+            'single_flight': get_single_flight().snapshot(),
+            'gemini': get_client().bulkhead.snapshot(),
+            'gemini_quota': get_client().rate_limiter.snapshot() if get_client().rate_limiter is not None else None,
+        }
+        return get_response_schema(return_data, SuccessMessage.RECORD_RETRIEVED.value, status.HTTP_200_OK)
+
+
 class CreateFileSearchStoreView(GenericAPIView):
     """Create an (empty) FileSearchStore record. POST /api/filesearch/stores/"""
     permission_classes = [IsUser]
@@ -53,23 +107,31 @@ class CreateFileSearchStoreView(GenericAPIView):
         return get_response_schema(serializer.data, SuccessMessage.RECORD_CREATED.value, status.HTTP_201_CREATED)
 
 
-class DocumentUploadView(GenericAPIView):
-    """Upload PDF and start ingestion (synchronous). POST /api/filesearch/upload/"""
+class DocumentUploadView(AsyncAPIView):
+    """Upload PDF and queue it for ingestion. POST /api/filesearch/upload/"""
     permission_classes = [IsUser]
     parser_classes = [MultiPartParser, FormParser]
     serializer_class = FileUploadSerializer
 
     @swagger_auto_schema(
-        operation_description='Upload a PDF file for ingestion. The file will be processed synchronously.',
+        operation_description='Upload a PDF file for ingestion. The file is processed in the background; '
+                              'poll the document detail endpoint for its status.',
         manual_parameters=[
             openapi.Parameter(name='file', in_=openapi.IN_FORM, type=openapi.TYPE_FILE, required=True,
                               description='PDF file to upload'),
             openapi.Parameter(name='title', in_=openapi.IN_FORM, type=openapi.TYPE_STRING, required=False,
                               description='Title for the document (defaults to filename)'),
         ],
-        responses={201: openapi.Response('Document created successfully', FileSearchStoreSerializer)}
+        responses={
+            201: openapi.Response('Identical document already ingested; created READY', FileSearchStoreSerializer),
+            202: openapi.Response('Document queued for processing', FileSearchStoreSerializer),
+        }
     )
-    def post(self, request):
+    async def post(self, request):
+        # Multipart parsing, hashing and file storage are blocking disk work: run them off the event loop
+        return await sync_to_async(self.create_document)(request)
+
+    def create_document(self, request):
         try:
             if 'file' not in request.FILES:
                 return_data = {
@@ -86,31 +148,34 @@ class DocumentUploadView(GenericAPIView):
 
             title = request.data.get('title') or uploaded_file.name
 
-            # Create DB record with UPLOADING status (do NOT mark READY here)
+            # Create DB record with CREATED status; the ingestion worker moves it through
+            # UPLOADING/PROCESSING/READY/FAILED.
 
             request.data['user'] = request.user.id
-            request.data['status'] = FileSearchStore.StoreStatus.UPLOADING
+            request.data['status'] = FileSearchStore.StoreStatus.CREATED
+            # Digest computed by the hashing upload handlers while the file was written
+            request.data['content_hash'] = getattr(uploaded_file, 'content_hash', None) or compute_file_hash(
+                uploaded_file)
 
             serializer = FileStoreCreateSerializer(data=request.data)
-            if serializer.is_valid():
-                document = serializer.save()
-            else:
+            if not serializer.is_valid():
                 return get_response_schema(serializer.errors, ErrorMessage.BAD_REQUEST.value,
                                            status.HTTP_400_BAD_REQUEST)
 
-            # Synchronous processing: create Gemini store and upload file.
-            # This will update document.status -> PROCESSING/READY/FAILED and set store_name or error_message.
-            try:
-                process_file_search_store(str(document.id))
-            except Exception as proc_exc:
-                logger.exception("Processing failed for document %s", document.id)
-                # process_file_search_store already updates DB on failure; return the document state
-                serializer = FileSearchStoreSerializer(document)
-                return get_response_schema(serializer.data, ErrorMessage.SOMETHING_WENT_WRONG.value,
-                                           status.HTTP_500_INTERNAL_SERVER_ERROR)
+            with transaction.atomic():
+                source = find_reusable_document(serializer.validated_data['content_hash'], request.user, lock=True)
+                if source is not None:
+                    # Identical PDF already ingested: reuse its file and remote store, skip ingestion
+                    document = serializer.save(file=source.file.name, **reuse_fields(source))
+                else:
+                    document = serializer.save()
+                    enqueue_ingestion(document)
 
             serializer = FileSearchStoreSerializer(document)
-            return get_response_schema(serializer.data, SuccessMessage.RECORD_CREATED.value, status.HTTP_201_CREATED)
+            if source is not None:
+                return get_response_schema(serializer.data, SuccessMessage.RECORD_CREATED.value,
+                                           status.HTTP_201_CREATED)
+            return get_response_schema(serializer.data, SuccessMessage.DOCUMENT_QUEUED.value, status.HTTP_202_ACCEPTED)
 
         except Exception as e:
             logger.exception('Error uploading document')
@@ -120,10 +185,186 @@ class DocumentUploadView(GenericAPIView):
             return get_response_schema(return_data, ErrorMessage.BAD_REQUEST.value, status.HTTP_400_BAD_REQUEST)
 
 
-class QueryDocumentView(GenericAPIView):
+CONTENT_RANGE_RE = re.compile(r'^bytes (\d+)-(\d+)/(\d+|\*)$')
+
+
+def upload_session_response(session, message, status_code):
+    response = get_response_schema(UploadSessionSerializer(session).data, message, status_code)
+    response['Upload-Offset'] = str(session.offset)
+    response['Upload-Length'] = str(session.upload_length)
+    return response
+
+
+class UploadSessionCreateView(GenericAPIView):
+    """Start a resumable upload. POST /api/filesearch/uploads/"""
+    permission_classes = [IsUser]
+    serializer_class = UploadSessionCreateSerializer
+
+    @swagger_auto_schema(
+        operation_description='Create a resumable upload session. Send the bytes with PUT/PATCH on the returned '
+                              'Location and finalize the session to start ingestion.',
+        request_body=UploadSessionCreateSerializer,
+        responses={201: UploadSessionSerializer}
+    )
+    def post(self, request):
+        serializer = self.get_serializer(data=request.data)
+        if not serializer.is_valid():
+            return get_response_schema(serializer.errors, ErrorMessage.BAD_REQUEST.value, status.HTTP_400_BAD_REQUEST)
+
+        session = create_session(
+            request.user,
+            serializer.validated_data['filename'],
+            serializer.validated_data['size'],
+            title=serializer.validated_data.get('title'),
+        )
+
+        response = upload_session_response(session, SuccessMessage.RECORD_CREATED.value, status.HTTP_201_CREATED)
+        response['Location'] = reverse('filesearch-upload-session', args=[session.id])
+        return response
+
+
+class UploadSessionDetailView(GenericAPIView):
+    """
+    GET/HEAD   /api/filesearch/uploads/<id>/ - current offset
+    PUT/PATCH  /api/filesearch/uploads/<id>/ - append a byte range (Upload-Offset or Content-Range header)
+    DELETE     /api/filesearch/uploads/<id>/ - abort the upload
+    """
+    permission_classes = [IsUser]
+    serializer_class = UploadSessionSerializer
+
+    def get_queryset(self):
+        return UploadSession.objects.filter(user_id=self.request.user.id, is_active=True, expires__gt=timezone.now())
+
+    def get_object(self, pk, lock=False):
+        queryset = self.get_queryset()
+        if lock:
+            queryset = queryset.select_for_update()
+        return queryset.filter(pk=pk).first()
+
+    def get(self, request, pk):
+        session = self.get_object(pk)
+        if not session:
+            return get_response_schema({}, ErrorMessage.NOT_FOUND.value, status.HTTP_404_NOT_FOUND)
+        return upload_session_response(session, SuccessMessage.RECORD_RETRIEVED.value, status.HTTP_200_OK)
+
+    def head(self, request, pk):
+        return self.get(request, pk)
+
+    @staticmethod
+    def requested_offset(request):
+        if request.headers.get('Upload-Offset') is not None:
+            return int(request.headers['Upload-Offset'])
+
+        match = CONTENT_RANGE_RE.match(request.headers.get('Content-Range', ''))
+        if match:
+            return int(match.group(1))
+        return None
+
+    @swagger_auto_schema(
+        operation_description='Append raw bytes (application/offset+octet-stream) at the given offset.',
+        manual_parameters=[
+            openapi.Parameter('Upload-Offset', openapi.IN_HEADER, type=openapi.TYPE_INTEGER,
+                              description='Offset of the first byte in the body (or send Content-Range)'),
+        ],
+        responses={200: UploadSessionSerializer,
+                   409: 'Offset mismatch or another chunk still being written; resume from Upload-Offset'}
+    )
+    def put(self, request, pk):
+        try:
+            offset = self.requested_offset(request)
+            length = int(request.META.get('CONTENT_LENGTH') or 0)
+        except ValueError:
+            offset = None
+
+        if offset is None:
+            return_data = {
+                settings.REST_FRAMEWORK['NON_FIELD_ERRORS_KEY']: [ErrorMessage.UPLOAD_OFFSET_REQUIRED.value]
+            }
+            return get_response_schema(return_data, ErrorMessage.BAD_REQUEST.value, status.HTTP_400_BAD_REQUEST)
+
+        session = self.get_object(pk)
+        if not session:
+            return get_response_schema({}, ErrorMessage.NOT_FOUND.value, status.HTTP_404_NOT_FOUND)
+
+        try:
+            if length:
+                append_chunk(session, request.stream, offset, length)
+            elif offset != session.offset:
+                raise UploadOffsetMismatch()
+        except UploadOffsetMismatch:
+            return upload_session_response(session, ErrorMessage.UPLOAD_OFFSET_MISMATCH.value,
+                                           status.HTTP_409_CONFLICT)
+        except UploadBusy:
+            return upload_session_response(session, ErrorMessage.UPLOAD_IN_PROGRESS.value,
+                                           status.HTTP_409_CONFLICT)
+        except UploadTooLarge:
+            return upload_session_response(session, ErrorMessage.UPLOAD_TOO_LARGE.value,
+                                           status.HTTP_413_REQUEST_ENTITY_TOO_LARGE)
+        except UploadClosed:
+            # Finalized or aborted by another request: gone, like for a request arriving after it
+            return get_response_schema({}, ErrorMessage.NOT_FOUND.value, status.HTTP_404_NOT_FOUND)
+
+        return upload_session_response(session, SuccessMessage.RECORD_UPDATED.value, status.HTTP_200_OK)
+
+    def patch(self, request, pk):
+        return self.put(request, pk)
+
+    def delete(self, request, pk):
+        session = self.get_object(pk)
+        if not session:
+            return get_response_schema({}, ErrorMessage.NOT_FOUND.value, status.HTTP_404_NOT_FOUND)
+
+        discard_session(session)
+        return get_response_schema({}, SuccessMessage.RECORD_DELETED.value, status.HTTP_204_NO_CONTENT)
+
+
+class UploadSessionFinalizeView(UploadSessionDetailView):
+    """Finish a resumable upload and start ingestion. POST /api/filesearch/uploads/<id>/finalize/"""
+    http_method_names = ['post', 'options']
+
+    @swagger_auto_schema(
+        operation_description='Finalize a complete upload. The document is queued for ingestion, or returned READY '
+                              'if an identical PDF was already ingested.',
+        responses={201: FileSearchStoreSerializer, 202: FileSearchStoreSerializer, 409: 'Upload not complete'}
+    )
+    def post(self, request, pk):
+        with transaction.atomic():
+            session = self.get_object(pk, lock=True)
+            if not session:
+                return get_response_schema({}, ErrorMessage.NOT_FOUND.value, status.HTTP_404_NOT_FOUND)
+
+            try:
+                document = finalize_session(session)
+            except UploadIncomplete:
+                return upload_session_response(session, ErrorMessage.UPLOAD_INCOMPLETE.value,
+                                               status.HTTP_409_CONFLICT)
+
+        serializer = FileSearchStoreSerializer(document)
+        if document.status == FileSearchStore.StoreStatus.READY:
+            return get_response_schema(serializer.data, SuccessMessage.RECORD_CREATED.value, status.HTTP_201_CREATED)
+        return get_response_schema(serializer.data, SuccessMessage.DOCUMENT_QUEUED.value, status.HTTP_202_ACCEPTED)
+
+
+def unavailable_response(exc):
+    """503 for a Gemini call refused by the bulkhead (circuit open or too many calls in flight)."""
+
+    response = get_response_schema(
+        {
+            settings.REST_FRAMEWORK['NON_FIELD_ERRORS_KEY']: [
+                ErrorMessage.SERVICE_UNAVAILABLE.value
+            ]
+        },
+        ErrorMessage.SERVICE_UNAVAILABLE.value,
+        status.HTTP_503_SERVICE_UNAVAILABLE)
+    response['Retry-After'] = retry_after_header(exc)
+    return response
+
+
+class QueryDocumentView(AsyncAPIView):
     """POST /api/filesearch/query/ - Query a specific document (by id) or latest user store if not provided"""
     permission_classes = [IsUser]
     serializer_class = QuerySerializer
+    timing_metric = QUERY_STAGE_METRIC
 
     @swagger_auto_schema(
         operation_description='Query the uploaded document(s) via Gemini file search',
@@ -131,36 +372,43 @@ class QueryDocumentView(GenericAPIView):
             type=openapi.TYPE_OBJECT,
             properties={
                 'query': openapi.Schema(type=openapi.TYPE_STRING, description='Query to run'),
-                'document_id': openapi.Schema(type=openapi.TYPE_INTEGER, description='Document ID to query (optional)'),
+                'document_id': openapi.Schema(type=openapi.TYPE_INTEGER,
+                                              description='Document ID to query (optional; omit to search the '
+                                                          'whole library)'),
+                'document_ids': openapi.Schema(type=openapi.TYPE_ARRAY, items=openapi.Schema(type=openapi.TYPE_INTEGER),
+                                               description='Query several documents at once (optional)'),
+                'all_documents': openapi.Schema(type=openapi.TYPE_BOOLEAN,
+                                                description='Query every READY document (optional)'),
+                'refresh': openapi.Schema(type=openapi.TYPE_BOOLEAN,
+                                          description='Skip cached answers and ask again (optional)'),
             }
         ),
         responses={200: 'Query result (text and grounding metadata)'}
     )
-    def post(self, request):
+    async def post(self, request):
         serializer = self.get_serializer(data=request.data)
         serializer.is_valid(raise_exception=True)
         query = serializer.validated_data['query']
         document_id = serializer.validated_data.get('document_id')
+        document_ids = serializer.validated_data.get('document_ids')
+        refresh = serializer.validated_data['refresh']
 
-        document = (
-            FileSearchStore.objects
-            .filter(
-                user=request.user,
-                id=document_id,
-                status=FileSearchStore.StoreStatus.READY,
-                is_active=True
-            )
-            .first()
-        )
+        if document_ids is not None or serializer.validated_data['all_documents']:
+            return await self.post_documents(request, query, document_ids, refresh)
+
+        # No document given: search the whole library in the user's shared stores,
+        # otherwise fall back to the latest ready document
+        with timed(QUERY_STAGE_METRIC, 'lookup'):
+            document, library_stores = await sync_to_async(resolve_query_target)(request.user, document_id)
 
-        if not document:
+        if not document and not library_stores:
             return get_response_schema(
                 {},
                 ErrorMessage.NOT_FOUND.value,
                 status.HTTP_404_NOT_FOUND
             )
 
-        if not document.store_name:
+        if document and not document.store_name:
             return get_response_schema(
                 {
                     settings.REST_FRAMEWORK['NON_FIELD_ERRORS_KEY']: [
@@ -171,52 +419,70 @@ class QueryDocumentView(GenericAPIView):
                 status.HTTP_400_BAD_REQUEST)
 
         try:
-            client = GeminiClientWrapper()
+            if document:
+                result = await aquery_document(document, query, refresh=refresh)
+            else:
+                result = await aquery_library(library_stores, query, refresh=refresh)
 
-            # Add system instruction: forbid hallucination
-            system_prompt = (
-                "You must answer ONLY using the provided document chunks. "
-                "If the answer is not explicitly present in the document, reply exactly with: "
-                "'I don't know. The answer is not present in the document.'"
-            )
+            return_data = {
+                "query": query,
+                "response_text": result["response_text"],
+                "grounding_chunks": result["grounding_chunks"],
+                "document_id": str(document.id) if document else None,
+                "cache": result["cache"],
+            }
 
-            response = client.query_store(
-                document.store_name,
-                f"{system_prompt}\n\nUser question: {query}"
+            return get_response_schema(
+                return_data,
+                SuccessMessage.RECORD_RETRIEVED.value,
+                status.HTTP_200_OK
             )
 
-            # --- Extract text output ---
-            text_output = None
-            if hasattr(response, "text") and response.text:
-                text_output = response.text
-            else:
-                # fallback to candidates
-                try:
-                    text_output = response.candidates[0].content[0].text
-                except Exception:
-                    text_output = ""
-
-            # --- Extract grounding chunks (actual retrieved text, not titles) ---
-            grounding_chunks = []
-            try:
-                grounding = response.candidates[0].grounding_metadata
-                if grounding and grounding.grounding_chunks:
-                    grounding_chunks = [
-                        c.retrieved_context.text for c in grounding.grounding_chunks
-                        if hasattr(c, "retrieved_context") and c.retrieved_context.text
+        except SingleFlightTimeout:
+            return get_response_schema(
+                {
+                    settings.REST_FRAMEWORK['NON_FIELD_ERRORS_KEY']: [
+                        ErrorMessage.QUERY_TIMEOUT.value
                     ]
-            except Exception:
-                grounding_chunks = []
+                },
+                ErrorMessage.QUERY_TIMEOUT.value,
+                status.HTTP_504_GATEWAY_TIMEOUT)
+
+        except GeminiUnavailable as e:
+            return unavailable_response(e)
+
+        except Exception as e:
+            logger.exception('Error querying document')
+            return_data = {
+                settings.REST_FRAMEWORK['NON_FIELD_ERRORS_KEY']: [str(e)]
+            }
+
+            return get_response_schema(return_data, ErrorMessage.BAD_REQUEST.value, status.HTTP_400_BAD_REQUEST)
+
+
+    async def post_documents(self, request, query, document_ids, refresh):
+        """Several documents (or all READY ones) in one call, each grounding chunk attributed to its document."""
+
+        with timed(QUERY_STAGE_METRIC, 'lookup'):
+            documents = await sync_to_async(resolve_query_documents)(request.user, document_ids)
+        if not documents:
+            return get_response_schema(
+                {},
+                ErrorMessage.NOT_FOUND.value,
+                status.HTTP_404_NOT_FOUND
+            )
 
-            # --- Enforce “no hallucination” rule ---
-            if not grounding_chunks:
-                text_output = "I don't know. The answer is not present in the document."
+        try:
+            result = await aquery_documents(documents, query, refresh=refresh)
 
             return_data = {
                 "query": query,
-                "response_text": text_output,
-                "grounding_chunks": grounding_chunks,
-                "document_id": str(document.id),
+                "response_text": result["response_text"],
+                "grounding_chunks": result["grounding_chunks"],
+                "sources": result["sources"],
+                "document_id": None,
+                "document_ids": [str(document.id) for document in documents],
+                "cache": result["cache"],
             }
 
             return get_response_schema(
@@ -225,8 +491,21 @@ class QueryDocumentView(GenericAPIView):
                 status.HTTP_200_OK
             )
 
+        except SingleFlightTimeout:
+            return get_response_schema(
+                {
+                    settings.REST_FRAMEWORK['NON_FIELD_ERRORS_KEY']: [
+                        ErrorMessage.QUERY_TIMEOUT.value
+                    ]
+                },
+                ErrorMessage.QUERY_TIMEOUT.value,
+                status.HTTP_504_GATEWAY_TIMEOUT)
+
+        except GeminiUnavailable as e:
+            return unavailable_response(e)
+
         except Exception as e:
-            logger.exception('Error querying document')
+            logger.exception('Error querying documents')
             return_data = {
                 settings.REST_FRAMEWORK['NON_FIELD_ERRORS_KEY']: [str(e)]
             }
@@ -234,7 +513,223 @@ class QueryDocumentView(GenericAPIView):
             return get_response_schema(return_data, ErrorMessage.BAD_REQUEST.value, status.HTTP_400_BAD_REQUEST)
 
 
-class FileSearchStoreListView(ListAPIView):
+class BatchQueryView(AsyncAPIView):
+    """
+    POST /api/filesearch/query/batch/ - Many questions against one document (or the library) in one request.
+    Questions run concurrently (BATCH_QUERY_CONCURRENCY at a time); results come back in input order,
+    each with its own `error`, as one JSON envelope or, with `ndjson`, one JSON line per question.
+    """
+    permission_classes = [IsUser]
+    serializer_class = BatchQuerySerializer
+    timing_metric = QUERY_STAGE_METRIC
+
+    @swagger_auto_schema(
+        operation_description='Run a list of queries against one document (or the whole library)',
+        request_body=BatchQuerySerializer,
+        responses={
+            200: 'All queries answered',
+            207: 'Some queries failed (see each result\'s `error`)',
+        }
+    )
+    async def post(self, request):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        queries = serializer.validated_data['queries']
+        document_id = serializer.validated_data.get('document_id')
+        refresh = serializer.validated_data['refresh']
+
+        # Authentication and the document lookup happen once for the whole batch
+        with timed(QUERY_STAGE_METRIC, 'lookup'):
+            document, library_stores = await sync_to_async(resolve_query_target)(request.user, document_id)
+
+        if not document and not library_stores:
+            return get_response_schema(
+                {},
+                ErrorMessage.NOT_FOUND.value,
+                status.HTTP_404_NOT_FOUND
+            )
+
+        if document and not document.store_name:
+            return get_response_schema(
+                {
+                    settings.REST_FRAMEWORK['NON_FIELD_ERRORS_KEY']: [
+                        ErrorMessage.DOCUMENT_NO_STORE.value
+                    ]
+                },
+                ErrorMessage.BAD_REQUEST.value,
+                status.HTTP_400_BAD_REQUEST)
+
+        if document:
+            store_names, metadata_filter = [document.store_name], document_metadata_filter(document)
+        else:
+            store_names, metadata_filter = library_stores, None
+        document_id = str(document.id) if document else None
+
+        results = (
+            self.batch_result(index, queries[index], result, error)
+            async for index, result, error in abatch_query(store_names, queries, metadata_filter, refresh)
+        )
+
+        if serializer.validated_data['ndjson']:
+            async def lines():
+                async for item in results:
+                    yield json.dumps(item) + "\n"
+
+            response = StreamingHttpResponse(lines(), content_type='application/x-ndjson')
+            response['X-Accel-Buffering'] = 'no'
+            return response
+
+        items = [item async for item in results]
+        failed = sum(1 for item in items if item["error"])
+        return_data = {
+            "document_id": document_id,
+            "results": items,
+            "succeeded": len(items) - failed,
+            "failed": failed,
+        }
+
+        if failed:
+            return get_response_schema(return_data, SuccessMessage.BATCH_PARTIALLY_RETRIEVED.value,
+                                       status.HTTP_207_MULTI_STATUS)
+        return get_response_schema(return_data, SuccessMessage.RECORD_RETRIEVED.value, status.HTTP_200_OK)
+
+    def batch_result(self, index, query, result, error):
+        if error is None:
+            return {
+                "index": index,
+                "query": query,
+                "response_text": result["response_text"],
+                "grounding_chunks": result["grounding_chunks"],
+                "cache": result["cache"],
+                "error": None,
+            }
+
+        if isinstance(error, SingleFlightTimeout):
+            message = ErrorMessage.QUERY_TIMEOUT.value
+        elif isinstance(error, GeminiUnavailable):
+            message = ErrorMessage.SERVICE_UNAVAILABLE.value
+        else:
+            logger.error('Error querying document (batch item %s)', index, exc_info=error)
+            message = str(error)
+        return {
+            "index": index,
+            "query": query,
+            "response_text": None,
+            "grounding_chunks": [],
+            "cache": None,
+            "error": message,
+        }
+
+
+def sse_event(event, data):
+    """One Server-Sent Event frame."""
+
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+class QueryStreamView(AsyncAPIView):
+    """
+    POST /api/filesearch/query/stream/ - Same request as /query/, answered as Server-Sent Events:
+    `delta` events with text as it is generated, then one `done` event with the full response
+    (its `response_text` is authoritative) or an `error` event.
+    """
+    permission_classes = [IsUser]
+    serializer_class = QuerySerializer
+    timing_metric = QUERY_STAGE_METRIC
+
+    @swagger_auto_schema(
+        operation_description='Query the uploaded document(s), streaming the answer as text/event-stream',
+        request_body=QuerySerializer,
+        responses={200: 'text/event-stream of delta / done / error events'}
+    )
+    async def post(self, request):
+        serializer = self.serializer_class(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        query = serializer.validated_data['query']
+        document_id = serializer.validated_data.get('document_id')
+        document_ids = serializer.validated_data.get('document_ids')
+        refresh = serializer.validated_data['refresh']
+
+        if document_ids is not None or serializer.validated_data['all_documents']:
+            return await self.post_documents(request, query, document_ids, refresh)
+
+        with timed(QUERY_STAGE_METRIC, 'lookup'):
+            document, library_stores = await sync_to_async(resolve_query_target)(request.user, document_id)
+
+        if not document and not library_stores:
+            return get_response_schema(
+                {},
+                ErrorMessage.NOT_FOUND.value,
+                status.HTTP_404_NOT_FOUND
+            )
+
+        if document and not document.store_name:
+            return get_response_schema(
+                {
+                    settings.REST_FRAMEWORK['NON_FIELD_ERRORS_KEY']: [
+                        ErrorMessage.DOCUMENT_NO_STORE.value
+                    ]
+                },
+                ErrorMessage.BAD_REQUEST.value,
+                status.HTTP_400_BAD_REQUEST)
+
+        if document:
+            store_names, metadata_filter = [document.store_name], document_metadata_filter(document)
+        else:
+            store_names, metadata_filter = library_stores, None
+
+        return self.stream(query, store_names, metadata_filter, refresh,
+                           {"document_id": str(document.id) if document else None})
+
+    async def post_documents(self, request, query, document_ids, refresh):
+        with timed(QUERY_STAGE_METRIC, 'lookup'):
+            documents = await sync_to_async(resolve_query_documents)(request.user, document_ids)
+        if not documents:
+            return get_response_schema(
+                {},
+                ErrorMessage.NOT_FOUND.value,
+                status.HTTP_404_NOT_FOUND
+            )
+
+        store_names, metadata_filter = documents_query_target(documents)
+        target = {"document_id": None, "document_ids": [str(document.id) for document in documents]}
+        return self.stream(query, store_names, metadata_filter, refresh, target, documents)
+
+    def stream(self, query, store_names, metadata_filter, refresh, target, documents=None):
+        async def events():
+            try:
+                async for event, payload in astream_query(store_names, query, metadata_filter, refresh):
+                    if event == 'delta':
+                        yield sse_event('delta', {"text": payload})
+                        continue
+
+                    done = {
+                        "query": query,
+                        "response_text": payload["response_text"],
+                        "grounding_chunks": payload["grounding_chunks"],
+                        **target,
+                        "cache": payload["cache"],
+                    }
+                    if documents is not None:
+                        done["sources"] = attribute_sources(documents, payload)
+                    yield sse_event('done', done)
+            except GeminiUnavailable as e:
+                yield sse_event('error', {
+                    settings.REST_FRAMEWORK['NON_FIELD_ERRORS_KEY']: [ErrorMessage.SERVICE_UNAVAILABLE.value],
+                    'retry_after': int(retry_after_header(e)),
+                })
+            except Exception as e:
+                logger.exception('Error streaming query')
+                yield sse_event('error', {settings.REST_FRAMEWORK['NON_FIELD_ERRORS_KEY']: [str(e)]})
+
+        response = StreamingHttpResponse(events(), content_type='text/event-stream')
+        response['Cache-Control'] = 'no-cache'
+        # Let proxies (nginx) pass events through as they are produced
+        response['X-Accel-Buffering'] = 'no'
+        return response
+
+
+class FileSearchStoreListView(AsyncAPIView):
     permission_classes = [IsUser]
     serializer_class = FileSearchStoreListDisplaySerializer
 
@@ -256,30 +751,48 @@ class FileSearchStoreListView(ListAPIView):
             openapi.Parameter('title', openapi.IN_QUERY, type=openapi.TYPE_STRING, description='Filter by title'),
         ]
     )
-    def get(self, request, *args, **kwargs):
-        return self.list(request, *args, **kwargs)
+    async def get(self, request, *args, **kwargs):
+        return await sync_to_async(self.list_page)()
 
+    def list_page(self):
+        # The paginator counts and slices with the sync ORM
+        page = self.paginate_queryset(self.get_queryset())
+        serializer = self.get_serializer(page, many=True)
+        return self.get_paginated_response(serializer.data)
 
-class FileSearchStoreDetailView(GenericAPIView):
+
+class FileSearchStoreDetailView(AsyncAPIView):
     permission_classes = [IsUser]
     serializer_class = FileSearchStoreSerializer
 
-    def get_object(self, pk):
-        file_search_store = FileSearchStore.objects.filter(id=pk, user_id=self.request.user.id, is_active=True).order_by('-created')
+    async def get_object(self, pk):
+        return await FileSearchStore.objects.filter(
+            id=pk, user_id=self.request.user.id, is_active=True
+        ).order_by('-created').afirst()
 
-        if not file_search_store:
-            return None
+    async def get(self, request, pk):
 
-        return file_search_store.first()
+        file_search_store = await self.get_object(pk)
+        if not file_search_store:
+            return get_response_schema(
+                {},
+                ErrorMessage.NOT_FOUND.value,
+                status.HTTP_404_NOT_FOUND
+            )
+        serializer = self.get_serializer(file_search_store)
+        return get_response_schema(serializer.data, SuccessMessage.RECORD_RETRIEVED.value, status.HTTP_200_OK)
 
-    def get(self, request, pk):
+    async def delete(self, request, pk):
 
-        file_search_store = self.get_object(pk)
+        file_search_store = await self.get_object(pk)
         if not file_search_store:
             return get_response_schema(
                 {},
                 ErrorMessage.NOT_FOUND.value,
                 status.HTTP_404_NOT_FOUND
             )
-        serializer = self.get_serializer(file_search_store)
-        return get_response_schema(serializer.data, SuccessMessage.RECORD_RETRIEVED.value, status.HTTP_200_OK)
\ No newline at end of file
+
+        # Soft delete; the remote store is removed once no other document shares it
+        await sync_to_async(release_document)(file_search_store)
+
+        return get_response_schema({}, SuccessMessage.RECORD_DELETED.value, status.HTTP_204_NO_CONTENT)
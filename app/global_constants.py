@@ -6,6 +6,9 @@ class SuccessMessage(str, Enum):
     RECORD_RETRIEVED = "Record retrieved successfully."
     RECORD_UPDATED = "Record updated successfully."
     RECORD_DELETED = "Record deleted successfully."
+    DOCUMENT_QUEUED = "Document queued for processing."
+    SERVICE_HEALTHY = "Service is healthy."
+    BATCH_PARTIALLY_RETRIEVED = "Some queries of the batch failed."
 
     CREDENTIALS_MATCHED = "Login successful."
     CREDENTIALS_REMOVED = "Logout successful."
@@ -26,6 +29,14 @@ class ErrorMessage(str, Enum):
     PDF_FILE_REQUIRED = "PDF file is required."
     DOCUMENT_NOT_READY = "No ready document found. Upload and wait for processing."
     DOCUMENT_NO_STORE = "Document is not yet associated with a remote store"
+    UPLOAD_OFFSET_REQUIRED = "Upload-Offset or Content-Range header is required."
+    UPLOAD_OFFSET_MISMATCH = "Upload offset does not match the offset stored on the server."
+    UPLOAD_TOO_LARGE = "Upload exceeds the declared or allowed size."
+    UPLOAD_INCOMPLETE = "Upload is not complete yet."
+    UPLOAD_IN_PROGRESS = "Another chunk of this upload is still being written."
+    SERVICE_UNAVAILABLE = "Service temporarily unavailable, please try again later."
+    QUERY_TIMEOUT = "An identical query is still running, please try again shortly."
+    QUERY_TARGET_CONFLICT = "Send only one of document_id, document_ids and all_documents."
 
 class GlobalValues(int, Enum):
 
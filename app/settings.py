@@ -9,6 +9,7 @@ https://docs.djangoproject.com/en/5.0/topics/settings/
 For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.0/ref/settings/
 """
+import json
 import os
 from datetime import timedelta
 
@@ -59,6 +60,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    # First, so it times the whole middleware stack
+    'app.core.middleware.RequestMetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -141,6 +144,141 @@ STATIC_URL = 'static/'
 MEDIA_URL = '/media/'
 MEDIA_ROOT = BASE_DIR / 'media'
 
+# Upload handlers compute a SHA-256 of each file while it is written (used for deduplication)
+FILE_UPLOAD_HANDLERS = [
+    'app.filesearch.upload_handlers.HashingMemoryFileUploadHandler',
+    'app.filesearch.upload_handlers.HashingTemporaryFileUploadHandler',
+]
+
+# File search backend behind GeminiClientWrapper:
+#   'app.filesearch.backends.gemini.GeminiBackend' - Google Gemini File Search
+#   'app.filesearch.backends.fake.FakeBackend'     - offline fake with configurable latency and faults
+#   'app.filesearch.backends.local.LocalBackend'   - local BM25 retrieval under MEDIA_ROOT, generation only remote
+FILESEARCH_BACKEND = os.getenv('FILESEARCH_BACKEND', 'app.filesearch.backends.gemini.GeminiBackend')
+# Overrides of app.filesearch.backends.fake.DEFAULT_CONFIG, e.g.
+# {"latency": {"query_store": {"median_ms": 900}}, "error_rates": {"429": 0.02}}
+FAKE_FILESEARCH_BACKEND = json.loads(os.getenv('FAKE_FILESEARCH_BACKEND', '{}'))
+
+# Local retrieval backend
+LOCAL_FILESEARCH_INDEX_DIR = 'filesearch/index'  # relative to MEDIA_ROOT
+LOCAL_FILESEARCH_GENERATOR = os.getenv('LOCAL_FILESEARCH_GENERATOR', 'app.filesearch.backends.gemini.GeminiBackend')
+LOCAL_RETRIEVAL_TOP_K = int(os.getenv('LOCAL_RETRIEVAL_TOP_K', 5))
+LOCAL_RETRIEVAL_CHUNK_WORDS = int(os.getenv('LOCAL_RETRIEVAL_CHUNK_WORDS', 200))
+LOCAL_RETRIEVAL_CHUNK_OVERLAP_WORDS = int(os.getenv('LOCAL_RETRIEVAL_CHUNK_OVERLAP_WORDS', 40))
+# Dense retrieval: chunk embeddings in a memory-mapped .npy per document ('' disables the vector index)
+LOCAL_EMBEDDER = os.getenv('LOCAL_EMBEDDER', 'app.filesearch.retrieval.vectors.HashingEmbedder')
+LOCAL_EMBEDDING_BATCH_SIZE = int(os.getenv('LOCAL_EMBEDDING_BATCH_SIZE', 64))
+LOCAL_RETRIEVAL_MODE = os.getenv('LOCAL_RETRIEVAL_MODE', 'hybrid')  # bm25 | vector | hybrid
+# Hybrid: each search returns top_k * factor candidates, fused with RRF(k) then reranked on term coverage
+LOCAL_HYBRID_CANDIDATE_FACTOR = int(os.getenv('LOCAL_HYBRID_CANDIDATE_FACTOR', 4))
+LOCAL_RRF_K = int(os.getenv('LOCAL_RRF_K', 60))
+LOCAL_RERANK_WEIGHT = float(os.getenv('LOCAL_RERANK_WEIGHT', 0.5))
+# Approximate tokens of retrieved context sent to generation (0 = only LOCAL_RETRIEVAL_TOP_K applies)
+LOCAL_RETRIEVAL_TOKEN_BUDGET = int(os.getenv('LOCAL_RETRIEVAL_TOKEN_BUDGET', 1500))
+# PDF extraction fans page ranges out to a per-process pool; small documents are extracted inline
+LOCAL_EXTRACTION_WORKERS = int(os.getenv('LOCAL_EXTRACTION_WORKERS', max((os.cpu_count() or 1) - 1, 1)))
+LOCAL_EXTRACTION_PAGES_PER_TASK = int(os.getenv('LOCAL_EXTRACTION_PAGES_PER_TASK', 25))
+
+# Gemini client (one pooled client per process, see app.filesearch.gemini_client.get_client)
+GEMINI_MODEL = os.getenv('GEMINI_MODEL', 'gemini-2.5-flash')
+GEMINI_HTTP_TIMEOUT_MS = int(os.getenv('GEMINI_HTTP_TIMEOUT_MS', 60000))
+GEMINI_HTTP_MAX_CONNECTIONS = int(os.getenv('GEMINI_HTTP_MAX_CONNECTIONS', 100))
+GEMINI_HTTP_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv('GEMINI_HTTP_MAX_KEEPALIVE_CONNECTIONS', 20))
+GEMINI_HTTP_KEEPALIVE_EXPIRY = float(os.getenv('GEMINI_HTTP_KEEPALIVE_EXPIRY', 120))  # seconds
+GEMINI_WARMUP_ON_START = os.getenv('GEMINI_WARMUP_ON_START', 'True') == 'True'
+GEMINI_HEALTH_CHECK_TTL = float(os.getenv('GEMINI_HEALTH_CHECK_TTL', 10))  # seconds
+
+# Bulkhead around Gemini calls (per process). The circuit breaker opens when GEMINI_BREAKER_FAILURE_RATE of the last
+# GEMINI_BREAKER_WINDOW calls failed with 429/5xx/timeouts, fails calls fast for GEMINI_BREAKER_OPEN_SECONDS, then
+# lets GEMINI_BREAKER_HALF_OPEN_CALLS probes through. Each call class (queries, uploads, operation polls, store
+# management) has its own concurrency limit, which adapts (AIMD) to latency and errors.
+GEMINI_BREAKER_ENABLED = os.getenv('GEMINI_BREAKER_ENABLED', 'True') == 'True'
+GEMINI_BREAKER_WINDOW = int(os.getenv('GEMINI_BREAKER_WINDOW', 20))  # calls
+GEMINI_BREAKER_MIN_CALLS = int(os.getenv('GEMINI_BREAKER_MIN_CALLS', 10))
+GEMINI_BREAKER_FAILURE_RATE = float(os.getenv('GEMINI_BREAKER_FAILURE_RATE', 0.5))
+GEMINI_BREAKER_OPEN_SECONDS = float(os.getenv('GEMINI_BREAKER_OPEN_SECONDS', 30))
+GEMINI_BREAKER_HALF_OPEN_CALLS = int(os.getenv('GEMINI_BREAKER_HALF_OPEN_CALLS', 3))
+GEMINI_LIMITER_ENABLED = os.getenv('GEMINI_LIMITER_ENABLED', 'True') == 'True'
+GEMINI_LIMITER_INITIAL = int(os.getenv('GEMINI_LIMITER_INITIAL', 20))  # concurrent calls
+GEMINI_LIMITER_MIN = int(os.getenv('GEMINI_LIMITER_MIN', 2))
+GEMINI_LIMITER_MAX = int(os.getenv('GEMINI_LIMITER_MAX', 200))
+GEMINI_LIMITER_QUEUE_TIMEOUT = float(os.getenv('GEMINI_LIMITER_QUEUE_TIMEOUT', 2))  # seconds a call waits for a slot
+GEMINI_LIMITER_LATENCY_TOLERANCE = float(os.getenv('GEMINI_LIMITER_LATENCY_TOLERANCE', 2))  # x the median latency
+GEMINI_LIMITER_WINDOW = int(os.getenv('GEMINI_LIMITER_WINDOW', 20))  # calls at least between two decreases
+
+# Gemini quota shared by every worker through the RateLimitBucket table (0 = no limit). Queries reserve
+# GEMINI_RATE_LIMIT_QUERY_TOKENS up front and settle against the reported usage; ingestion calls can't use the last
+# GEMINI_RATE_LIMIT_BACKGROUND_RESERVE share of a bucket. A 429 halves the rate, which recovers over RECOVERY_SECONDS.
+GEMINI_RATE_LIMIT_RPM = int(os.getenv('GEMINI_RATE_LIMIT_RPM', 0))  # requests per minute
+GEMINI_RATE_LIMIT_TPM = int(os.getenv('GEMINI_RATE_LIMIT_TPM', 0))  # tokens per minute
+GEMINI_RATE_LIMIT_QUERY_TOKENS = int(os.getenv('GEMINI_RATE_LIMIT_QUERY_TOKENS', 4000))
+GEMINI_RATE_LIMIT_BACKGROUND_RESERVE = float(os.getenv('GEMINI_RATE_LIMIT_BACKGROUND_RESERVE', 0.3))
+GEMINI_RATE_LIMIT_MAX_WAIT = float(os.getenv('GEMINI_RATE_LIMIT_MAX_WAIT', 5))  # seconds a query waits for quota
+GEMINI_RATE_LIMIT_BACKGROUND_MAX_WAIT = float(os.getenv('GEMINI_RATE_LIMIT_BACKGROUND_MAX_WAIT', 60))
+GEMINI_RATE_LIMIT_RECOVERY_SECONDS = float(os.getenv('GEMINI_RATE_LIMIT_RECOVERY_SECONDS', 300))
+
+# Answer cache for /api/filesearch/query/ (in-process LRU, plus a shared tier if ANSWER_CACHE_SHARED_ALIAS
+# names an entry of CACHES, e.g. Redis; the shared tier also carries invalidations across processes)
+ANSWER_CACHE_ENABLED = os.getenv('ANSWER_CACHE_ENABLED', 'True') == 'True'
+ANSWER_CACHE_MAX_ENTRIES = int(os.getenv('ANSWER_CACHE_MAX_ENTRIES', 1024))
+ANSWER_CACHE_TTL = int(os.getenv('ANSWER_CACHE_TTL', 3600))  # seconds
+ANSWER_CACHE_SHARED_ALIAS = os.getenv('ANSWER_CACHE_SHARED_ALIAS', '')
+# Near-duplicate query cache (in-process): reuse an answer when a past question on the same store is this similar
+SEMANTIC_CACHE_ENABLED = os.getenv('SEMANTIC_CACHE_ENABLED', 'True') == 'True'
+SEMANTIC_CACHE_EMBEDDER = os.getenv('SEMANTIC_CACHE_EMBEDDER', 'app.filesearch.retrieval.vectors.HashingEmbedder')
+SEMANTIC_CACHE_THRESHOLD = float(os.getenv('SEMANTIC_CACHE_THRESHOLD', 0.9))  # cosine similarity
+SEMANTIC_CACHE_MAX_ENTRIES = int(os.getenv('SEMANTIC_CACHE_MAX_ENTRIES', 256))  # past queries per store scope
+SEMANTIC_CACHE_MAX_SCOPES = int(os.getenv('SEMANTIC_CACHE_MAX_SCOPES', 512))
+
+# Single-flight: identical concurrent queries wait for the first one's answer instead of calling Gemini again.
+# Cross-process coalescing uses the QueryLock table and reads the result from the shared answer cache tier.
+SINGLE_FLIGHT_ENABLED = os.getenv('SINGLE_FLIGHT_ENABLED', 'True') == 'True'
+SINGLE_FLIGHT_TIMEOUT = float(os.getenv('SINGLE_FLIGHT_TIMEOUT', 60))  # seconds a duplicate waits
+SINGLE_FLIGHT_CROSS_PROCESS = os.getenv('SINGLE_FLIGHT_CROSS_PROCESS', 'False') == 'True'
+SINGLE_FLIGHT_POLL_INTERVAL = float(os.getenv('SINGLE_FLIGHT_POLL_INTERVAL', 0.1))
+
+# Batch queries (POST /api/filesearch/query/batch/): questions per request and how many run at once
+BATCH_QUERY_MAX_QUESTIONS = int(os.getenv('BATCH_QUERY_MAX_QUESTIONS', 100))
+BATCH_QUERY_CONCURRENCY = int(os.getenv('BATCH_QUERY_CONCURRENCY', 8))
+
+# Remote store layout: 'per_document' creates one Gemini store per document, 'per_user' packs a user's
+# documents into a small pool of shared stores (queries filter by document metadata)
+FILESEARCH_STORE_MODE = os.getenv('FILESEARCH_STORE_MODE', 'per_document')
+FILESEARCH_USER_STORE_POOL_SIZE = int(os.getenv('FILESEARCH_USER_STORE_POOL_SIZE', 1))
+
+# Resumable uploads (POST /api/filesearch/uploads/)
+RESUMABLE_UPLOAD_MAX_SIZE = int(os.getenv('RESUMABLE_UPLOAD_MAX_SIZE', 2 * 1024 ** 3))  # bytes
+RESUMABLE_UPLOAD_EXPIRY = int(os.getenv('RESUMABLE_UPLOAD_EXPIRY', 24 * 60 * 60))  # seconds
+RESUMABLE_UPLOAD_READ_SIZE = 64 * 1024  # bytes copied per read from the request body
+
+# Ingestion worker (python manage.py ingestion_worker)
+INGESTION_WORKER_CONCURRENCY = int(os.getenv('INGESTION_WORKER_CONCURRENCY', 4))
+INGESTION_WORKER_POLL_INTERVAL = float(os.getenv('INGESTION_WORKER_POLL_INTERVAL', 2))
+INGESTION_JOB_MAX_ATTEMPTS = int(os.getenv('INGESTION_JOB_MAX_ATTEMPTS', 5))
+INGESTION_JOB_RETRY_BASE_DELAY = float(os.getenv('INGESTION_JOB_RETRY_BASE_DELAY', 10))  # seconds
+INGESTION_JOB_RETRY_MAX_DELAY = float(os.getenv('INGESTION_JOB_RETRY_MAX_DELAY', 600))  # seconds
+INGESTION_JOB_LEASE_TIMEOUT = int(os.getenv('INGESTION_JOB_LEASE_TIMEOUT', 900))  # seconds
+# Running jobs' leases are renewed this often, so only a dead worker's jobs expire
+INGESTION_JOB_HEARTBEAT_INTERVAL = float(os.getenv('INGESTION_JOB_HEARTBEAT_INTERVAL', 60))  # seconds
+
+# Upload operation poller (python manage.py poll_operations)
+OPERATION_POLLER_BATCH_SIZE = int(os.getenv('OPERATION_POLLER_BATCH_SIZE', 100))
+OPERATION_POLLER_CONCURRENCY = int(os.getenv('OPERATION_POLLER_CONCURRENCY', 8))
+OPERATION_POLL_BASE_DELAY = float(os.getenv('OPERATION_POLL_BASE_DELAY', 2))  # seconds
+OPERATION_POLL_MAX_DELAY = float(os.getenv('OPERATION_POLL_MAX_DELAY', 30))  # seconds
+OPERATION_POLL_TIMEOUT = int(os.getenv('OPERATION_POLL_TIMEOUT', 1800))  # seconds
+
+# Stage timings (GET /metrics/, Prometheus text format). Every process writes its histograms to METRICS_DIR
+# every METRICS_FLUSH_INTERVAL seconds; the endpoint merges them. METRICS_TOKEN, if set, is required as a Bearer token.
+METRICS_ENABLED = os.getenv('METRICS_ENABLED', 'True') == 'True'
+METRICS_DIR = os.getenv('METRICS_DIR', str(BASE_DIR / 'metrics'))
+METRICS_FLUSH_INTERVAL = float(os.getenv('METRICS_FLUSH_INTERVAL', 10))  # seconds
+METRICS_TOKEN = os.getenv('METRICS_TOKEN')
+# Per-endpoint latency percentiles (GET /api/metrics/latency/) over these windows (seconds), kept in slots of
+# REQUEST_METRICS_SLOT_SECONDS
+REQUEST_METRICS_WINDOWS = [int(window) for window in os.getenv('REQUEST_METRICS_WINDOWS', '60,300,900').split(',')]
+REQUEST_METRICS_SLOT_SECONDS = int(os.getenv('REQUEST_METRICS_SLOT_SECONDS', 15))
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.0/ref/settings/#default-auto-field
 
@@ -168,6 +306,9 @@ REST_FRAMEWORK = {
     'EXCEPTION_HANDLER': "app.exceptions.custom_exception_handler"
 }
 
+# Login attempts per client IP (raise it for load tests that log in from one machine)
+LOGIN_THROTTLE_RATE = os.getenv('LOGIN_THROTTLE_RATE', '100/hour')
+
 # Custom user model
 AUTH_USER_MODEL = 'user.User'
 
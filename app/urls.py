@@ -23,6 +23,8 @@ from drf_yasg import openapi
 from drf_yasg.views import get_schema_view
 from rest_framework import permissions
 
+from app.core.views import MetricsView, RequestLatencyView
+
 schema_view = get_schema_view(
     openapi.Info(
         title="Demo starter project",
@@ -43,6 +45,10 @@ urlpatterns = [
     # App URLs
     path('api/user/', include('app.user.urls')),
     path('api/filesearch/', include('app.filesearch.urls')),
+    path('api/metrics/latency/', RequestLatencyView.as_view(), name='metrics-latency'),
+
+    # Prometheus scrape endpoint
+    path('metrics/', MetricsView.as_view(), name='metrics'),
 ]
 
 if settings.DEBUG:
@@ -3,7 +3,9 @@ from datetime import time
 from django.contrib.auth.base_user import AbstractBaseUser, BaseUserManager
 from django.contrib.auth.models import PermissionsMixin
 from django.core.validators import FileExtensionValidator
+from django.contrib.postgres.indexes import OpClass
 from django.db import models
+from django.db.models.functions import Upper
 from django.utils import timezone
 
 from app.role.models import Role
@@ -52,6 +54,12 @@ class User(AbstractBaseUser, PermissionsMixin):
     # Use custom manager
     objects = UserManager()
 
-
-
-
+    class Meta:
+        indexes = [
+            # Superadmin user list: by role, last updated first
+            models.Index(fields=['role', '-updated'], name='user_role_updated_idx'),
+            # User list filters (istartswith compares UPPER(column) with LIKE 'X%')
+            models.Index(OpClass(Upper('email'), name='text_pattern_ops'), name='user_email_prefix_idx'),
+            models.Index(OpClass(Upper('first_name'), name='text_pattern_ops'), name='user_first_name_prefix_idx'),
+            models.Index(OpClass(Upper('last_name'), name='text_pattern_ops'), name='user_last_name_prefix_idx'),
+        ]
@@ -1,3 +1,25 @@
-from django.test import TestCase
+from django.contrib.auth import get_user_model
+from django.urls import reverse
+from rest_framework.test import APITestCase
 
-# Create your tests here.
+from app.global_constants import GlobalValues
+from app.role.models import Role
+
+
+class UserLoginTests(APITestCase):
+
+    def setUp(self):
+        role = Role.objects.create(id=GlobalValues.USER.value, name='User')
+        get_user_model().objects.create_user('reader@example.com', 'secret', first_name='Test', last_name='Reader',
+                                             role=role)
+
+    def test_login_returns_tokens(self):
+        response = self.client.post(reverse('user-login'), {'email': 'reader@example.com', 'password': 'secret'})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('access', response.data['results'])
+
+    def test_login_matches_the_exact_email(self):
+        response = self.client.post(reverse('user-login'), {'email': 'Reader@example.com', 'password': 'secret'})
+
+        self.assertEqual(response.status_code, 404)
@@ -92,7 +92,7 @@ class UserSetupView(GenericAPIView):
 
 class UserLoginThrottle(AnonRateThrottle):
     """Custom throttle for login endpoint"""
-    rate = '100/hour'
+    rate = settings.LOGIN_THROTTLE_RATE
 
 
 class UserLogin(GenericAPIView):
@@ -123,6 +123,7 @@ class UserLogin(GenericAPIView):
                     status.HTTP_400_BAD_REQUEST
                 )
 
+            # Exact match, served by the unique index on email
             user = get_user_model().objects.filter(email=email, is_active=True).first()
 
             if user is None: